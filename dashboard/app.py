@@ -8,36 +8,52 @@ if "postgres" in st.secrets:
     os.environ["PGPASSWORD"] = pg["password"]
     os.environ["PGSSLMODE"] = pg.get("sslmode", "require")
 from utils import (
-    load_properties,
-    load_properties_with_predictions,
-    apply_filters,
-    kpi,
+    data_version,
     sidebar_filters,
+    query_filter_bounds,
+    query_kpis,
+    query_price_histogram,
+    query_rooms_distribution,
+    table_preview_sql,
+    load_aggregates,
+    select_aggregates,
+    only_type_filter,
+    query_analytics,
+    query_scatter,
+    query_residuals_by_type,
+    query_deal_property_types,
+    SURFACE_RANGE,
+    PRICE_RANGE,
+    plot_price_distribution,
+    plot_rooms_distribution,
     plot_city_medians,
-    plot_price_per_sqm_violin,
+    plot_price_per_sqm_box,
     plot_price_by_rooms,
     render_map_properties,
-    table_preview,
-    plot_price_distribution,
+    map_view_controls,
     plot_price_vs_surface,
-    plot_rooms_distribution,
     plot_real_vs_pred,
     plot_deals_map,
     plot_residuals_by_type,
     plot_confidence_vs_error,
+    scatter_with_details,
+    deals_table,
 )
+from profiler import start_run, section, finish_run, payload_size
 
 
 st.set_page_config(page_title="Immo — Starter", layout="wide")
+start_run() # temps par section (voir profiler.py, détail avec ?debug=1)
 
-df = load_properties()
-df2 = load_properties_with_predictions()
+# une seule sonde de version par rerun : clé de cache de toutes les requêtes, relancées seulement si de nouvelles données sont arrivées
+with section("data_version"):
+    version = data_version()
 
-selected_types, min_price, max_price, rooms_range, surface_range = sidebar_filters(df)
-
-st.title("Prédiction immobilière et données")
-f = apply_filters(
-    df,
+# bornes, KPI, aperçu, graphes et cartes calculés en SQL : aucune table complète n'est chargée en mémoire
+with section("sidebar_filters"):
+    bounds = query_filter_bounds(version)
+    selected_types, min_price, max_price, rooms_range, surface_range = sidebar_filters(bounds=bounds)
+filters = dict(
     selected_types=selected_types,
     min_price=min_price,
     max_price=max_price,
@@ -45,12 +61,20 @@ f = apply_filters(
     surface_range=surface_range
 )
 
+st.title("Prédiction immobilière et données")
+
+# graphes d'analyse lus dans les tables pré-agrégées (filtrées par type d'annonce)
+with section("load_aggregates"):
+    aggs = select_aggregates(load_aggregates(version), selected_types)
+    use_aggs = only_type_filter(filters, bounds)
+
 # KPI
-n, avg, med = kpi(f)
-c1, c2, c3 = st.columns(3)
-with c1: st.metric("Annonces", f"{n:,}")
-with c2: st.metric("Prix moyen", f"{avg:,.0f}")
-with c3: st.metric("Prix médian", f"{med:,.0f}")
+with section("kpis"):
+    n, avg, med = query_kpis(filters, version)
+    c1, c2, c3 = st.columns(3)
+    with c1: st.metric("Annonces", f"{n:,}")
+    with c2: st.metric("Prix moyen", f"{avg:,.0f}")
+    with c3: st.metric("Prix médian", f"{med:,.0f}")
 
 st.divider()
 tab, tab_pred = st.tabs(["Donnée brut", "Prédiction"])
@@ -58,49 +82,93 @@ tab, tab_pred = st.tabs(["Donnée brut", "Prédiction"])
 with tab:
     st.caption("Aperçu des données brut du résultat du scrapping effectué.")
     st.subheader("Aperçu")
-    table_preview(f, n=30)
+    with section("table_preview"):
+        table_preview_sql(filters, n=30, version=version)
 
     st.divider()
     st.subheader("Carte des annonces")
-    fig_map = render_map_properties(f)
-    if fig_map is not None:
-        st.plotly_chart(fig_map, use_container_width=True, config={"scrollZoom": True})
-    else:
-        st.info("Erreur carte.")
+    # agrégée en cellules côté serveur, points individuels seulement quand la vue contient peu d'annonces
+    top_cities = aggs["city_stats"].sort_values("n", ascending=False)["city"].drop_duplicates().head(50)
+    with section("map_properties") as s:
+        view = map_view_controls("map", top_cities, version)
+        deck = render_map_properties(filters, view, version)
+        s["bytes"] = payload_size(deck)
+        if deck is not None:
+            st.pydeck_chart(deck, use_container_width=True)
+        else:
+            st.info("Erreur carte.")
 
     st.divider()
     st.subheader("Graphes principaux")
 
-    fig1 = plot_price_distribution(f)
-    if fig1: st.plotly_chart(fig1, use_container_width=True)
-
-    fig2 = plot_price_vs_surface(f)
-    if fig2: st.plotly_chart(fig2, use_container_width=True)
-
-    fig4 = plot_rooms_distribution(f)
-    if fig4: st.plotly_chart(fig4, use_container_width=True)
+    with section("price_distribution") as s:
+        hist = aggs["price_histogram"] if use_aggs else query_price_histogram(filters, 50, version)
+        fig1 = plot_price_distribution(hist)
+        s["bytes"] = payload_size(fig1)
+        if fig1: st.plotly_chart(fig1, use_container_width=True)
+
+    with section("price_vs_surface") as s:
+        scatter = query_scatter("price_vs_surface", filters, x_range=SURFACE_RANGE, y_range=PRICE_RANGE, version=version)
+        s["rows"] = scatter[1]
+        fig2 = plot_price_vs_surface(scatter)
+        s["bytes"] = payload_size(fig2)
+        if fig2: scatter_with_details(fig2, "price_vs_surface")
+
+    with section("rooms_distribution") as s:
+        counts = aggs["rooms_counts"] if use_aggs else query_rooms_distribution(filters, version)
+        fig4 = plot_rooms_distribution(counts)
+        s["bytes"] = payload_size(fig4)
+        if fig4: st.plotly_chart(fig4, use_container_width=True)
 
     st.divider()
     st.subheader("Analyses avancées")
-    st.plotly_chart(plot_city_medians(f, 20), use_container_width=True)
-    st.plotly_chart(plot_price_per_sqm_violin(f), use_container_width=True)
-    st.plotly_chart(plot_price_by_rooms(f), use_container_width=True)
+    if use_aggs:
+        st.caption("Calculées sur l'ensemble des annonces des types sélectionnés (tables pré-agrégées).")
+    else:
+        st.caption("Calculées sur les annonces filtrées.")
+    with section("advanced_analytics") as s:
+        analytics = aggs if use_aggs else query_analytics(filters, version)
+        figs = [plot_city_medians(analytics["city_stats"], 20), plot_price_per_sqm_box(analytics["price_per_sqm"]), plot_price_by_rooms(analytics["rooms_box"])]
+        sizes = [payload_size(fig) for fig in figs if fig]
+        s["bytes"] = sum(sizes) if sizes and None not in sizes else None
+        for fig in figs:
+            if fig: st.plotly_chart(fig, use_container_width=True)
 
 # ML
 with tab_pred:
     st.caption("Aperçu des performances du modèle et des bonnes affaires potentielles.")
-    fig_rvp = plot_real_vs_pred(df2)
-    if fig_rvp:
-        st.plotly_chart(fig_rvp, use_container_width=True)
-
-    fig_res_type = plot_residuals_by_type(df2)
-    if fig_res_type:
-        st.plotly_chart(fig_res_type, use_container_width=True)
-
-    fig_conf_err = plot_confidence_vs_error(df2)
-    if fig_conf_err:
-        st.plotly_chart(fig_conf_err, use_container_width=True)
-
-    fig_deals = plot_deals_map(df2, threshold=0.8)
-    if fig_deals:
-        st.plotly_chart(fig_deals, use_container_width=True, config={"scrollZoom": True})
+    with section("real_vs_pred") as s:
+        scatter = query_scatter("real_vs_pred", version=version)
+        s["rows"] = scatter[1]
+        fig_rvp = plot_real_vs_pred(scatter)
+        s["bytes"] = payload_size(fig_rvp)
+        if fig_rvp:
+            scatter_with_details(fig_rvp, "real_vs_pred")
+
+    with section("residuals_by_type") as s:
+        fig_res_type = plot_residuals_by_type(query_residuals_by_type(version))
+        s["bytes"] = payload_size(fig_res_type)
+        if fig_res_type:
+            st.plotly_chart(fig_res_type, use_container_width=True)
+
+    with section("confidence_vs_error") as s:
+        scatter = query_scatter("confidence_vs_error", version=version)
+        s["rows"] = scatter[1]
+        fig_conf_err = plot_confidence_vs_error(scatter)
+        s["bytes"] = payload_size(fig_conf_err)
+        if fig_conf_err:
+            scatter_with_details(fig_conf_err, "confidence_vs_error")
+
+    st.subheader("Meilleures affaires (prix sous la prédiction, pondéré par la confiance)")
+    with section("top_deals"):
+        deals_table(top_cities, query_deal_property_types(version), version)
+
+    st.subheader("Carte des bonnes affaires détectées (prix < prédiction)")
+    with section("deals_map") as s:
+        deals_view = map_view_controls("deals", top_cities, version)
+        deck_deals = plot_deals_map(deals_view, threshold=0.8, version=version)
+        s["bytes"] = payload_size(deck_deals)
+        if deck_deals is not None:
+            st.pydeck_chart(deck_deals, use_container_width=True)
+
+finish_run()
@@ -0,0 +1,103 @@
+import os, json, time, threading, uuid
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+
+# Mesures de rendu du dashboard : temps par section, lignes lues en SQL, taille des payloads envoyés au navigateur, cache touché ou non.
+# Une ligne JSON par rerun est ajoutée à PROFILE_LOG (agrégeable avec pandas.read_json(..., lines=True)) ;
+# le détail du rerun s'affiche en bas de page avec ?debug=1 dans l'URL.
+PROFILE_LOG = os.getenv("DASHBOARD_PROFILE_LOG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profile_log.jsonl"))
+
+_local = threading.local() # un thread de script par session Streamlit : chaque rerun a ses propres mesures
+_log_lock = threading.Lock()
+
+def debug_enabled():
+    return st.query_params.get("debug") == "1"
+
+# À appeler en tout début de script
+def start_run():
+    _local.run = {"t0": time.perf_counter(), "sections": [], "stack": []}
+    _local.detailed = debug_enabled()
+
+def _current_run():
+    return getattr(_local, "run", None)
+
+# Chronomètre une section ; rec["rows"] / rec["bytes"] peuvent être remplis par l'appelant.
+# cache = "miss" si la section a exécuté au moins une requête SQL, "hit" sinon (tout est venu des caches Streamlit)
+@contextmanager
+def section(name):
+    rec = {"section": name, "ms": None, "rows": None, "bytes": None, "queries": 0, "sql_rows": 0, "cache": None}
+    run = _current_run()
+    t0 = time.perf_counter()
+    if run is not None:
+        run["stack"].append((rec, t0))
+    try:
+        yield rec
+    finally:
+        _close(rec, t0)
+        if run is not None and (rec, t0) in run["stack"]: # absente si le rerun a déjà été journalisé (rerun())
+            run["stack"].remove((rec, t0))
+            run["sections"].append(rec)
+
+def _close(rec, t0):
+    rec["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    rec["cache"] = "miss" if rec["queries"] else "hit"
+
+# Appelé par chaque lecture SQL : compté dans toutes les sections ouvertes (imbriquées comprises)
+def note_query(rows):
+    run = _current_run()
+    if run is None:
+        return
+    for rec, _ in run["stack"]:
+        rec["queries"] += 1
+        rec["sql_rows"] += int(rows)
+
+# Taille sérialisée d'une figure plotly / carte pydeck / DataFrame (toujours mesurée : le log sert à suivre les payloads dans le temps)
+def payload_size(obj):
+    if obj is None:
+        return None
+    try:
+        if isinstance(obj, pd.DataFrame):
+            return int(obj.memory_usage(deep=True).sum())
+        return len(obj.to_json())
+    except Exception:
+        return None
+
+def _session_id():
+    if "profile_session" not in st.session_state:
+        st.session_state["profile_session"] = uuid.uuid4().hex[:8]
+    return st.session_state["profile_session"]
+
+# À appeler en fin de script : ajoute le rerun au log local et affiche le panneau de debug si ?debug=1
+# (interrupted=True : rerun demandé en cours de script, les sections encore ouvertes sont journalisées avec leur durée jusque-là)
+def finish_run(interrupted=False):
+    run = _current_run()
+    if run is None:
+        return
+    while run["stack"]:
+        rec, t0 = run["stack"].pop()
+        _close(rec, t0)
+        run["sections"].append(rec)
+    total_ms = round((time.perf_counter() - run["t0"]) * 1000, 1)
+    entry = {"ts": datetime.utcnow().isoformat(timespec="seconds"), "session": _session_id(), "total_ms": total_ms, "sections": run["sections"]}
+    if interrupted:
+        entry["interrupted"] = True
+    try:
+        with _log_lock, open(PROFILE_LOG, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(entry, default=str) + "\n")
+    except OSError as e:
+        print(f"Erreur écriture du profil : {e}")
+
+    if getattr(_local, "detailed", False) and not interrupted:
+        with st.expander(f"Profilage du rendu : {total_ms:,.0f} ms", expanded=True):
+            prof = pd.DataFrame(run["sections"])
+            if not prof.empty:
+                st.dataframe(prof.sort_values("ms", ascending=False), use_container_width=True, hide_index=True)
+            st.caption(f"Log : {PROFILE_LOG}")
+    _local.run = None
+
+# À utiliser à la place de st.rerun() dans le script : st.rerun() interrompt le script avant finish_run, le rerun serait perdu
+def rerun():
+    finish_run(interrupted=True)
+    st.rerun()
@@ -1,84 +1,235 @@
 import os, sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import plotly.express as px
+import plotly.graph_objects as go
+import pydeck as pdk
 import numpy as np
 import pandas as pd
 from database.connection import get_connection
+from database.deals import top_deals
+from profiler import note_query, rerun
 import streamlit as st
 
 # --- DATA ---
-@st.cache_data()
-def load_properties():
-    conn = get_connection()
-    if conn is None:
-        st.error("Connexion PostgreSQL impossible.")
-        st.stop()
-    q = """
-        SELECT id, title, address, price::float AS price, rooms, property_type, latitude, longitude,
-               listing_type, scraped_at, url, surface::float AS surface
-        FROM public.properties
-    """
-    try:
-        return pd.read_sql(q, conn)
-    finally:
-        try: conn.close()
-        except: pass
+# Le dashboard lit toujours la base (PostgreSQL, ou SQLite avec DB_BACKEND=sqlite) : les graphes et la carte sont calculés en SQL,
+# l'instantané Parquet (DATA_SOURCE=snapshot) ne sert qu'à l'entraînement
+
+TYPE_COLORS = {"rent": "red", "sale": "blue"}
 
-# Renvoie un dataframe réunissant les données scrappés et les prédictions de l'algo avec l'autre table
-def load_properties_with_predictions():
+def _read_sql(q, params=None):
     conn = get_connection()
     if conn is None:
         st.error("Connexion PostgreSQL impossible.")
         st.stop()
-    q = """
-        SELECT p.id, p.title, p.address, p.price::float AS price, p.rooms, p.property_type, p.latitude, p.longitude,
-               p.listing_type, p.scraped_at, p.url, p.surface::float AS surface,
-               pr.predicted_price::float,
-               pr.confidence_score::float,
-               pr.created_at AS prediction_date
-        FROM public.properties p
-        JOIN public.price_predictions pr
-          ON p.id = pr.property_id
-    """
     try:
-        return pd.read_sql(q, conn)
+        df = pd.read_sql(q, conn, params=params)
+        note_query(len(df)) # compté dans la section en cours du profileur
+        return df
     finally:
         try: conn.close()
         except: pass
 
-# On filtre par type, prix, chambres et surface (si dispo)
-def apply_filters(df, selected_types, min_price, max_price, rooms_range=None, surface_range=None):
-    f = df.copy()
-    # Type
+# Les id (séquence) et les horodatages scraped_at / created_at sont pris AVANT le commit (24 threads du scraper, gros upserts) :
+# une ligne peut devenir visible après une ligne plus récente qu'elle et ne changer aucun max. La version compte donc aussi
+# les lignes d'une fenêtre de REREAD_LAG avant chaque max : une ligne commitée en retard invalide quand même les requêtes en cache.
+REREAD_LAG = pd.Timedelta(seconds=int(os.getenv("DASHBOARD_REREAD_LAG_S", 900)))
+
+def _lagged(ts):
+    return None if ts is None else (pd.Timestamp(ts) - REREAD_LAG).to_pydatetime()
+
+# Version des données : sondes très peu coûteuses (max et comptages sur des colonnes indexées), change dès qu'une annonce ou une prédiction
+# est écrite ou qu'une annonce est modifiée (updated_at : prix, coordonnées) -> (max id, max scraped_at, max created_at des prédictions,
+# nb d'annonces / de prédictions dans la fenêtre de relecture, max updated_at) ; sert de clé de cache à toutes les requêtes du dashboard
+def data_version():
+    v = _read_sql("""
+        SELECT (SELECT max(id) FROM public.properties) AS max_id,
+               (SELECT max(scraped_at) FROM public.properties) AS max_scraped_at,
+               (SELECT max(created_at) FROM public.price_predictions) AS max_prediction_at,
+               (SELECT max(updated_at) FROM public.properties) AS max_updated_at
+    """).iloc[0]
+    max_id, max_scraped, max_pred, max_updated = (None if pd.isna(x) else x for x in (v["max_id"], v["max_scraped_at"], v["max_prediction_at"], v["max_updated_at"]))
+    recent = _read_sql("""
+        SELECT (SELECT COUNT(*) FROM public.properties WHERE scraped_at > %s)
+               + (SELECT COUNT(*) FROM public.properties WHERE updated_at > %s) AS n_properties,
+               (SELECT COUNT(*) FROM public.price_predictions WHERE created_at > %s) AS n_predictions
+    """, params=[_lagged(max_scraped), _lagged(max_updated), _lagged(max_pred)]).iloc[0]
+    return (max_id, max_scraped, max_pred, int(recent["n_properties"]), int(recent["n_predictions"]), max_updated)
+
+# --- SQL : filtres, KPI et agrégats calculés directement dans PostgreSQL (index idx_properties_type_price & co, voir database/migrations/) ---
+
+# Traduit les filtres de la sidebar en clause WHERE paramétrée
+def build_filter_sql(selected_types, min_price, max_price, rooms_range=None, surface_range=None, alias=""):
+    c = f"{alias}." if alias else "" # préfixe de colonnes quand la requête fait une jointure
+    clauses, params = [f"{c}price IS NOT NULL"], []
     if selected_types and set(selected_types) != {"sale", "rent"}:
-        f = f[f["listing_type"].isin(selected_types)]
-        
-    # Prix
-    f = f[(f["price"] >= float(min_price)) & (f["price"] <= float(max_price))]
-
-    # Chambres
-    if rooms_range and "rooms" in f.columns:
-        rmin, rmax = rooms_range
-        f = f[(f["rooms"] >= rmin) & (f["rooms"] <= rmax)]
-
-    # Surface
-    if surface_range and "surface" in f.columns:
-        smin, smax = surface_range
-        f = f[(f["surface"] >= smin) & (f["surface"] <= smax)]
-
-    return f
-
-# KPI
-def kpi(df):
-    n = len(df)
-    if n == 0 or "price" not in df:
+        clauses.append(f"{c}listing_type = ANY(%s)")
+        params.append(list(selected_types))
+    clauses.append(f"{c}price BETWEEN %s AND %s")
+    params += [float(min_price), float(max_price)]
+    if rooms_range:
+        clauses.append(f"{c}rooms BETWEEN %s AND %s")
+        params += [int(rooms_range[0]), int(rooms_range[1])]
+    if surface_range:
+        clauses.append(f"{c}surface BETWEEN %s AND %s")
+        params += [float(surface_range[0]), float(surface_range[1])]
+    return " AND ".join(clauses), params
+
+# Bornes des filtres (min/max) lues dans la base ; version = data_version(), sert de clé de cache
+@st.cache_data(max_entries=8)
+def query_filter_bounds(version=None):
+    b = _read_sql("""
+        SELECT min(price)::float AS price_min, max(price)::float AS price_max,
+               min(rooms) AS rooms_min, max(rooms) AS rooms_max,
+               min(surface)::float AS surface_min, max(surface)::float AS surface_max
+        FROM public.properties
+        WHERE price IS NOT NULL
+    """).iloc[0]
+    return {k: (None if pd.isna(v) else v) for k, v in b.items()}
+
+# Bornes équivalentes calculées sur un DataFrame déjà chargé
+def frame_bounds(df):
+    return {
+        "price_min": df["price"].min(), "price_max": df["price"].max(),
+        "rooms_min": df["rooms"].min() if "rooms" in df else None, "rooms_max": df["rooms"].max() if "rooms" in df else None,
+        "surface_min": df["surface"].min() if "surface" in df else None, "surface_max": df["surface"].max() if "surface" in df else None,
+    }
+
+# Nombre d'annonces, prix moyen et médian des annonces filtrées (agrégat SQL, aucune ligne ne transite)
+@st.cache_data(max_entries=256)
+def query_kpis(filters, version=None):
+    where, params = build_filter_sql(**filters)
+    k = _read_sql(f"""
+        SELECT COUNT(*) AS n, AVG(price)::float AS avg,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY price)::float AS med
+        FROM public.properties
+        WHERE {where}
+    """, params=params).iloc[0]
+    if not k["n"]:
         return 0, 0.0, 0.0
-    avg = float(df["price"].mean())
-    med = float(df["price"].median())
-    return n, avg, med
+    return int(k["n"]), float(k["avg"]), float(k["med"])
+
+# Histogramme des prix calculé en base (width_bucket) -> nbins lignes au lieu de toutes les annonces
+@st.cache_data(max_entries=256)
+def query_price_histogram(filters, nbins=50, version=None):
+    where, params = build_filter_sql(**filters)
+    lo, hi = float(filters["min_price"]), float(filters["max_price"])
+    if hi <= lo:
+        hi = lo + 1.0
+    h = _read_sql(f"""
+        SELECT LEAST(width_bucket(price, %s, %s, %s), %s) AS bucket, COUNT(*) AS n
+        FROM public.properties
+        WHERE {where}
+        GROUP BY 1
+        ORDER BY 1
+    """, params=[lo, hi, nbins, nbins] + params)
+    width = (hi - lo) / nbins
+    h["price"] = lo + (h["bucket"] - 0.5) * width # centre du bucket
+    h["width"] = width
+    return h
+
+# Nombre d'annonces par nombre de chambres et type
+@st.cache_data(max_entries=256)
+def query_rooms_distribution(filters, version=None):
+    where, params = build_filter_sql(**filters)
+    return _read_sql(f"""
+        SELECT listing_type, rooms, COUNT(*) AS n
+        FROM public.properties
+        WHERE {where} AND rooms IS NOT NULL
+        GROUP BY listing_type, rooms
+        ORDER BY rooms
+    """, params=params)
+
+PAGE_COLUMNS = ["id", "title", "listing_type", "price", "rooms", "surface", "address", "url"]
+
+# Pagination par clé (keyset) triée par prix décroissant : after = (price, id) de la dernière ligne de la page précédente
+# -> coût constant quelle que soit la page (pas d'OFFSET), servi par l'index idx_properties_price_id
+def query_table_page(filters, n=30, after=None):
+    where, params = build_filter_sql(**filters)
+    if after is not None:
+        where += " AND (price, id) < (%s, %s)"
+        params += [float(after[0]), int(after[1])]
+    return _read_sql(f"""
+        SELECT id, title, listing_type, price::float AS price, rooms, surface::float AS surface, address, url
+        FROM public.properties
+        WHERE {where}
+        ORDER BY price DESC, id DESC
+        LIMIT %s
+    """, params=params + [int(n)])
+
+# --- Tables pré-agrégées (database/aggregates.py) : quelques centaines de lignes quelle que soit la taille de properties ---
+@st.cache_data(ttl=300, max_entries=4)
+def load_aggregates(version=None):
+    aggs = {
+        "city_stats": _read_sql("SELECT listing_type, city, n, median_price, mean_price, std_price FROM agg_city_stats"),
+        "price_per_sqm": _read_sql("SELECT listing_type, n, mean, p01, q1, median, q3, p99 FROM agg_price_per_sqm"),
+        "rooms_box": _read_sql("SELECT listing_type, rooms_bin, n, min_price, q1, median, q3, max_price FROM agg_rooms_box"),
+        "rooms_counts": _read_sql("SELECT listing_type, rooms, n FROM agg_rooms_counts ORDER BY rooms"),
+        "price_histogram": _read_sql("SELECT listing_type, bucket, price_lo, price_hi, n FROM agg_price_histogram ORDER BY listing_type, bucket"),
+    }
+    h = aggs["price_histogram"]
+    h["price"] = (h["price_lo"] + h["price_hi"]) / 2
+    h["width"] = h["price_hi"] - h["price_lo"]
+    return aggs
+
+# Ne garde que les types d'annonce sélectionnés dans chaque agrégat
+def select_aggregates(aggs, selected_types):
+    return {k: v[v["listing_type"].isin(selected_types)] for k, v in aggs.items()}
+
+# Mêmes tableaux que load_aggregates (city_stats, price_per_sqm, rooms_box) calculés en base sur les annonces filtrées :
+# utilisés quand un filtre prix / chambres / surface est actif, les tables pré-agrégées ne couvrant que les types entiers
+@st.cache_data(max_entries=64)
+def query_analytics(filters, version=None):
+    where, params = build_filter_sql(**filters)
+    city_stats = _read_sql(f"""
+        SELECT listing_type, city, COUNT(*) AS n,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY price) AS median_price,
+               AVG(price) AS mean_price, STDDEV_SAMP(price) AS std_price
+        FROM (
+            SELECT listing_type, trim(split_part(address, ',', 2)) AS city, price::float AS price
+            FROM public.properties
+            WHERE {where}
+        ) t
+        WHERE city <> ''
+        GROUP BY listing_type, city
+    """, params=params)
+    price_per_sqm = _read_sql(f"""
+        SELECT listing_type, n, mean, q[1] AS p01, q[2] AS q1, q[3] AS median, q[4] AS q3, q[5] AS p99
+        FROM (
+            SELECT listing_type, COUNT(*) AS n, AVG(price::float / surface::float) AS mean,
+                   percentile_cont(ARRAY[0.01, 0.25, 0.5, 0.75, 0.99]) WITHIN GROUP (ORDER BY price::float / surface::float) AS q
+            FROM public.properties
+            WHERE {where} AND surface > 10 AND surface < 10000
+            GROUP BY listing_type
+        ) t
+    """, params=params)
+    rooms_box = _read_sql(f"""
+        SELECT listing_type, rooms_bin, n, min_price, q[1] AS q1, q[2] AS median, q[3] AS q3, max_price
+        FROM (
+            SELECT listing_type, LEAST(GREATEST(rooms, 0), 6) AS rooms_bin, COUNT(*) AS n,
+                   MIN(price)::float AS min_price, MAX(price)::float AS max_price,
+                   percentile_cont(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY price::float) AS q
+            FROM public.properties
+            WHERE {where} AND rooms IS NOT NULL
+            GROUP BY 1, 2
+        ) t
+    """, params=params)
+    return {"city_stats": city_stats, "price_per_sqm": price_per_sqm, "rooms_box": rooms_box}
+
+# Vrai si seuls les types sont filtrés (prix/chambres/surface sur toute leur plage) -> les agrégats pré-calculés suffisent
+def only_type_filter(filters, bounds):
+    def full(rng, lo, hi):
+        return rng is None or lo is None or (rng[0] <= lo and rng[1] >= hi)
+    return (
+        full((filters["min_price"], filters["max_price"]), bounds["price_min"], bounds["price_max"])
+        and full(filters.get("rooms_range"), bounds["rooms_min"], bounds["rooms_max"])
+        and full(filters.get("surface_range"), bounds["surface_min"], bounds["surface_max"])
+    )
 
 # Sidebar
-def sidebar_filters(df):
+# bounds : bornes des filtres (query_filter_bounds), sinon calculées sur df
+def sidebar_filters(df=None, bounds=None):
+    if bounds is None:
+        bounds = frame_bounds(df)
     st.sidebar.header("Filtres")
     st.sidebar.subheader("Type d'annonce")
     sale_selected = st.sidebar.checkbox("Sale", value=True)
@@ -94,8 +245,8 @@ def sidebar_filters(df):
 
     # Prix
     st.sidebar.subheader("Gamme de prix")
-    pmin = int(df["price"].min())
-    pmax = int(df["price"].max())
+    pmin = int(bounds["price_min"] or 0)
+    pmax = int(bounds["price_max"] or 0)
 
     col1, col2 = st.sidebar.columns(2)
     with col1:
@@ -105,18 +256,18 @@ def sidebar_filters(df):
 
     # Chambres
     st.sidebar.subheader("Nombre de chambres")
-    if "rooms" in df:
-        rmin = int(df["rooms"].min())
-        rmax = int(df["rooms"].max())
+    if bounds.get("rooms_min") is not None:
+        rmin = int(bounds["rooms_min"])
+        rmax = int(bounds["rooms_max"])
     else:
         rmin, rmax = 0, 11
     rooms_min, rooms_max = st.sidebar.slider("Plage de chambres", min_value=rmin, max_value=rmax, value=(rmin, rmax))
 
     # Surface en m2
     st.sidebar.subheader("Surface (m²)")
-    if "surface" in df:
-        smin = int(df["surface"].min())
-        smax = int(df["surface"].max())
+    if bounds.get("surface_min") is not None:
+        smin = int(bounds["surface_min"])
+        smax = int(bounds["surface_max"])
     else:
         smin, smax = 0, 300
     surface_min, surface_max = st.sidebar.slider("Plage de surface (appuyer flèche du haut et bas pour ajuster précisement)", min_value=smin, max_value=smax, value=(smin, smax), step=10)
@@ -134,186 +285,465 @@ def table_preview(df, n):
     else:
         st.info("Aucune ligne après filtres.")
 
-def render_map_properties(df):
-    # on garde uniquement les annonces contenant des infos sur leur geoloc
-    m = df.dropna(subset=["latitude", "longitude"]).copy()
-    if m.empty:
+# Aperçu paginé côté SQL : on garde en session la pile des curseurs (price, id) pour naviguer page par page
+def table_preview_sql(filters, n, version=None):
+    key = repr((filters, version))
+    if st.session_state.get("page_key") != key: # filtres changés -> retour à la 1re page
+        st.session_state["page_key"] = key
+        st.session_state["page_cursors"] = [None]
+    cursors = st.session_state["page_cursors"]
+
+    page = query_table_page(filters, n=n, after=cursors[-1])
+    if page.empty:
+        st.info("Aucune ligne après filtres.")
+    else:
+        st.dataframe(page.drop(columns=["id"]), use_container_width=True)
+
+    c1, c2, c3 = st.columns([1, 1, 6])
+    with c1:
+        if st.button("Page précédente", disabled=len(cursors) == 1):
+            cursors.pop()
+            rerun()
+    with c2:
+        if st.button("Page suivante", disabled=len(page) < n):
+            last = page.iloc[-1]
+            cursors.append((last["price"], last["id"]))
+            rerun()
+    with c3:
+        st.caption(f"Page {len(cursors)}")
+
+# --- Cartes : agrégation spatiale côté serveur (cellules de grille dépendantes du zoom) rendue avec pydeck ---
+MAP_MAX_POINTS = 5000 # en dessous, on affiche les annonces une par une
+MAP_CELLS_PER_TILE = 8 # ~32 px par cellule
+
+# Emprise approximative de la vue (centre + zoom) pour une carte d'environ 1280 x 520 px ; None = monde entier
+def view_bbox(view):
+    if view["zoom"] <= 3:
         return None
+    half_lon = 180.0 / 2 ** view["zoom"] * 2.5
+    half_lat = half_lon * 0.5
+    return (view["lat"] - half_lat, view["lat"] + half_lat, view["lon"] - half_lon, view["lon"] + half_lon)
+
+def _map_where(where, params, view):
+    where += " AND p.latitude IS NOT NULL AND p.longitude IS NOT NULL"
+    bbox = view_bbox(view)
+    if bbox is not None:
+        where += " AND p.latitude BETWEEN %s AND %s AND p.longitude BETWEEN %s AND %s"
+        params = params + list(bbox)
+    return where, params
+
+# Source des cartes : toutes les annonces filtrées ("properties") ou les bonnes affaires ("deals", table deal_scores déjà calculée)
+def _map_source(kind, filters, threshold):
+    if kind == "deals":
+        return "deal_scores d JOIN public.properties p ON p.id = d.property_id", "d.underpricing > %s", [1 - threshold]
+    where, params = build_filter_sql(**filters, alias="p")
+    return "public.properties p", where, params
+
+# Points individuels si peu d'annonces dans la vue, sinon cellules (nb, prix médian, sous-évaluation médiane) : payload borné
+@st.cache_data(max_entries=128)
+def query_map_data(kind, filters, view, threshold=0.8, version=None):
+    source, where, params = _map_source(kind, filters, threshold)
+    where, params = _map_where(where, params, view)
+    underpricing = "d.underpricing" if kind == "deals" else "NULL::float"
+
+    n = int(_read_sql(f"SELECT COUNT(*) AS n FROM {source} WHERE {where}", params=params)["n"].iloc[0])
+    if n <= MAP_MAX_POINTS:
+        pts = _read_sql(f"""
+            SELECT p.id, p.title, p.address, p.price::float AS price, p.latitude::float AS lat, p.longitude::float AS lon,
+                   {underpricing} AS underpricing, 1 AS n
+            FROM {source} WHERE {where}
+        """, params=params)
+        return "points", pts, None
+
+    cell = 360.0 / 2 ** view["zoom"] / MAP_CELLS_PER_TILE
+    cells = _read_sql(f"""
+        SELECT floor(p.latitude / %s) * %s AS cell_lat, floor(p.longitude / %s) * %s AS cell_lon,
+               COUNT(*) AS n,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY p.price::float) AS median_price,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY {underpricing}) AS underpricing
+        FROM {source} WHERE {where}
+        GROUP BY 1, 2
+    """, params=[cell, cell, cell, cell] + params)
+    return "cells", cells, cell
+
+# Couleur (rouge -> jaune -> vert) d'une valeur normalisée entre P5 et P95
+def _color_columns(d, col):
+    v = pd.to_numeric(d[col], errors="coerce")
+    lo, hi = (v.quantile(0.05), v.quantile(0.95)) if v.notna().any() else (0.0, 1.0)
+    t = ((v - lo) / ((hi - lo) or 1.0)).clip(0, 1).fillna(0.5)
+    d["r"] = (255 * (1 - t).clip(0, 1) * 2).clip(0, 255).astype(int)
+    d["g"] = (255 * t * 2).clip(0, 255).astype(int)
+    d["b"] = 40
+    return d
+
+def _deck(mode, data, cell, view, color_col, tooltip):
+    data = _color_columns(data.copy(), color_col)
+    if mode == "points":
+        layer = pdk.Layer(
+            "ScatterplotLayer", data, get_position=["lon", "lat"], get_fill_color=["r", "g", "b", 180],
+            get_radius=60, radius_min_pixels=3, radius_max_pixels=12, pickable=True,
+        )
+    else:
+        meters = cell * 111_000 * max(np.cos(np.radians(view["lat"])), 0.2)
+        layer = pdk.Layer(
+            "GridCellLayer", data, get_position=["cell_lon", "cell_lat"], cell_size=meters,
+            get_fill_color=["r", "g", "b", 160], get_elevation="n", elevation_scale=0, pickable=True,
+        )
+    return pdk.Deck(
+        layers=[layer],
+        initial_view_state=pdk.ViewState(latitude=view["lat"], longitude=view["lon"], zoom=view["zoom"]),
+        tooltip=tooltip,
+    )
 
-    # types numériques
-    m["latitude"]  = pd.to_numeric(m["latitude"], errors="coerce")
-    m["longitude"] = pd.to_numeric(m["longitude"], errors="coerce")
-    m = m.dropna(subset=["latitude", "longitude"])
+# Contrôles de vue (zoom + centrage sur une ville) ; le centre par défaut est le barycentre des annonces géolocalisées
+def map_view_controls(key, cities=(), version=None):
+    c1, c2 = st.columns([1, 2])
+    with c1:
+        zoom = st.slider("Zoom", min_value=2, max_value=14, value=3, key=f"{key}_zoom")
+    with c2:
+        city = st.selectbox("Centrer sur", ["(toutes)"] + list(cities), key=f"{key}_city")
+    lat, lon = query_map_center(None if city == "(toutes)" else city, version)
+    return {"zoom": zoom, "lat": lat, "lon": lon}
+
+@st.cache_data(max_entries=64)
+def query_map_center(city=None, version=None):
+    where, params = "latitude IS NOT NULL AND longitude IS NOT NULL", []
+    if city:
+        where += " AND trim(split_part(address, ',', 2)) = %s"
+        params.append(city)
+    c = _read_sql(f"SELECT AVG(latitude)::float AS lat, AVG(longitude)::float AS lon FROM public.properties WHERE {where}", params=params).iloc[0]
+    if pd.isna(c["lat"]):
+        return 45.0, -75.0
+    return float(c["lat"]), float(c["lon"])
+
+# Carte des annonces filtrées : prix (couleur) par annonce ou médiane par cellule
+def render_map_properties(filters, view, version=None):
+    mode, data, cell = query_map_data("properties", filters, view, version=version)
+    if data.empty:
+        return None
+    if mode == "points":
+        tooltip = {"html": "{address}<br/><b>{price}</b>"}
+        return _deck(mode, data, cell, view, "price", tooltip)
+    tooltip = {"html": "<b>{n}</b> annonces<br/>prix médian {median_price}"}
+    return _deck(mode, data, cell, view, "median_price", tooltip)
+
+# Histogramme des prix à partir de buckets déjà comptés (agg_price_histogram ou query_price_histogram) : colonnes price (centre), width, n
+def plot_price_distribution(hist):
+    if hist is None or hist.empty:
+        return None
+    fig = go.Figure()
+    groups = hist.groupby("listing_type") if "listing_type" in hist else [(None, hist)]
+    for lt, h in groups:
+        fig.add_bar(x=h["price"], y=h["n"], width=h["width"], name=lt, marker_color=TYPE_COLORS.get(lt))
+    fig.update_layout(title="Distribution des prix", barmode="overlay", bargap=0, xaxis_title="price", yaxis_title="count", showlegend=hist.get("listing_type") is not None)
+    return fig
 
-    # prix (couleur) - cap à P95
-    m["price_num"] = pd.to_numeric(m.get("price"), errors="coerce").fillna(0.0)
-    if m["price_num"].notna().any():
-        p95 = np.nanpercentile(m["price_num"], 95)
-        m["price_cap"] = np.clip(m["price_num"], 0, p95 if p95 > 0 else 1.0)
-    else:
-        m["price_cap"] = 0.0
+# --- Nuages de points volumineux : échantillon stratifié (outliers conservés) ou heatmap 2D, détails chargés au clic ---
+SCATTER_MAX_POINTS = int(os.getenv("DASHBOARD_MAX_POINTS", 5000)) # au-delà, on n'envoie plus tous les points au navigateur
+DENSITY_FACTOR = 10 # au-delà de SCATTER_MAX_POINTS * DENSITY_FACTOR lignes, heatmap de densité au lieu d'un échantillon
+
+def scatter_mode(n, max_points=SCATTER_MAX_POINTS):
+    if n <= max_points:
+        return "full"
+    return "sample" if n <= max_points * DENSITY_FACTOR else "density"
+
+# Échantillon d'environ max_points lignes qui respecte la densité : même taux de tirage dans chaque case d'une grille bins x bins
+# (par groupe `by`, arrondi aléatoire non biaisé), et les points hors des quantiles [tail, 1-tail] conservés (10% du budget au plus)
+def downsample_points(df, x, y, max_points=SCATTER_MAX_POINTS, by=None, bins=40, tail=0.001, outlier_share=0.1, seed=0):
+    df = df.dropna(subset=[x, y])
+    if len(df) <= max_points:
+        return df
+    xv, yv = df[x].to_numpy(dtype=float), df[y].to_numpy(dtype=float)
+    (xlo, xhi), (ylo, yhi) = np.quantile(xv, [tail, 1 - tail]), np.quantile(yv, [tail, 1 - tail])
+    outlier = (xv < xlo) | (xv > xhi) | (yv < ylo) | (yv > yhi)
+    rng = np.random.default_rng(seed)
+
+    # les extrêmes de chaque axe sont toujours gardés, le reste des outliers est tiré dans sa part du budget
+    extremes = np.unique([xv.argmin(), xv.argmax(), yv.argmin(), yv.argmax()])
+    out_idx = np.setdiff1d(np.flatnonzero(outlier), extremes)
+    cap = int(max_points * outlier_share)
+    if len(out_idx) > cap:
+        out_idx = rng.choice(out_idx, cap, replace=False)
+    out_idx = np.concatenate([extremes, out_idx])
+
+    inner = np.flatnonzero(~outlier)
+    cx = np.clip(((xv[inner] - xlo) / ((xhi - xlo) or 1.0) * bins).astype(int), 0, bins - 1)
+    cy = np.clip(((yv[inner] - ylo) / ((yhi - ylo) or 1.0) * bins).astype(int), 0, bins - 1)
+    cell = cx * bins + cy
+    if by is not None:
+        cell = cell + pd.factorize(df[by].to_numpy()[inner])[0] * bins * bins
+    frac = (max_points - len(out_idx)) / max(len(inner), 1)
+
+    # tirage sans remise par case : ordre aléatoire puis on garde les `quota` premiers de chaque case
+    order = rng.permutation(len(inner))
+    cells = pd.Series(cell[order])
+    rank = cells.groupby(cells).cumcount().to_numpy()
+    sizes = cells.value_counts()
+    quotas = np.floor(sizes.to_numpy() * frac + rng.random(len(sizes))) # arrondi aléatoire : pas de biais vers les cases peu peuplées
+    quota = cells.map(pd.Series(quotas, index=sizes.index)).to_numpy()
+    keep = inner[order[rank < quota]]
+    return df.iloc[np.sort(np.concatenate([keep, out_idx]))]
+
+# Nuages de points lus en base : source, puis (nom, expression SQL) de x, y et de la couleur ; seul "price_vs_surface" suit les filtres
+PRED_SOURCE = "public.properties p JOIN public.price_predictions pr ON p.id = pr.property_id"
+SCATTERS = {
+    "price_vs_surface": ("public.properties p", ("surface", "p.surface::float"), ("price", "p.price::float"), ("listing_type", "p.listing_type")),
+    "real_vs_pred": (PRED_SOURCE, ("predicted_price", "pr.predicted_price::float"), ("price", "p.price::float"),
+                     ("confidence_score", "pr.confidence_score::float")),
+    "confidence_vs_error": (PRED_SOURCE, ("confidence_score", "pr.confidence_score::float"),
+                            ("abs_error", "abs(p.price - pr.predicted_price)::float"), ("listing_type", "p.listing_type")),
+}
+
+# Données d'un nuage de points selon sa taille (comptée en base) -> (mode, n, données, plages) :
+#   "full" / "sample" : lignes (id, x, y, couleur), au plus max_points * DENSITY_FACTOR, échantillonnées ensuite par downsample_points
+#   "density" : comptages bins x bins calculés en base (cx, cy, n) bornés aux plages fournies ou aux quantiles [tail, 1-tail]
+@st.cache_data(max_entries=64)
+def query_scatter(kind, filters=None, max_points=SCATTER_MAX_POINTS, x_range=None, y_range=None, bins=120, tail=0.005, version=None):
+    source, (x, x_sql), (y, y_sql), (color, color_sql) = SCATTERS[kind]
+    where, params = build_filter_sql(**filters, alias="p") if filters else ("p.price IS NOT NULL", [])
+    where += f" AND {x_sql} IS NOT NULL AND {y_sql} IS NOT NULL"
+    n = int(_read_sql(f"SELECT COUNT(*) AS n FROM {source} WHERE {where}", params=params)["n"].iloc[0])
+    mode = scatter_mode(n, max_points)
+    if mode != "density":
+        rows = _read_sql(f"SELECT p.id, {x_sql} AS {x}, {y_sql} AS {y}, {color_sql} AS {color} FROM {source} WHERE {where}", params=params)
+        return mode, n, rows, (x_range and list(x_range), y_range and list(y_range))
+
+    points = f"(SELECT {x_sql} AS x, {y_sql} AS y FROM {source} WHERE {where}) s"
+    if x_range is None or y_range is None:
+        q = _read_sql(f"""
+            SELECT qx[1] AS x_lo, qx[2] AS x_hi, qy[1] AS y_lo, qy[2] AS y_hi
+            FROM (
+                SELECT percentile_cont(ARRAY[{tail}, {1 - tail}]) WITHIN GROUP (ORDER BY x) AS qx,
+                       percentile_cont(ARRAY[{tail}, {1 - tail}]) WITHIN GROUP (ORDER BY y) AS qy
+                FROM {points}
+            ) t
+        """, params=params).iloc[0]
+        x_range = x_range or (float(q["x_lo"]), float(q["x_hi"]))
+        y_range = y_range or (float(q["y_lo"]), float(q["y_hi"]))
+    (xlo, xhi), (ylo, yhi) = x_range, y_range
+    xhi, yhi = max(xhi, xlo + 1.0), max(yhi, ylo + 1.0) # width_bucket refuse une plage vide
+    cells = _read_sql(f"""
+        SELECT LEAST(width_bucket(x, %s, %s, %s), %s) AS cx, LEAST(width_bucket(y, %s, %s, %s), %s) AS cy, COUNT(*) AS n
+        FROM {points}
+        WHERE x BETWEEN %s AND %s AND y BETWEEN %s AND %s
+        GROUP BY 1, 2
+    """, params=[xlo, xhi, bins, bins, ylo, yhi, bins, bins] + params + [xlo, xhi, ylo, yhi])
+    return mode, n, cells, ([xlo, xhi], [ylo, yhi])
+
+# Heatmap 2D à partir des comptages par case de query_scatter (seules les cases partent au navigateur)
+def density_figure(cells, n, x, y, title, labels=None, x_range=None, y_range=None, bins=120):
+    z = np.full((bins, bins), np.nan)
+    z[cells["cy"].to_numpy(dtype=int) - 1, cells["cx"].to_numpy(dtype=int) - 1] = cells["n"].to_numpy(dtype=float)
+    xe, ye = np.linspace(*x_range, bins + 1), np.linspace(*y_range, bins + 1)
+    labels = labels or {}
+    fig = go.Figure(go.Heatmap(
+        x=(xe[:-1] + xe[1:]) / 2, y=(ye[:-1] + ye[1:]) / 2, z=z, colorscale="Viridis",
+        colorbar=dict(title="annonces"), hovertemplate="%{x:,.0f} / %{y:,.0f}<br>%{z} annonces<extra></extra>",
+    ))
+    fig.update_layout(
+        title=f"{title} (densité, {n:,} annonces)",
+        xaxis_title=labels.get(x, x), yaxis_title=labels.get(y, y),
+    )
+    return fig
 
-    # surface (taille) - cap à P95
-    m["surface_num"] = pd.to_numeric(m.get("surface"), errors="coerce").fillna(10.0)
-    if m["surface_num"].notna().any():
-        s95 = np.nanpercentile(m["surface_num"], 95)
-        m["size_col"] = np.clip(m["surface_num"], 1, s95 if s95 > 1 else 10.0)
+# Nuage de points adapté à la taille (scatter = query_scatter(...)) : tous les points, échantillon ou heatmap ;
+# seul l'id part en customdata (détails au clic)
+def adaptive_scatter(scatter, x, y, title, color=None, by=None, labels=None, max_points=SCATTER_MAX_POINTS, **kwargs):
+    mode, n, data, (x_range, y_range) = scatter
+    if n == 0:
+        return None
+    if mode == "density":
+        return density_figure(data, n, x, y, title, labels, x_range=x_range, y_range=y_range)
+    if mode == "sample":
+        data = downsample_points(data, x, y, max_points, by=by)
+        title = f"{title} (échantillon de {len(data):,} / {n:,} annonces)"
+    fig = px.scatter(data, x=x, y=y, color=color, custom_data=["id"], labels=labels, title=title, render_mode="webgl", **kwargs)
+    if x_range or y_range:
+        fig.update_layout(xaxis=dict(range=x_range), yaxis=dict(range=y_range))
+    return fig
+
+# Titre, adresse, lien, prix et prédiction des annonces sélectionnées (lu à la demande plutôt qu'embarqué dans chaque point)
+@st.cache_data(max_entries=256)
+def query_listing_details(ids):
+    return _read_sql("""
+        SELECT p.id, p.title, p.listing_type, p.price::float AS price, pr.predicted_price::float AS predicted_price,
+               pr.confidence_score::float AS confidence_score, p.rooms, p.surface::float AS surface, p.address, p.url
+        FROM public.properties p
+        LEFT JOIN public.price_predictions pr ON p.id = pr.property_id
+        WHERE p.id = ANY(%s)
+    """, params=[list(ids)])
+
+# Affiche un nuage de points sélectionnable ; les annonces cliquées (ou prises au lasso) sont détaillées en dessous
+def scatter_with_details(fig, key, max_rows=50):
+    event = st.plotly_chart(fig, use_container_width=True, key=key, on_select="rerun", selection_mode=("points", "box", "lasso"))
+    points = event.selection.points if event else []
+    ids = tuple(int(p["customdata"][0]) for p in points if p.get("customdata"))[:max_rows]
+    if ids:
+        st.dataframe(query_listing_details(ids), use_container_width=True, hide_index=True,
+                     column_config={"url": st.column_config.LinkColumn("url")})
     else:
-        m["size_col"] = 10.0
-
-    # centre auto
-    center = {"lat": float(m["latitude"].mean()), "lon": float(m["longitude"].mean())}
-
-    # hover minimal
-    hover_cols = [c for c in ["address", "price", "rooms", "surface", "url"] if c in m.columns]
-
-    # carte
-    fig = px.scatter_mapbox(
-        m,
-        lat="latitude",
-        lon="longitude",
-        color="price_cap",
-        size="size_col",
-        size_max=24,
-        hover_data=hover_cols,
-        mapbox_style="open-street-map",
-        zoom=3.5,
-        center=center,
-        color_continuous_scale="turbo",
+        st.caption("Cliquer sur un point (ou sélectionner une zone) pour afficher le détail des annonces.")
+
+# Plages fixes de "Prix vs Surface" (passées à query_scatter, elles bornent aussi la heatmap)
+SURFACE_RANGE, PRICE_RANGE = (0, 400), (-10, 3_000_000)
+
+def plot_price_vs_surface(scatter, max_points=SCATTER_MAX_POINTS):
+    return adaptive_scatter(
+        scatter, "surface", "price", "Prix vs Surface (m²)", color="listing_type", by="listing_type",
+        color_discrete_map=TYPE_COLORS, max_points=max_points,
     )
-    fig.update_layout(height=520, margin=dict(l=0, r=0, t=0, b=0))
-    return fig
 
-def plot_price_distribution(df):
-    if "price" in df:
-        fig = px.histogram(df, x="price", nbins=50, title="Distribution des prix")
-        return fig
-    return None
-
-def plot_price_vs_surface(df):
-    if "price" in df and "surface" in df:
-        fig = px.scatter(
-            df, x="surface", y="price", color="listing_type",
-            title="Prix vs Surface (m²)", hover_data=["title"],
-            color_discrete_map={"rent": "red", "sale": "blue"}
-        )
-        fig.update_layout(
-            xaxis=dict(range=[0, 400]),
-            yaxis=dict(range=[-10, 3_000_000])
-        )
-        return fig
-    return None
 
+# Nb d'annonces par nombre de chambres à partir des comptages (agg_rooms_counts ou query_rooms_distribution)
+def plot_rooms_distribution(counts):
+    if counts is None or counts.empty:
+        return None
+    fig = px.bar(
+        counts, x="rooms", y="n", color="listing_type", barmode="group",
+        title="Distribution des annonces par nombre de chambres", labels={"n": "count"},
+        color_discrete_map=TYPE_COLORS
+    )
+    return fig
 
-def plot_rooms_distribution(df):
-    if "rooms" in df:
-        fig = px.histogram(
-            df, x="rooms", color="listing_type", barmode="group",
-            title="Distribution des annonces par nombre de chambres",
-            color_discrete_map={"rent": "red", "sale": "blue"}
-        )
-        return fig
-    return None
-
-def plot_city_medians(df, top_n=20):
-    d = df.copy()
-    d["price"] = pd.to_numeric(d["price"], errors="coerce")
-    d["city"] = d["address"].fillna("").str.split(",").str[1].str.strip()
-    d = d.dropna(subset=["price","city"])
-    grp = d.groupby("city")["price"].agg(["median","count","mean","std"]).reset_index()
-    grp = grp[grp["count"]>=10].sort_values("median", ascending=False).head(top_n)
+# Prix médian par ville lu dans agg_city_stats ou query_analytics (médiane, nb d'annonces et écart type déjà calculés en base)
+def plot_city_medians(city_stats, top_n=20):
+    if city_stats is None or city_stats.empty:
+        return None
+    grp = city_stats[city_stats["n"] >= 10].sort_values("median_price", ascending=False).head(top_n)
     fig = px.bar(
-        grp, x="city", y="median",
-        error_y=grp["std"].fillna(0),
+        grp, x="city", y="median_price", color="listing_type", barmode="group",
+        error_y=grp["std_price"].fillna(0),
+        labels={"median_price": "median"},
+        color_discrete_map=TYPE_COLORS,
         title="Prix médian par ville (Top N, min 10 annonces)"
     )
     fig.update_layout(xaxis_tickangle=-45, height=420, margin=dict(l=10, r=10, t=40, b=10))
     return fig
 
-def plot_price_per_sqm_violin(df):
-    d = df.copy()
-    d["price"] = pd.to_numeric(d["price"], errors="coerce")
-    d["surface"] = pd.to_numeric(d["surface"], errors="coerce")
-    d = d.dropna(subset=["price","surface","listing_type"])
-    d = d[(d["surface"]>10) & (d["surface"]<10000)]
-    d["price_per_sqm"] = d["price"]/d["surface"].replace(0,np.nan)
-    d = d.replace([np.inf,-np.inf], np.nan).dropna(subset=["price_per_sqm"])
-    # cap à P99 pour lisibilité
-    p99 = np.nanpercentile(d["price_per_sqm"], 99)
-    d = d[d["price_per_sqm"]<=p99]
-    fig = px.violin(
-        d, x="listing_type", y="price_per_sqm", box=True, points="suspectedoutliers",
-        title="Distribution du prix / m² par type",
-        color_discrete_map={"rent": "red", "sale": "blue"}
-    )
-    fig.update_layout(height=420, margin=dict(l=10, r=10, t=40, b=10))
+# Boîte du prix / m2 par type à partir des quantiles de agg_price_per_sqm ou query_analytics (P1-Q1-médiane-Q3-P99)
+def plot_price_per_sqm_box(ppsqm):
+    if ppsqm is None or ppsqm.empty:
+        return None
+    fig = go.Figure()
+    for _, r in ppsqm.iterrows():
+        fig.add_trace(go.Box(
+            x=[r["listing_type"]], name=r["listing_type"], marker_color=TYPE_COLORS.get(r["listing_type"]),
+            q1=[r["q1"]], median=[r["median"]], q3=[r["q3"]], lowerfence=[r["p01"]], upperfence=[r["p99"]], mean=[r["mean"]],
+        ))
+    fig.update_layout(title="Distribution du prix / m² par type", yaxis_title="price_per_sqm", height=420, margin=dict(l=10, r=10, t=40, b=10))
     return fig
 
-def plot_price_by_rooms(df):
-    d = df.copy()
-    d["price"] = pd.to_numeric(d["price"], errors="coerce")
-    d["rooms"] = pd.to_numeric(d["rooms"], errors="coerce")
-    d = d.dropna(subset=["price","rooms"])
-    d["rooms_bin"] = d["rooms"].clip(lower=0, upper=6)
-    fig = px.box(
-        d, x="rooms_bin", y="price", points="outliers",
-        title="Prix par nombre de chambres (boxplot)",
-        color_discrete_map={"rent": "red", "sale": "blue"}
-    )
-    fig.update_layout(height=420, margin=dict(l=10, r=10, t=40, b=10))
+# Boxplot du prix par nombre de chambres à partir de agg_rooms_box ou query_analytics (moustaches à 1.5 x IQR, bornées par le min/max)
+def plot_price_by_rooms(rooms_box):
+    if rooms_box is None or rooms_box.empty:
+        return None
+    fig = go.Figure()
+    for lt, b in rooms_box.sort_values("rooms_bin").groupby("listing_type"):
+        iqr = b["q3"] - b["q1"]
+        fig.add_trace(go.Box(
+            x=b["rooms_bin"], name=lt, marker_color=TYPE_COLORS.get(lt),
+            q1=b["q1"], median=b["median"], q3=b["q3"],
+            lowerfence=np.maximum(b["min_price"], b["q1"] - 1.5 * iqr),
+            upperfence=np.minimum(b["max_price"], b["q3"] + 1.5 * iqr),
+        ))
+    fig.update_layout(title="Prix par nombre de chambres (boxplot)", boxmode="group", xaxis_title="rooms_bin", yaxis_title="price",
+                      height=420, margin=dict(l=10, r=10, t=40, b=10))
     return fig
 
 
 # ML
 
-def plot_real_vs_pred(df):
-    df = df.dropna(subset=["price","predicted_price"])
-    fig = px.scatter(
-        df, x="predicted_price", y="price",
-        color="confidence_score", 
-        color_continuous_scale=["red", "green"],
-        hover_data=["title","address","url"],
-        labels={"predicted_price":"Prix prédit", "price":"Prix réel"},
-        title="Prix réel vs Prix prédit"
+def plot_real_vs_pred(scatter, max_points=SCATTER_MAX_POINTS):
+    fig = adaptive_scatter(
+        scatter, "predicted_price", "price", "Prix réel vs Prix prédit",
+        color="confidence_score", color_continuous_scale=["red", "green"],
+        labels={"predicted_price":"Prix prédit", "price":"Prix réel"}, max_points=max_points,
     )
-    fig.add_shape(type="line", x0=0, y0=0,
-                  x1=df["predicted_price"].max(), y1=df["predicted_price"].max(),
-                  line=dict(color="red", dash="dash"))
+    if fig is None:
+        return None
+    mode, _, data, (x_range, _) = scatter
+    top = x_range[1] if mode == "density" else data["predicted_price"].max()
+    fig.add_shape(type="line", x0=0, y0=0, x1=top, y1=top, line=dict(color="red", dash="dash"))
     return fig
 
-def plot_deals_map(df, threshold=0.8):
-    if not {"predicted_price","price","latitude","longitude"}.issubset(df.columns):
+# Carte des bonnes affaires (prix < prédiction de plus de 1-threshold) : sous-évaluation par annonce ou médiane par cellule
+def plot_deals_map(view, threshold=0.8, version=None):
+    mode, data, cell = query_map_data("deals", None, view, threshold, version)
+    if data.empty:
         return None
-    d = df.copy()
-    d["underpricing"] = (d["predicted_price"] - d["price"]) / d["predicted_price"]
-    d = d[d["underpricing"] > (1-threshold)]  # ex: deals >20% sous le modèle
-    fig = px.scatter_mapbox(
-        d, lat="latitude", lon="longitude",
-        color="underpricing",
-        hover_data=["title","price","predicted_price","address"],
-        mapbox_style="open-street-map", zoom=3.5,
-        title="Carte des bonnes affaires détectées (prix < prédiction)"
+    if mode == "points":
+        tooltip = {"html": "{title}<br/>{address}<br/>prix {price} ({underpricing} sous le modèle)"}
+    else:
+        tooltip = {"html": "<b>{n}</b> bonnes affaires<br/>sous-évaluation médiane {underpricing}"}
+    return _deck(mode, data, cell, view, "underpricing", tooltip)
+
+# Top-k des bonnes affaires (table deal_scores indexée) filtré par type, ville, type de bien et confiance minimale
+@st.cache_data(max_entries=256)
+def query_top_deals(listing_type, city=None, property_type=None, min_confidence=0.0, k=50, version=None):
+    deals = top_deals(listing_type, city, property_type, min_confidence, k)
+    note_query(len(deals))
+    return deals
+
+def deals_table(cities, property_types, version=None):
+    c1, c2, c3, c4, c5 = st.columns([1, 2, 1, 1, 1])
+    with c1:
+        lt = st.selectbox("Type", ["sale", "rent"], key="top_deals_type")
+    with c2:
+        city = st.selectbox("Ville", ["(toutes)"] + list(cities), key="top_deals_city")
+    with c3:
+        ptype = st.selectbox("Type de bien", ["(tous)"] + list(property_types), key="top_deals_ptype")
+    with c4:
+        min_conf = st.slider("Confiance min.", 0.0, 1.0, 0.5, 0.05, key="top_deals_conf")
+    with c5:
+        k = st.number_input("Top", 10, 500, 50, 10, key="top_deals_k")
+    deals = query_top_deals(
+        lt, None if city == "(toutes)" else city, None if ptype == "(tous)" else ptype, min_conf, int(k), version
     )
+    if deals.empty:
+        st.info("Aucune bonne affaire pour ces critères.")
+        return
+    st.dataframe(deals, use_container_width=True, hide_index=True, column_config={
+        "underpricing": st.column_config.NumberColumn("sous-évaluation", format="percent"),
+        "url": st.column_config.LinkColumn("url"),
+    })
+
+# Boîte des résidus (prix - prédiction) par type de bien, quantiles calculés en base
+@st.cache_data(max_entries=8)
+def query_residuals_by_type(version=None):
+    return _read_sql(f"""
+        SELECT property_type, n, min_residual, max_residual, q[1] AS q1, q[2] AS median, q[3] AS q3
+        FROM (
+            SELECT property_type, COUNT(*) AS n, MIN(residual) AS min_residual, MAX(residual) AS max_residual,
+                   percentile_cont(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY residual) AS q
+            FROM (
+                SELECT p.property_type, p.price::float - pr.predicted_price::float AS residual
+                FROM {PRED_SOURCE}
+                WHERE p.price IS NOT NULL AND pr.predicted_price IS NOT NULL AND p.property_type IS NOT NULL
+            ) r
+            GROUP BY property_type
+        ) t
+    """)
+
+# moustaches à 1.5 x IQR bornées par le min/max (comme plot_price_by_rooms)
+def plot_residuals_by_type(box):
+    if box is None or box.empty:
+        return None
+    iqr = box["q3"] - box["q1"]
+    fig = go.Figure(go.Box(
+        x=box["property_type"], q1=box["q1"], median=box["median"], q3=box["q3"],
+        lowerfence=np.maximum(box["min_residual"], box["q1"] - 1.5 * iqr),
+        upperfence=np.minimum(box["max_residual"], box["q3"] + 1.5 * iqr),
+    ))
+    fig.update_layout(title="Erreurs de prédiction par type de bien", xaxis_title="property_type", yaxis_title="residual")
     return fig
 
-def plot_ratio(df):
-    df = df.dropna(subset=["price","predicted_price"])
-    df["ratio"] = df["price"] / df["predicted_price"]
-    fig = px.histogram(df, x="ratio", nbins=50, title="Distribution du ratio Prix réel / prédit")
-    return fig
+# Types de bien présents dans les bonnes affaires (choix du tableau top-k)
+@st.cache_data(max_entries=8)
+def query_deal_property_types(version=None):
+    return _read_sql("SELECT DISTINCT property_type FROM deal_scores WHERE property_type IS NOT NULL ORDER BY 1")["property_type"].tolist()
 
-def plot_residuals_by_type(df):
-    df = df.dropna(subset=["price","predicted_price","property_type"])
-    df["residual"] = df["price"] - df["predicted_price"]
-    fig = px.box(df, x="property_type", y="residual", points="all", title="Erreurs de prédiction par type de bien")
-    return fig
-
-def plot_confidence_vs_error(df):
-    df = df.dropna(subset=["price","predicted_price","confidence_score"])
-    df["abs_error"] = (df["price"] - df["predicted_price"]).abs()
-    fig = px.scatter(df, x="confidence_score", y="abs_error",
-                     color="listing_type",
-                     color_discrete_map={"rent": "red","sale": "blue"},
-                     hover_data=["title","address","url"],
-                     title="Erreur absolue vs Confiance du modèle")
-    return fig
+def plot_confidence_vs_error(scatter, max_points=SCATTER_MAX_POINTS):
+    return adaptive_scatter(
+        scatter, "confidence_score", "abs_error", "Erreur absolue vs Confiance du modèle",
+        color="listing_type", by="listing_type", color_discrete_map=TYPE_COLORS, max_points=max_points,
+    )
@@ -0,0 +1,237 @@
+import os
+import re
+import sys
+import argparse
+import threading
+import unicodedata
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Géocodage hors ligne : un gazetier local (centroïdes des codes postaux et des villes, fichier CSV) est chargé une fois en mémoire,
+# les adresses ("47 National Crescent, Brampton (Snelgrove), ON, L7A 1J2, CA") sont résolues sans aucun appel réseau :
+#   1) code postal : préfixe le plus long connu (L7A1J2 -> L7A1J -> ... -> L7A, la RTA couvre toujours le code complet)
+#   2) ville + province, puis ville seule
+# Le gazetier se construit à partir des annonces déjà géolocalisées et/ou d'un fichier de codes postaux GeoNames (CA.txt) :
+#   python -m data_processing.geocoder build [--geonames CA.txt] [--no-db]
+# Les coordonnées posées sont des centroïdes, marqués dans properties.geo_precision ("postal" / "city" ; NULL = coordonnées de l'annonce) :
+# le dédoublonnage et l'index de voisinage du modèle les ignorent (is_centroid).
+GAZETTEER_PATH = Path(os.getenv("GAZETTEER_PATH", Path(__file__).resolve().parent / "gazetteer.csv"))
+POSTAL_RE = re.compile(r"\b([A-Z]\d[A-Z])\s?(\d[A-Z]\d)?\b")
+PROVINCES = {"AB", "BC", "MB", "NB", "NL", "NS", "NT", "NU", "ON", "PE", "QC", "SK", "YT"}
+MIN_PREFIX = 3 # RTA (région de tri d'acheminement)
+CACHE_SIZE = 65536
+
+_lock = threading.Lock()
+_index = None # gazetier chargé (partagé par les threads du scraper)
+
+def _norm(text):
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode().lower()
+    text = re.sub(r"\(.*?\)", "", text)
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+# Adresse -> (code postal sans espace, ville, province) normalisés
+def parse_address(address):
+    if not isinstance(address, str) or not address.strip():
+        return None, None, None
+    found = POSTAL_RE.findall(address.upper()) # le code postal est en fin d'adresse : dernière correspondance
+    postal = "".join(found[-1]) if found else None
+    parts = [p.strip() for p in address.split(",")]
+    # la ville précède le code de province ("Lot 4, 1414 Hwy 37, Rural Lac Ste Anne County, AB, ...")
+    at = next((k for k in range(len(parts) - 1, 0, -1) if parts[k].upper() in PROVINCES), None)
+    if at is not None:
+        city, province = _norm(parts[at - 1]), _norm(parts[at])
+    elif len(parts) >= 3:
+        city, province = _norm(parts[1]), _norm(parts[2])
+    else: # texte libre ("Downtown Toronto") : la dernière partie est la meilleure candidate
+        city, province = _norm(parts[-1]), None
+    return postal, city or None, province or None
+
+class Gazetteer:
+    # rows : DataFrame kind ("postal" / "city"), key, latitude, longitude, n (poids pour agréger les centroïdes)
+    def __init__(self, rows):
+        self.postal_ = {}
+        self.city_ = {}
+        self.city_any_ = {}
+        postal = rows[rows["kind"] == "postal"]
+        keys = postal["key"].astype(str).str.replace(" ", "").str.upper()
+        # index de préfixes : chaque longueur de MIN_PREFIX à 6 reçoit le centroïde pondéré des codes qu'elle couvre
+        for length in range(MIN_PREFIX, 7):
+            sub = postal[keys.str.len() >= length]
+            self.postal_.update(self._centroids(sub, keys[sub.index].str[:length]))
+        city = rows[rows["kind"] == "city"]
+        self.city_ = self._centroids(city, city["key"].astype(str))
+        self.city_any_ = self._centroids(city, city["key"].astype(str).str.split("|").str[0])
+
+    @staticmethod
+    def _centroids(rows, keys):
+        if rows.empty:
+            return {}
+        w = rows["n"].to_numpy(dtype=float)
+        g = pd.DataFrame({"key": keys.to_numpy(), "w": w, "lat": rows["latitude"].to_numpy(dtype=float) * w,
+                          "lon": rows["longitude"].to_numpy(dtype=float) * w}).groupby("key").sum()
+        return dict(zip(g.index, zip(g["lat"] / g["w"], g["lon"] / g["w"])))
+
+    # (lat, lon, précision) ou None ; la recherche est pure (aucun état modifié) -> mise en cache par clé normalisée
+    def resolve(self, postal, city, province):
+        if postal:
+            for length in range(len(postal), MIN_PREFIX - 1, -1):
+                hit = self.postal_.get(postal[:length])
+                if hit is not None:
+                    return (*hit, "postal")
+        if city:
+            hit = self.city_.get(f"{city}|{province}") if province else None
+            hit = hit if hit is not None else self.city_any_.get(city)
+            return None if hit is None else (*hit, "city")
+        return None
+
+    def __len__(self):
+        return len(self.postal_) + len(self.city_)
+
+def load_gazetteer(path=GAZETTEER_PATH):
+    path = Path(path)
+    if not path.exists():
+        print(f"[GEO] gazetier absent ({path}) : 'python -m data_processing.geocoder build' pour le créer, géocodage désactivé")
+        return Gazetteer(pd.DataFrame(columns=["kind", "key", "latitude", "longitude", "n"]))
+    return Gazetteer(pd.read_csv(path, dtype={"kind": str, "key": str}))
+
+def get_gazetteer():
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = load_gazetteer()
+    return _index
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _resolve(postal, city, province):
+    return get_gazetteer().resolve(postal, city, province)
+
+# Coordonnées d'une adresse : (lat, lon, précision "postal" / "city"), (None, None, None) si rien ne correspond dans le gazetier
+# default_city / default_province : ville de repli quand l'adresse n'en donne pas (Craigslist : "location" = quartier, ville connue par le site).
+# Le gazetier ne couvre que le Canada : l'appelant ne doit passer default_city que pour une source canadienne, avec sa province
+# (sinon "london" d'un site britannique tomberait sur London, Ontario)
+def locate(address, default_city=None, default_province=None):
+    hit = _resolve(*parse_address(address))
+    if hit is None and default_city:
+        hit = _resolve(None, _norm(default_city), _norm(default_province) if default_province else None)
+    return hit if hit is not None else (None, None, None)
+
+# Comme locate, sans la précision : (lat, lon), (None, None) si rien ne correspond
+def geocode(address, default_city=None, default_province=None):
+    return locate(address, default_city, default_province)[:2]
+
+# Vrai pour les coordonnées posées par le gazetier (centroïdes partagés par toute une zone) ; precision : colonne geo_precision
+def is_centroid(precision):
+    return pd.Series(precision, dtype=object).notna().to_numpy()
+
+# Version lot : chaque adresse distincte n'est analysée qu'une fois (les villes partagées passent par le cache)
+# -> latitudes, longitudes (NaN si introuvable), précisions (None si introuvable)
+def geocode_many(addresses):
+    addresses = pd.Series(addresses, dtype=object)
+    codes, uniques = pd.factorize(addresses)
+    hits = [locate(a) for a in uniques] + [(None, None, None)] # code -1 : adresse manquante
+    coords = np.array([h[:2] for h in hits], dtype=float).reshape(-1, 2)
+    precision = np.array([h[2] for h in hits], dtype=object)
+    return coords[codes, 0], coords[codes, 1], precision[codes]
+
+# Complète latitude / longitude manquantes à partir de l'adresse et marque leur précision (renvoie le nombre de lignes complétées, df modifié en place)
+def fill_coordinates(df):
+    if "geo_precision" not in df:
+        df["geo_precision"] = None
+    missing = (df["latitude"].isna() | df["longitude"].isna()).to_numpy()
+    if not missing.any():
+        return 0
+    lat, lon, precision = geocode_many(df.loc[missing, "address"])
+    found = ~np.isnan(lat)
+    idx = df.index[missing][found]
+    df.loc[idx, "latitude"] = lat[found]
+    df.loc[idx, "longitude"] = lon[found]
+    df.loc[idx, "geo_precision"] = precision[found]
+    return int(found.sum())
+
+# --- construction du gazetier ---
+# Centroïdes (médianes) des annonces géolocalisées, par code postal complet et par ville/province (coordonnées des annonces seulement,
+# pas les centroïdes déjà posés par le gazetier)
+def rows_from_listings():
+    from database.connection import get_connection
+    connexion = get_connection()
+    df = pd.read_sql("SELECT address, latitude::float AS latitude, longitude::float AS longitude FROM public.properties "
+                     "WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND address IS NOT NULL AND geo_precision IS NULL", connexion)
+    connexion.close()
+    parsed = pd.DataFrame([parse_address(a) for a in df["address"]], columns=["postal", "city", "province"], index=df.index)
+    df = df.join(parsed)
+    out = []
+    postal = df[df["postal"].str.len() == 6].groupby("postal").agg(latitude=("latitude", "median"), longitude=("longitude", "median"), n=("latitude", "size"))
+    out.append(postal.reset_index().rename(columns={"postal": "key"}).assign(kind="postal"))
+    city = df[df["city"].notna()].assign(key=lambda d: d["city"] + "|" + d["province"].fillna(""))
+    city = city.groupby("key").agg(latitude=("latitude", "median"), longitude=("longitude", "median"), n=("latitude", "size"))
+    out.append(city.reset_index().assign(kind="city"))
+    return pd.concat(out, ignore_index=True)
+
+# Fichier de codes postaux GeoNames (tabulé, sans en-tête : pays, code, lieu, province, code province, ..., lat, lon, précision)
+def rows_from_geonames(path):
+    g = pd.read_csv(path, sep="\t", header=None, dtype=str, keep_default_na=False, usecols=[1, 2, 4, 9, 10],
+                    names=["key", "place", "province", "latitude", "longitude"])
+    g["latitude"], g["longitude"] = pd.to_numeric(g["latitude"], errors="coerce"), pd.to_numeric(g["longitude"], errors="coerce")
+    g = g.dropna(subset=["latitude", "longitude"])
+    postal = g.assign(key=g["key"].str.replace(" ", "").str.upper(), kind="postal", n=1)
+    city = g.assign(key=g["place"].map(_norm) + "|" + g["province"].map(_norm), kind="city", n=1)
+    city = city.groupby("key", as_index=False).agg(latitude=("latitude", "mean"), longitude=("longitude", "mean"), n=("n", "sum")).assign(kind="city")
+    return pd.concat([postal[["kind", "key", "latitude", "longitude", "n"]], city], ignore_index=True)
+
+def build_gazetteer(path=GAZETTEER_PATH, geonames=None, from_db=True):
+    parts = []
+    if from_db:
+        parts.append(rows_from_listings())
+    if geonames:
+        parts.append(rows_from_geonames(geonames))
+    if not parts:
+        print("[GEO] aucune source pour le gazetier")
+        return None
+    rows = pd.concat(parts, ignore_index=True)[["kind", "key", "latitude", "longitude", "n"]]
+    rows = rows.sort_values(["kind", "key"]).reset_index(drop=True)
+    rows.to_csv(path, index=False, float_format="%.6f")
+    print(f"[GEO] gazetier écrit : {(rows['kind'] == 'postal').sum()} codes postaux, {(rows['kind'] == 'city').sum()} villes -> {path}")
+    return rows
+
+# Annonces déjà en base sans coordonnées : géocodées par lots puis mises à jour
+def backfill_coordinates(batch_size=5000):
+    from database.connection import get_connection, execute_batch
+    connexion = get_connection()
+    if connexion is None:
+        print("erreur")
+        return 0
+    cursor = connexion.cursor()
+    cursor.execute("SELECT id, address FROM public.properties WHERE (latitude IS NULL OR longitude IS NULL) AND address IS NOT NULL")
+    rows = cursor.fetchall()
+    updated = 0
+    now = datetime.utcnow() # même horloge que scraped_at
+    for k in range(0, len(rows), batch_size):
+        chunk = rows[k:k + batch_size]
+        lat, lon, precision = geocode_many([r[1] for r in chunk])
+        params = [(float(a), float(b), p, now, r[0]) for r, a, b, p in zip(chunk, lat, lon, precision) if not np.isnan(a)]
+        execute_batch(cursor, "UPDATE public.properties SET latitude = %s, longitude = %s, geo_precision = %s, updated_at = %s WHERE id = %s",
+                      params, page_size=1000)
+        updated += len(params)
+    connexion.commit()
+    cursor.close()
+    connexion.close()
+    print(f"[GEO] {updated}/{len(rows)} annonces sans coordonnées géocodées")
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Géocodage hors ligne (gazetier local)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="construit le gazetier (annonces géolocalisées et/ou fichier GeoNames)")
+    b.add_argument("--geonames", default=None, help="fichier de codes postaux GeoNames (ex: CA.txt)")
+    b.add_argument("--no-db", action="store_true", help="n'utilise pas les annonces en base")
+    b.add_argument("--out", default=str(GAZETTEER_PATH))
+    sub.add_parser("backfill", help="géocode les annonces en base sans coordonnées")
+    args = parser.parse_args()
+    if args.command == "build":
+        sys.exit(0 if build_gazetteer(args.out, geonames=args.geonames, from_db=not args.no_db) is not None else 1)
+    backfill_coordinates()
@@ -0,0 +1,181 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from database.connection import get_connection, execute_batch
+
+# Tables pré-agrégées lues directement par les graphes "Analyses" du dashboard (détail dans migrations/0004_dashboard_aggregates.sql).
+# Elles sont maintenues par partition (type d'annonce, ville) : chaque partition garde des comptages par classe logarithmique de prix
+# (agg_city_price_bins, agg_city_ppsqm_bins, migration 0012). Un refresh ne relit dans properties que les villes qui ont reçu une annonce
+# nouvelle ou modifiée, puis redérive les tables de 0004 à partir des comptages (quelques milliers de lignes par type) :
+# nombres et moyennes exacts, quantiles lus dans les classes (valeur = moyenne de la classe, classes larges de 0,23 %).
+
+PRICE_HISTOGRAM_BINS = 50
+BINS_PER_DECADE = 1000 # classe = floor(log10(prix) * 1000)
+REFRESH_LAG = pd.Timedelta(minutes=15) # scraped_at est pris avant le commit : une ligne peut devenir visible après le dernier max vu
+CITY_SQL = "COALESCE(trim(split_part(address, ',', 2)), '')" # même expression que l'index idx_properties_type_city (ville '' = inconnue)
+
+def _bin_sql(value):
+    return f"CAST(floor(log({value}) * %(bpd)s + 1e-9) AS INTEGER)" # epsilon : log10(1000) = 2.9999... selon le moteur
+
+PARTITION_SQL = {
+    # prix par ville et nombre de chambres (rooms NULL : inconnu), sommes pour la moyenne et l'écart type exacts
+    "agg_city_price_bins": f"""
+        INSERT INTO agg_city_price_bins(listing_type, city, rooms, bin, n, total, total_sq)
+        SELECT %(lt)s, city, rooms, bin, COUNT(*), SUM(price), SUM(price * price)
+        FROM (
+            SELECT {CITY_SQL} AS city, rooms, {_bin_sql("price::float")} AS bin, price::float AS price
+            FROM public.properties
+            WHERE listing_type = %(lt)s AND price > 0 {{cities}}
+        ) t
+        GROUP BY city, rooms, bin
+    """,
+    # prix / m2 par ville (surfaces plausibles seulement)
+    "agg_city_ppsqm_bins": f"""
+        INSERT INTO agg_city_ppsqm_bins(listing_type, city, bin, n, total)
+        SELECT %(lt)s, city, bin, COUNT(*), SUM(ppsqm)
+        FROM (
+            SELECT {CITY_SQL} AS city, {_bin_sql("price::float / surface::float")} AS bin, price::float / surface::float AS ppsqm
+            FROM public.properties
+            WHERE listing_type = %(lt)s AND price > 0 AND surface > 10 AND surface < 10000 {{cities}}
+        ) t
+        GROUP BY city, bin
+    """,
+}
+
+# Quantiles (interpolation linéaire de percentile_cont) à partir de classes triées : chaque annonce vaut la moyenne de sa classe
+def _quantiles(n, value, qs):
+    cum = np.cumsum(n)
+    def at(rank):
+        return value[np.searchsorted(cum, rank, side="right")]
+    out = []
+    for q in qs:
+        h = q * (cum[-1] - 1)
+        lo, hi = at(np.floor(h)), at(np.ceil(h))
+        out.append(float(lo + (h - np.floor(h)) * (hi - lo)))
+    return out
+
+# Classes d'un groupe d'annonces -> (n, moyenne par classe) triées par classe
+def _merged(bins):
+    g = bins.groupby("bin")[["n", "total"]].sum().sort_index()
+    return g["n"].to_numpy(), (g["total"] / g["n"]).to_numpy()
+
+# Tables de 0004 pour un type d'annonce, recalculées à partir des comptages de toutes ses villes
+def derive_aggregates(price_bins, ppsqm_bins):
+    out = {}
+    city_rows = []
+    for city, b in price_bins[price_bins["city"] != ""].groupby("city"):
+        n, total, total_sq = b["n"].sum(), b["total"].sum(), b["total_sq"].sum()
+        std = float(np.sqrt(max(total_sq - total * total / n, 0) / (n - 1))) if n > 1 else None
+        city_rows.append((city, int(n), _quantiles(*_merged(b), [0.5])[0], float(total / n), std))
+    out["agg_city_stats"] = city_rows
+
+    rooms = price_bins[price_bins["rooms"].notna()]
+    rooms = rooms.assign(rooms=rooms["rooms"].astype(int))
+    out["agg_rooms_counts"] = [(int(r), int(n)) for r, n in rooms.groupby("rooms")["n"].sum().items()]
+    box_rows = []
+    for rooms_bin, b in rooms.assign(rooms_bin=rooms["rooms"].clip(0, 6)).groupby("rooms_bin"):
+        mn, q1, med, q3, mx = _quantiles(*_merged(b), [0, 0.25, 0.5, 0.75, 1])
+        box_rows.append((int(rooms_bin), int(b["n"].sum()), mn, q1, med, q3, mx))
+    out["agg_rooms_box"] = box_rows
+
+    # histogramme : 50 buckets entre le min et le P99 (les prix au-delà vont dans le dernier bucket), classes rangées par leur moyenne
+    hist_rows = []
+    if not price_bins.empty:
+        n, value = _merged(price_bins)
+        lo, p99 = _quantiles(n, value, [0, 0.99])
+        hi = max(p99, lo + 1)
+        width = (hi - lo) / PRICE_HISTOGRAM_BINS
+        bucket = np.clip(np.floor((value - lo) / width).astype(int) + 1, 1, PRICE_HISTOGRAM_BINS)
+        counts = pd.Series(n).groupby(bucket).sum()
+        hist_rows = [(int(k), lo + (k - 1) * width, lo + k * width, int(c)) for k, c in counts.items()]
+    out["agg_price_histogram"] = hist_rows
+
+    ppsqm_rows = []
+    if not ppsqm_bins.empty:
+        n, value = _merged(ppsqm_bins)
+        ppsqm_rows = [(int(n.sum()), float(ppsqm_bins["total"].sum() / n.sum()), *_quantiles(n, value, [0.01, 0.25, 0.5, 0.75, 0.99]))]
+    out["agg_price_per_sqm"] = ppsqm_rows
+    return out
+
+INSERT_SQL = {
+    "agg_city_stats": "INSERT INTO agg_city_stats(listing_type, city, n, median_price, mean_price, std_price) VALUES (%s, %s, %s, %s, %s, %s)",
+    "agg_rooms_counts": "INSERT INTO agg_rooms_counts(listing_type, rooms, n) VALUES (%s, %s, %s)",
+    "agg_rooms_box": "INSERT INTO agg_rooms_box(listing_type, rooms_bin, n, min_price, q1, median, q3, max_price) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+    "agg_price_histogram": "INSERT INTO agg_price_histogram(listing_type, bucket, price_lo, price_hi, n) VALUES (%s, %s, %s, %s, %s)",
+    "agg_price_per_sqm": "INSERT INTO agg_price_per_sqm(listing_type, n, mean, p01, q1, median, q3, p99) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+}
+
+def _read_bins(cursor, table, columns, lt):
+    cursor.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE listing_type = %s", (lt,))
+    return pd.DataFrame(cursor.fetchall(), columns=columns)
+
+# Met à jour les partitions (type, ville) modifiées depuis le dernier refresh puis redérive les agrégats des types touchés
+# (force=True ou type sans état : toutes les villes du type sont relues)
+def refresh_aggregates(force=False):
+    try:
+        connexion = get_connection()
+        if connexion is None:
+            print("erreur")
+            return []
+
+        cursor = connexion.cursor()
+        cursor.execute("SELECT listing_type FROM agg_refresh_state")
+        known = {r[0] for r in cursor.fetchall()}
+        cursor.execute("SELECT COALESCE(MAX(max_id), 0), MAX(max_scraped_at), MAX(max_updated_at) FROM agg_refresh_state")
+        last_id, last_scraped, last_updated = cursor.fetchone()
+
+        # villes touchées depuis le dernier passage, par type : nouvelles annonces et annonces repricées (index sur id, scraped_at, updated_at)
+        if force or last_scraped is None:
+            cursor.execute("SELECT DISTINCT listing_type FROM public.properties WHERE listing_type IS NOT NULL")
+            touched = {r[0]: None for r in cursor.fetchall()}
+        else:
+            since = (pd.Timestamp(last_scraped) - REFRESH_LAG).to_pydatetime()
+            updated_since = (pd.Timestamp(last_updated) - REFRESH_LAG).to_pydatetime() if last_updated is not None else datetime.min
+            cursor.execute(f"""
+                SELECT DISTINCT listing_type, {CITY_SQL} FROM public.properties
+                WHERE listing_type IS NOT NULL AND (id > %s OR scraped_at > %s OR updated_at > %s)
+                """, (last_id, since, updated_since))
+            touched = {}
+            for lt, city in cursor.fetchall():
+                touched.setdefault(lt, set()).add(city)
+            touched = {lt: (None if lt not in known else sorted(cities)) for lt, cities in touched.items()}
+
+        for lt, cities in touched.items():
+            # une transaction par type : le dashboard voit soit l'ancien soit le nouvel agrégat, jamais une table vide
+            cursor.execute("SELECT MAX(id), MAX(scraped_at), MAX(updated_at) FROM public.properties WHERE listing_type = %s", (lt,))
+            max_id, max_scraped, max_updated = cursor.fetchone()
+            params = {"lt": lt, "bpd": BINS_PER_DECADE, "cities": cities}
+            for table, sql in PARTITION_SQL.items():
+                if cities is None:
+                    cursor.execute(f"DELETE FROM {table} WHERE listing_type = %(lt)s", params)
+                    cursor.execute(sql.format(cities=""), params)
+                else:
+                    cursor.execute(f"DELETE FROM {table} WHERE listing_type = %(lt)s AND city = ANY(%(cities)s)", params)
+                    cursor.execute(sql.format(cities=f"AND {CITY_SQL} = ANY(%(cities)s)"), params)
+
+            price_bins = _read_bins(cursor, "agg_city_price_bins", ["city", "rooms", "bin", "n", "total", "total_sq"], lt)
+            ppsqm_bins = _read_bins(cursor, "agg_city_ppsqm_bins", ["city", "bin", "n", "total"], lt)
+            for table, rows in derive_aggregates(price_bins, ppsqm_bins).items():
+                cursor.execute(f"DELETE FROM {table} WHERE listing_type = %s", (lt,))
+                execute_batch(cursor, INSERT_SQL[table], [(lt, *r) for r in rows], page_size=1000)
+            cursor.execute("""
+                INSERT INTO agg_refresh_state(listing_type, max_id, max_scraped_at, max_updated_at, refreshed_at)
+                VALUES (%s, %s, %s, %s, NOW())
+                ON CONFLICT (listing_type) DO UPDATE
+                  SET max_id = EXCLUDED.max_id, max_scraped_at = EXCLUDED.max_scraped_at,
+                      max_updated_at = EXCLUDED.max_updated_at, refreshed_at = NOW()
+                """, (lt, max_id, max_scraped, max_updated))
+            connexion.commit()
+            print(f"Agrégats {lt} : {'toutes les villes' if cities is None else f'{len(cities)} ville(s) relue(s)'}")
+
+        cursor.close()
+        connexion.close()
+        print(f"Agrégats rafraîchis : {list(touched) or 'rien de nouveau'}")
+        return list(touched)
+    except Exception as e:
+        print(f"Erreur lors du rafraîchissement des agrégats : {e}")
+        return []
+
+if __name__ == "__main__":
+    import sys
+    refresh_aggregates(force="--force" in sys.argv)
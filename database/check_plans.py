@@ -0,0 +1,100 @@
+import re
+import sys
+import json
+from datetime import date
+from database.connection import get_connection
+
+# Vérifie les plans d'exécution des requêtes chaudes (EXPLAIN, sans les exécuter) :
+# élagage des partitions de properties et index utilisables pour l'entraînement et le dashboard.
+# Les index sont testés avec enable_seqscan = off : sur une petite base un seq scan est normal, on vérifie seulement qu'ils servent.
+# Code de sortie 1 si une vérification échoue (utilisable en CI après les migrations).
+
+CHECKS = [
+    {
+        "name": "load_data : seule la partition du type est lue",
+        "sql": "SELECT id, price FROM public.properties WHERE price IS NOT NULL AND listing_type = 'sale'",
+        "only_partitions": "properties_sale",
+    },
+    {
+        "name": "load_data(since) : seuls les derniers mois sont lus",
+        "sql": "SELECT id, price FROM public.properties WHERE price IS NOT NULL AND listing_type = 'sale' AND scraped_at > date_trunc('month', now())",
+        "from_current_month": True, # aucune partition mensuelle antérieure au mois courant
+    },
+    {
+        "name": "prédictions récentes : index sur created_at",
+        "sql": "SELECT property_id FROM public.price_predictions WHERE created_at > now() - interval '1 day'",
+        "index": "idx_price_predictions_created",
+        "no_seqscan": True,
+    },
+    {
+        "name": "jointure annonces / prédictions : index sur property_id",
+        "sql": "SELECT p.id, pr.predicted_price FROM public.properties p JOIN public.price_predictions pr ON p.id = pr.property_id WHERE p.id = 1",
+        "index": "price_predictions_property",
+        "no_seqscan": True,
+    },
+    {
+        "name": "filtres du dashboard : partition du type + index sur le prix",
+        "sql": "SELECT COUNT(*) FROM public.properties WHERE listing_type = 'rent' AND price BETWEEN 1000 AND 2000",
+        "only_partitions": "properties_rent",
+        "index": "price",
+        "no_seqscan": True,
+    },
+    {
+        "name": "filtre d'équipements : index GIN sur feature_ids",
+        "sql": "SELECT id FROM public.properties WHERE feature_ids @> ARRAY[1, 2]",
+        "index": "feature_ids",
+        "no_seqscan": True,
+    },
+    {
+        "name": "data_version : max(scraped_at) sans parcours complet",
+        "sql": "SELECT max(scraped_at) FROM public.properties",
+        "index": "scraped",
+        "no_seqscan": True,
+    },
+]
+
+def _nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _nodes(child)
+
+def explain(cursor, sql, no_seqscan=False):
+    cursor.execute(f"SET enable_seqscan = {'off' if no_seqscan else 'on'}")
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return list(_nodes(plan[0]["Plan"]))
+
+# Renvoie la liste des (nom, ok, détail) ; verbose : affiche le résultat de chaque vérification
+def check_plans(verbose=True):
+    connexion = get_connection()
+    if connexion is None:
+        print("erreur")
+        return []
+    cursor = connexion.cursor()
+    results = []
+    for check in CHECKS:
+        nodes = explain(cursor, check["sql"], check.get("no_seqscan", False))
+        relations = sorted({n["Relation Name"] for n in nodes if "Relation Name" in n})
+        indexes = sorted({n["Index Name"] for n in nodes if "Index Name" in n})
+        ok = True
+        if "only_partitions" in check:
+            ok &= all(r.startswith(check["only_partitions"]) for r in relations if r.startswith("properties"))
+        if check.get("from_current_month"):
+            months = [m.group(1) for r in relations if (m := re.search(r"_(\d{6})$", r))]
+            ok &= all(m >= date.today().strftime("%Y%m") for m in months)
+        if "index" in check:
+            ok &= any(check["index"] in i for i in indexes)
+        detail = f"tables={relations} index={indexes}"
+        results.append((check["name"], ok, detail))
+        if verbose:
+            print(f"[{'OK' if ok else 'KO'}] {check['name']} -> {detail}")
+    cursor.close()
+    connexion.close()
+    return results
+
+
+if __name__ == "__main__":
+    results = check_plans()
+    sys.exit(0 if results and all(ok for _, ok, _ in results) else 1)
@@ -0,0 +1,100 @@
+import os
+import sys
+import sqlite3
+import argparse
+from database.connection import get_connection, backend
+from database.models import run_migrations
+from database.sqlite_backend import SCHEMA_PATH
+
+# Vérifie que le schéma SQLite (database/sqlite_schema.sql, maintenu à la main) a les mêmes tables et colonnes que les migrations
+# PostgreSQL (database/migrations/) : les migrations sont appliquées dans une base vide temporaire (<PGDATABASE>_schema_check),
+# comparée à un fichier SQLite neuf. Code de sortie 1 si une table ou une colonne manque d'un côté (utilisable en CI).
+# Les types, index, partitions et triggers ne sont pas comparés (ils diffèrent volontairement, voir l'en-tête de sqlite_schema.sql).
+#   python -m database.check_schema [--live]   (--live : compare la base courante au lieu d'une base migrée à neuf)
+POSTGRES_ONLY = {"schema_migrations"} # suivi des migrations, sans équivalent dans le fichier SQLite
+
+# {table: {colonnes}} des tables de public (tables partitionnées comptées une fois, sans leurs partitions)
+def postgres_columns(cursor):
+    cursor.execute("""
+        SELECT c.relname, a.attname
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = c.oid
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+          AND a.attnum > 0 AND NOT a.attisdropped
+        """)
+    tables = {}
+    for table, column in cursor.fetchall():
+        tables.setdefault(table, set()).add(column)
+    return {t: cols for t, cols in tables.items() if t not in POSTGRES_ONLY}
+
+# Colonnes d'une base vide créée par les seules migrations (supprimée ensuite)
+def migrated_columns():
+    database = os.getenv("PGDATABASE", "real_estate_db")
+    scratch = f"{database}_schema_check"
+    admin = get_connection()
+    admin.autocommit = True # CREATE / DROP DATABASE hors transaction
+    cursor = admin.cursor()
+    cursor.execute(f'DROP DATABASE IF EXISTS "{scratch}"')
+    cursor.execute(f'CREATE DATABASE "{scratch}"')
+    os.environ["PGDATABASE"] = scratch
+    try:
+        run_migrations()
+        connexion = get_connection()
+        tables = postgres_columns(connexion.cursor())
+        connexion.close()
+    finally:
+        os.environ["PGDATABASE"] = database
+        cursor.execute(f'DROP DATABASE IF EXISTS "{scratch}"')
+        cursor.close()
+        admin.close()
+    return tables
+
+# Même chose pour un fichier SQLite neuf créé avec sqlite_schema.sql (en mémoire)
+def sqlite_columns(path=SCHEMA_PATH):
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(path.read_text(encoding="utf-8"))
+    names = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    tables = {t: {r[1] for r in conn.execute(f"PRAGMA table_info({t})")} for t in names}
+    conn.close()
+    return tables
+
+# Renvoie la liste des écarts (texte) ; live : compare la base courante (déjà migrée) ; verbose : les affiche
+def check_schema(live=False, verbose=True):
+    if backend() != "postgres":
+        print("check_schema compare avec PostgreSQL : lancer sans DB_BACKEND=sqlite")
+        return None
+    try:
+        if live:
+            connexion = get_connection()
+            pg = postgres_columns(connexion.cursor())
+            connexion.close()
+        else:
+            pg = migrated_columns()
+    except Exception as e:
+        print(f"Erreur lors de la lecture du schéma PostgreSQL : {e}")
+        return None
+    lite = sqlite_columns()
+
+    problems = []
+    for table in sorted(set(pg) | set(lite)):
+        if table not in lite:
+            problems.append(f"table {table} absente de sqlite_schema.sql")
+        elif table not in pg:
+            problems.append(f"table {table} absente des migrations PostgreSQL")
+        else:
+            problems += [f"colonne {table}.{c} absente de sqlite_schema.sql" for c in sorted(pg[table] - lite[table])]
+            problems += [f"colonne {table}.{c} absente des migrations PostgreSQL" for c in sorted(lite[table] - pg[table])]
+    if verbose:
+        for p in problems:
+            print(f"[KO] {p}")
+        print(f"{len(pg)} tables comparées : {'schémas identiques' if not problems else f'{len(problems)} écart(s)'}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare les tables / colonnes du schéma SQLite et des migrations PostgreSQL")
+    parser.add_argument("--live", action="store_true", help="compare la base courante au lieu d'une base migrée à neuf")
+    args = parser.parse_args()
+    problems = check_schema(live=args.live)
+    sys.exit(0 if problems == [] else 1)
@@ -1,9 +1,24 @@
 import psycopg2
+import psycopg2.extras
 import os
+from pathlib import Path
 from psycopg2 import sql
+from pipeline.log import get_logger
+
+log = get_logger("database.connection")
+
+# DB_BACKEND=sqlite : toute la chaîne (scraper, entraînement, dashboard) tourne sur un fichier SQLite local (database/sqlite_backend.py),
+# sans serveur PostgreSQL ; le fichier est rempli à partir d'un dump par 'python3 -m database.import_dump'
+DEFAULT_SQLITE_PATH = str(Path(__file__).resolve().parent.parent / "local.db")
+
+def backend():
+    return os.getenv("DB_BACKEND", "postgres").lower()
 
 def get_connection():
     try:
+        if backend() == "sqlite":
+            from database.sqlite_backend import connect
+            return connect(os.getenv("SQLITE_PATH", DEFAULT_SQLITE_PATH))
         connexion = psycopg2.connect(
             host=os.getenv("PGHOST", "localhost"),
             database=os.getenv("PGDATABASE", "real_estate_db"),
@@ -14,5 +29,12 @@ def get_connection():
         )
         return connexion
     except Exception as e:
-        print(f"Erreur de connexion : {e}")
-        return None
\ No newline at end of file
+        log.error("connection_failed", key=backend(), error=str(e)) # appelé à chaque annonce : limité par fenêtre
+        return None
+
+# Insertion par lots quel que soit le backend (execute_batch de psycopg2, executemany en SQLite)
+def execute_batch(cursor, query, rows, page_size=1000):
+    if isinstance(cursor, psycopg2.extensions.cursor):
+        psycopg2.extras.execute_batch(cursor, query, rows, page_size=page_size)
+    else:
+        cursor.executemany(query, rows)
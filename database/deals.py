@@ -0,0 +1,79 @@
+import pandas as pd
+from database.connection import get_connection
+
+# Classement des bonnes affaires (table deal_scores, détail dans migrations/0005_deal_scores.sql), recalculé après chaque écriture de prédictions.
+# underpricing = (prédit - prix) / prédit ; score = underpricing * confiance du modèle ; rang par (type d'annonce, ville)
+
+REFRESH_SQL = """
+    INSERT INTO deal_scores(property_id, listing_type, city, property_type, price, predicted_price,
+                            confidence_score, underpricing, score, rank_city, updated_at)
+    SELECT id, listing_type, city, property_type, price, predicted_price, confidence_score, underpricing, score,
+           ROW_NUMBER() OVER (PARTITION BY city ORDER BY score DESC, id), NOW()
+    FROM (
+        SELECT p.id, p.listing_type, trim(split_part(p.address, ',', 2)) AS city, p.property_type,
+               p.price::float AS price, pr.predicted_price::float AS predicted_price,
+               pr.confidence_score::float AS confidence_score,
+               (pr.predicted_price - p.price)::float / pr.predicted_price::float AS underpricing,
+               (pr.predicted_price - p.price)::float / pr.predicted_price::float * pr.confidence_score::float AS score
+        FROM public.properties p
+        JOIN public.price_predictions pr ON p.id = pr.property_id
+        WHERE p.listing_type = %(lt)s AND p.price IS NOT NULL AND pr.predicted_price > 0
+          AND pr.predicted_price > p.price -- on ne garde que les annonces sous le prix prédit
+          AND NOT EXISTS (SELECT 1 FROM listing_clusters c WHERE c.property_id = p.id AND NOT c.is_canonical) -- un seul exemplaire par bien
+          AND NOT EXISTS (SELECT 1 FROM listing_state s WHERE s.property_id = p.id AND s.status <> 'active') -- annonces retirées
+    ) t
+"""
+
+# Recalcule deal_scores pour les types d'annonce donnés (par défaut tous) ; une transaction par type
+def refresh_deal_scores(listing_types=None):
+    try:
+        connexion = get_connection()
+        if connexion is None:
+            print("erreur")
+            return 0
+
+        cursor = connexion.cursor()
+        if listing_types is None:
+            cursor.execute("SELECT DISTINCT listing_type FROM public.properties WHERE listing_type IS NOT NULL")
+            listing_types = [r[0] for r in cursor.fetchall()]
+
+        total = 0
+        for lt in listing_types:
+            cursor.execute("DELETE FROM deal_scores WHERE listing_type = %s", (lt,))
+            cursor.execute(REFRESH_SQL, {"lt": lt})
+            total += cursor.rowcount
+            connexion.commit()
+
+        cursor.close()
+        connexion.close()
+        print(f"Bonnes affaires classées : {total} annonces ({', '.join(listing_types)})")
+        return total
+    except Exception as e:
+        print(f"Erreur lors du calcul des bonnes affaires : {e}")
+        return 0
+
+# Top-k des annonces les plus sous-évaluées (lecture par index : (listing_type, city, rank_city) ou (listing_type, score))
+def top_deals(listing_type, city=None, property_type=None, min_confidence=0.0, k=50):
+    q = """
+        SELECT d.property_id, d.city, d.property_type, d.price, d.predicted_price, d.confidence_score,
+               d.underpricing, d.score, d.rank_city, p.title, p.address, p.url
+        FROM deal_scores d
+        JOIN public.properties p ON p.id = d.property_id
+        WHERE d.listing_type = %s AND d.confidence_score >= %s
+    """
+    params = [listing_type, min_confidence]
+    if city:
+        q += " AND d.city = %s"
+        params.append(city)
+    if property_type:
+        q += " AND d.property_type = %s"
+        params.append(property_type)
+    q += " ORDER BY d.rank_city LIMIT %s" if city else " ORDER BY d.score DESC LIMIT %s"
+    params.append(int(k))
+    connexion = get_connection()
+    df = pd.read_sql(q, connexion, params=params)
+    connexion.close()
+    return df
+
+if __name__ == "__main__":
+    refresh_deal_scores()
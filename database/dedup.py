@@ -0,0 +1,273 @@
+import re
+import time
+import argparse
+from itertools import zip_longest
+import unicodedata
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from database.connection import get_connection, execute_batch
+from data_processing.geocoder import is_centroid
+
+# Détection des doublons (même bien publié plusieurs fois : sources différentes, annonce C21 republiée sous une nouvelle URL).
+# Comparer toutes les paires est impossible : les annonces sont d'abord regroupées par clés de blocage
+#   - cell / cell_alt : geohash (~150 m) + nb de chambres, sur deux grilles décalées d'une demi-case
+#   - address_key : adresse normalisée (numéro + rue + ville)
+# Dans chaque bloc, les annonces triées par prix ne sont comparées qu'à leurs WINDOW voisines (un doublon a un prix proche),
+# puis chaque paire candidate est notée (prix, surface, titre, distance). Les paires retenues forment des groupes
+# (composantes connexes) enregistrés dans listing_clusters (détail dans migrations/0010_listing_clusters.sql).
+# Les centroïdes du gazetier (geo_precision renseignée) ne comptent pas comme géolocalisation : ni cellule, ni distance.
+# Passe incrémentale : seules les annonces absentes de listing_clusters sont traitées, comparées aux annonces qui partagent une de leurs clés.
+
+GEOHASH_PRECISION = 7
+WINDOW = 20 # voisines comparées dans un bloc trié par prix
+PRICE_TOL = 0.05 # écart de prix relatif max
+SURFACE_TOL = 0.10 # écart de surface relatif max (si les deux surfaces sont connues)
+MAX_DISTANCE_M = 150 # distance max (si les deux annonces sont géolocalisées)
+MIN_SCORE = 0.75
+KEY_BATCH = 5000 # clés par requête de candidats
+
+BASE32 = np.array(list("0123456789bcdefghjkmnpqrstuvwxyz"))
+STREET_WORDS = {
+    "street": "st", "avenue": "ave", "av": "ave", "road": "rd", "drive": "dr", "boulevard": "blvd", "crescent": "cres",
+    "court": "ct", "place": "pl", "lane": "ln", "terrace": "terr", "highway": "hwy", "parkway": "pkwy", "circle": "cir",
+    "square": "sq", "trail": "trl", "north": "n", "south": "s", "east": "e", "west": "w", "rue": "r", "chemin": "ch",
+    "unit": "", "apt": "", "suite": "", "ste": "", "the": "",
+}
+
+COLUMNS_SQL = """
+    p.id, p.title, p.address, p.price::float AS price, p.surface::float AS surface, p.rooms,
+    p.latitude::float AS latitude, p.longitude::float AS longitude, p.geo_precision, p.listing_type, p.scraped_at
+"""
+NEW_SQL = f"""
+    SELECT {COLUMNS_SQL}, NULL AS cluster_id
+    FROM public.properties p
+    WHERE NOT EXISTS (SELECT 1 FROM listing_clusters c WHERE c.property_id = p.id)
+"""
+CANDIDATE_CLUSTERS_SQL = """
+    SELECT DISTINCT cluster_id FROM listing_clusters
+    WHERE cell = ANY(%s) OR cell_alt = ANY(%s) OR address_key = ANY(%s)
+"""
+MEMBERS_SQL = f"""
+    SELECT {COLUMNS_SQL}, c.cluster_id
+    FROM listing_clusters c
+    JOIN public.properties p ON p.id = c.property_id
+    WHERE c.cluster_id = ANY(%s)
+"""
+UPSERT_SQL = """
+    INSERT INTO listing_clusters(property_id, cluster_id, is_canonical, listing_type, cell, cell_alt, address_key, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+    ON CONFLICT (property_id) DO UPDATE
+      SET cluster_id = EXCLUDED.cluster_id, is_canonical = EXCLUDED.is_canonical, cell = EXCLUDED.cell,
+          cell_alt = EXCLUDED.cell_alt, address_key = EXCLUDED.address_key, updated_at = NOW()
+"""
+
+# --- clés de blocage ---
+# Geohash vectorisé (bits longitude/latitude entrelacés, 5 bits par caractère) ; None si pas de coordonnées
+def geohash(lat, lon, precision=GEOHASH_PRECISION):
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    n_bits = precision * 5
+    lon_bits, lat_bits = (n_bits + 1) // 2, n_bits // 2
+    ok = ~(np.isnan(lat) | np.isnan(lon))
+    lat_i = np.clip(np.floor((np.nan_to_num(lat) + 90) / 180 * 2 ** lat_bits), 0, 2 ** lat_bits - 1).astype(np.int64)
+    lon_i = np.clip(np.floor((np.nan_to_num(lon) + 180) / 360 * 2 ** lon_bits), 0, 2 ** lon_bits - 1).astype(np.int64)
+    code = np.zeros(len(lat), dtype=np.int64)
+    for k in range(n_bits): # bit k (depuis le poids fort) : longitude si k pair, latitude sinon
+        bit = (lon_i >> (lon_bits - 1 - k // 2)) & 1 if k % 2 == 0 else (lat_i >> (lat_bits - 1 - k // 2)) & 1
+        code = (code << 1) | bit
+    chars = [BASE32[(code >> (n_bits - 5 * (c + 1))) & 31] for c in range(precision)]
+    out = chars[0].astype(object)
+    for c in chars[1:]:
+        out = out + c
+    return np.where(ok, out, None)
+
+# Taille d'une case geohash en degrés (latitude, longitude) : sert au décalage de la 2e grille
+def cell_size(precision=GEOHASH_PRECISION):
+    n_bits = precision * 5
+    return 180 / 2 ** (n_bits // 2), 360 / 2 ** ((n_bits + 1) // 2)
+
+def _ascii(text):
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+
+def _tokens(text):
+    return [STREET_WORDS.get(t, t) for t in re.findall(r"[a-z0-9]+", _ascii(text or ""))]
+
+# "1203 - 15 Queen Street West, Toronto (Downtown), ON, ..." -> "1203 15 queen st w|toronto"
+def address_key(address):
+    if not isinstance(address, str) or not address.strip():
+        return None
+    parts = [re.sub(r"\(.*?\)", "", p) for p in address.split(",")]
+    street = " ".join(t for t in _tokens(parts[0]) if t)
+    if not re.search(r"\d", street): # sans numéro, l'adresse ne désigne pas un bien précis
+        return None
+    city = " ".join(t for t in _tokens(parts[1]) if t) if len(parts) > 1 else ""
+    return f"{street}|{city}"
+
+# Coordonnées de l'annonce elle-même (NaN pour un centroïde : toutes les annonces d'une ville tomberaient dans la même cellule)
+def _coordinates(df):
+    lat, lon = df["latitude"].to_numpy(dtype=float, copy=True), df["longitude"].to_numpy(dtype=float, copy=True)
+    if "geo_precision" in df:
+        centroid = is_centroid(df["geo_precision"])
+        lat[centroid], lon[centroid] = np.nan, np.nan
+    return lat, lon
+
+def blocking_keys(df):
+    rooms = df["rooms"].map(lambda r: "x" if pd.isna(r) else str(int(r)))
+    dlat, dlon = cell_size()
+    lat, lon = _coordinates(df)
+    gh = geohash(lat, lon)
+    gh_alt = geohash(lat + dlat / 2, lon + dlon / 2)
+    return pd.DataFrame({
+        "cell": [None if g is None else f"{g}:{r}" for g, r in zip(gh, rooms)],
+        "cell_alt": [None if g is None else f"{g}:{r}" for g, r in zip(gh_alt, rooms)],
+        "address_key": df["address"].map(address_key),
+    }, index=df.index)
+
+# --- paires candidates et score ---
+# Paires (i, j) de lignes partageant une clé (même type d'annonce), chaque ligne comparée à ses window voisines par prix
+def candidate_pairs(df, keys, window=WINDOW):
+    price = df["price"].fillna(-1).to_numpy()
+    out = []
+    for col in ("cell", "cell_alt", "address_key"):
+        block = np.where(keys[col].notna(), df["listing_type"].astype(str) + "|" + keys[col].astype(str), None)
+        codes, _ = pd.factorize(block)
+        order = np.lexsort((price, codes))
+        c = codes[order]
+        for off in range(1, min(window, len(order) - 1) + 1):
+            same = (c[off:] == c[:-off]) & (c[off:] >= 0)
+            out.append(np.column_stack([order[:-off][same], order[off:][same]]))
+    if not out:
+        return np.empty((0, 2), dtype=np.int64)
+    pairs = np.sort(np.concatenate(out), axis=1)
+    return np.unique(pairs, axis=0)
+
+def _haversine_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371000 * np.arcsin(np.sqrt(a))
+
+def _rel_diff(a, b):
+    return np.abs(a - b) / np.maximum(np.maximum(np.abs(a), np.abs(b)), 1e-9)
+
+# Score des paires (vectorisé sauf la similarité des titres, calculée seulement pour les paires qui passent les filtres durs)
+def score_pairs(df, keys, pairs):
+    if len(pairs) == 0:
+        return pairs, np.array([])
+    i, j = pairs[:, 0], pairs[:, 1]
+    price, surface = df["price"].to_numpy(dtype=float), df["surface"].to_numpy(dtype=float)
+    rooms = df["rooms"].to_numpy(dtype=float)
+    lat, lon = _coordinates(df)
+
+    dp = _rel_diff(price[i], price[j])
+    ds = _rel_diff(surface[i], surface[j])
+    dist = _haversine_m(lat[i], lon[i], lat[j], lon[j])
+    ok = (df["listing_type"].to_numpy()[i] == df["listing_type"].to_numpy()[j]) & (dp <= PRICE_TOL)
+    ok &= np.isnan(rooms[i]) | np.isnan(rooms[j]) | (rooms[i] == rooms[j])
+    ok &= np.isnan(ds) | (ds <= SURFACE_TOL)
+    ok &= np.isnan(dist) | (dist <= MAX_DISTANCE_M)
+    # numéros de l'adresse (civique, lot, logement) : l'un doit contenir l'autre ("43 Starfire Dr" ~ "43 Starfire Dr Apt 3", pas "Apt 3" ~ "Apt 4")
+    numbers = keys["address_key"].map(lambda k: frozenset(re.findall(r"\d+", k.split("|")[0])) if isinstance(k, str) else None).to_numpy()
+    ok &= np.array([a is None or b is None or a <= b or b <= a for a, b in zip(numbers[i], numbers[j])], dtype=bool)
+    i, j, dp, ds, dist = i[ok], j[ok], dp[ok], ds[ok], dist[ok]
+
+    tokens = {k: set(_tokens(df["title"].iat[k])) for k in np.unique(np.concatenate([i, j]))}
+    akey = keys["address_key"].to_numpy()
+    title_sim = np.array([
+        1.0 if akey[a] is not None and akey[a] == akey[b] else len(tokens[a] & tokens[b]) / max(len(tokens[a] | tokens[b]), 1)
+        for a, b in zip(i, j)
+    ])
+    score = (0.35 * (1 - dp / PRICE_TOL)
+             + 0.20 * np.where(np.isnan(ds), 0.5, 1 - ds / SURFACE_TOL)
+             + 0.25 * title_sim
+             + 0.20 * np.where(np.isnan(dist), 0.5, 1 - dist / MAX_DISTANCE_M))
+    keep = score >= MIN_SCORE
+    return np.column_stack([i[keep], j[keep]]), score[keep]
+
+# Groupes : composantes connexes des paires retenues + appartenance aux groupes déjà enregistrés
+# cluster_id = plus petit id du groupe, annonce canonique = la plus récente (scraped_at puis id)
+def assign_clusters(df, matches):
+    n = len(df)
+    edges = [matches]
+    known = df["cluster_id"].notna().to_numpy()
+    if known.any():
+        pos = np.flatnonzero(known)
+        first = pd.Series(pos).groupby(df["cluster_id"].to_numpy()[pos]).transform("first").to_numpy()
+        edges.append(np.column_stack([pos, first]))
+    e = np.concatenate(edges) if edges else np.empty((0, 2), dtype=np.int64)
+    graph = sparse.coo_matrix((np.ones(len(e)), (e[:, 0], e[:, 1])), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+    out = pd.DataFrame({"label": labels, "id": df["id"].to_numpy(), "scraped_at": df["scraped_at"].to_numpy()})
+    cluster_id = out.groupby("label")["id"].transform("min")
+    latest = out.sort_values(["scraped_at", "id"]).groupby("label")["id"].transform("last").reindex(out.index)
+    return cluster_id.to_numpy(), (latest == out["id"]).to_numpy()
+
+def _read(cursor, q, params=None):
+    cursor.execute(q, params)
+    return pd.DataFrame(cursor.fetchall(), columns=[c[0] for c in cursor.description])
+
+def _chunks(values, size=KEY_BATCH):
+    values = sorted({v for v in values if isinstance(v, str) or (v is not None and pd.notna(v))})
+    return [values[k:k + size] for k in range(0, len(values), size)] or [[]]
+
+# Passe de dédoublonnage : incrémentale par défaut (annonces pas encore examinées), full=True repart de zéro
+def run_dedup(full=False):
+    start = time.time()
+    try:
+        connexion = get_connection()
+        if connexion is None:
+            print("erreur")
+            return None
+        cursor = connexion.cursor()
+        if full:
+            cursor.execute("DELETE FROM listing_clusters")
+        new = _read(cursor, NEW_SQL)
+        if new.empty:
+            cursor.close()
+            connexion.close()
+            print("Dédoublonnage : aucune nouvelle annonce")
+            return {"new": 0, "pairs": 0, "matches": 0, "duplicates": 0}
+        new_keys = blocking_keys(new)
+
+        # annonces déjà groupées qui partagent une clé avec les nouvelles, avec tous les membres de leurs groupes
+        cluster_ids = set()
+        for cells, alts, addrs in zip_longest(_chunks(new_keys["cell"]), _chunks(new_keys["cell_alt"]), _chunks(new_keys["address_key"]), fillvalue=[]):
+            cursor.execute(CANDIDATE_CLUSTERS_SQL, (cells, alts, addrs))
+            cluster_ids.update(r[0] for r in cursor.fetchall())
+        members = [_read(cursor, MEMBERS_SQL, (ids,)) for ids in _chunks(cluster_ids)]
+        df = pd.concat([new] + [m for m in members if len(m)], ignore_index=True)
+        df["scraped_at"] = pd.to_datetime(df["scraped_at"])
+        keys = blocking_keys(df)
+
+        pairs = candidate_pairs(df, keys)
+        is_new = np.zeros(len(df), dtype=bool)
+        is_new[:len(new)] = True
+        pairs = pairs[is_new[pairs[:, 0]] | is_new[pairs[:, 1]]] # paires entre anciennes annonces déjà jugées
+        matches, _ = score_pairs(df, keys, pairs)
+        cluster_id, canonical = assign_clusters(df, matches)
+
+        rows = [
+            (int(pid), int(cid), bool(can), lt, cell, alt, akey)
+            for pid, cid, can, lt, cell, alt, akey in zip(df["id"], cluster_id, canonical, df["listing_type"],
+                                                           keys["cell"], keys["cell_alt"], keys["address_key"])
+        ]
+        execute_batch(cursor, UPSERT_SQL, rows, page_size=1000)
+        connexion.commit()
+        cursor.close()
+        connexion.close()
+    except Exception as e:
+        print(f"Erreur lors du dédoublonnage : {e}")
+        return None
+
+    stats = {"new": len(new), "pairs": len(pairs), "matches": len(matches), "duplicates": int((~canonical).sum())}
+    print(f"Dédoublonnage : {stats['new']} annonces examinées, {stats['pairs']} paires comparées, "
+          f"{stats['matches']} doublons trouvés, {stats['duplicates']} annonces non canoniques parmi les groupes touchés "
+          f"({time.time() - start:,.1f}s)")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dédoublonnage des annonces (listing_clusters)")
+    parser.add_argument("--full", action="store_true", help="recalcule tous les groupes au lieu des seules nouvelles annonces")
+    args = parser.parse_args()
+    run_dedup(full=args.full)
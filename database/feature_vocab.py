@@ -0,0 +1,67 @@
+import threading
+import pandas as pd
+from database.connection import get_connection
+from pipeline.log import get_logger
+
+# Caractéristiques d'annonces codées en entiers (table feature_vocab, détail dans migrations/0009_feature_vocab.sql).
+# Le cache nom -> id est partagé par tous les threads du scraper : seule une caractéristique jamais vue coûte un aller-retour en base.
+_cache = {}
+_lock = threading.Lock()
+log = get_logger("database.feature_vocab")
+
+def _lookup(cursor, names):
+    cursor.execute("SELECT name, id FROM feature_vocab WHERE name = ANY(%s)", (list(names),))
+    return dict(cursor.fetchall())
+
+# Liste de caractéristiques (textes) -> tableau d'ids trié sans doublon ; les nouvelles sont ajoutées au vocabulaire (insert=False : ignorées)
+def encode_features(names, insert=True):
+    names = {n for n in (names or []) if n}
+    if not names:
+        return []
+    with _lock:
+        missing = names.difference(_cache)
+    if missing:
+        try:
+            connexion = get_connection()
+            if connexion is None:
+                log.error("connection_failed")
+                return []
+            cursor = connexion.cursor()
+            found = _lookup(cursor, missing)
+            new = sorted(missing.difference(found))
+            if new and insert:
+                cursor.executemany("INSERT INTO feature_vocab(name) VALUES (%s) ON CONFLICT (name) DO NOTHING", [(n,) for n in new])
+                connexion.commit()
+                found.update(_lookup(cursor, new)) # relu : un autre thread a pu insérer le même nom entre-temps
+            cursor.close()
+            connexion.close()
+            with _lock:
+                _cache.update(found)
+        except Exception as e:
+            log.error("vocab_failed", error=str(e))
+    with _lock:
+        return sorted({_cache[n] for n in names if n in _cache})
+
+# Vocabulaire complet id -> nom (noms lisibles des colonnes d'équipements du modèle)
+def load_vocab():
+    connexion = get_connection()
+    df = pd.read_sql("SELECT id, name FROM feature_vocab ORDER BY id", connexion)
+    connexion.close()
+    return dict(zip(df["id"], df["name"]))
+
+# Annonces possédant toutes les caractéristiques demandées (index GIN : feature_ids @> ARRAY[...])
+def find_listings_with(names, listing_type=None, limit=1000):
+    ids = encode_features(names, insert=False)
+    if len(ids) < len(set(names)):
+        return pd.DataFrame(columns=["id", "title", "address", "price", "listing_type"]) # une caractéristique inconnue -> aucune annonce
+    q = "SELECT id, title, address, price::float AS price, listing_type FROM public.properties WHERE feature_ids @> %s::int[]"
+    params = [ids]
+    if listing_type is not None:
+        q += " AND listing_type = %s"
+        params.append(listing_type)
+    q += " LIMIT %s"
+    params.append(int(limit))
+    connexion = get_connection()
+    df = pd.read_sql(q, connexion, params=params)
+    connexion.close()
+    return df
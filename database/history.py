@@ -0,0 +1,148 @@
+from datetime import datetime
+from database.connection import get_connection, execute_batch
+from database.feature_vocab import encode_features
+from pipeline.log import get_logger
+
+log = get_logger("database.history")
+
+# Historique des annonces (tables listing_state / price_history, détail dans migrations/0008_price_history.sql) :
+# une annonce déjà connue n'est plus réécrite à chaque scraping, seuls son état courant et ses changements de prix/statut sont enregistrés.
+
+# Annonces actives à la date as_of, au prix connu à cette date (dernière observation <= as_of) ; même colonnes que load_data
+AS_OF_SQL = """
+    WITH h AS (
+        SELECT property_id, price, status
+        FROM (
+            SELECT property_id, price, status, ROW_NUMBER() OVER (PARTITION BY property_id ORDER BY observed_at DESC) AS rn
+            FROM price_history
+            WHERE listing_type = %(lt)s AND observed_at <= %(as_of)s
+        ) o
+        WHERE rn = 1
+    )
+    SELECT
+    p.id, p.title, p.address, h.price::float AS price, p.surface,
+    p.rooms, p.property_type, p.latitude, p.longitude, p.geo_precision, p.scraped_at, p.updated_at, p.source, p.feature_ids
+    FROM h
+    JOIN public.properties p ON p.id = h.property_id
+    WHERE p.listing_type = %(lt)s AND p.scraped_at <= %(as_of)s
+      AND h.status = 'active' AND h.price IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM listing_clusters c WHERE c.property_id = p.id AND NOT c.is_canonical)
+"""
+
+def _same_price(a, b):
+    if a is None or b is None:
+        return a is None and b is None
+    return round(float(a), 2) == round(float(b), 2)
+
+# Enregistre une annonce vue par le scraper (mêmes paramètres que save_property, + geo_precision si les coordonnées viennent du gazetier)
+# et renvoie (property_id, changement) :
+# les caractéristiques sont stockées en ids (feature_ids, vocabulaire feature_vocab), plus en liste de textes
+# - 1re apparition : ligne complète dans properties + état courant + observation initiale -> "new"
+# - déjà connue : seul listing_state est mis à jour ; price_history reçoit une ligne si le prix a changé ("price")
+#   ou si l'annonce réapparaît après avoir été retirée ("status"), sinon changement = None
+def record_listing(title, price, address, surface, rooms, property_type, latitude, longitude, description, features, source, url, listing_type, scraped_at, feature_ids=None, geo_precision=None):
+    seen_at = scraped_at or datetime.utcnow()
+    if feature_ids is None:
+        feature_ids = encode_features(features)
+    try:
+        connexion = get_connection()
+        if connexion is None:
+            log.error("connection_failed")
+            return None, None
+
+        cursor = connexion.cursor()
+        cursor.execute("SELECT property_id FROM property_urls WHERE source = %s AND url = %s", (source, url))
+        row = cursor.fetchone()
+
+        if row is None:
+            cursor.execute("""
+                INSERT INTO properties
+                (title, price, address, surface, rooms, property_type, latitude, longitude, geo_precision, description, feature_ids, source, url, listing_type, scraped_at)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+                """, (title, price, address, surface, rooms, property_type, latitude, longitude, geo_precision, description, feature_ids, source, url, listing_type, seen_at))
+            property_id = cursor.fetchone()[0]
+            cursor.execute("""
+                INSERT INTO listing_state(property_id, listing_type, status, price, first_seen_at, last_seen_at, changed_at)
+                VALUES (%s, %s, 'active', %s, %s, %s, %s)
+                """, (property_id, listing_type, price, seen_at, seen_at, seen_at))
+            change = "new"
+        else:
+            property_id = row[0]
+            cursor.execute("SELECT price, status FROM listing_state WHERE property_id = %s FOR UPDATE", (property_id,))
+            state = cursor.fetchone()
+            if state is None: # annonce antérieure à l'historique
+                cursor.execute("""
+                    INSERT INTO listing_state(property_id, listing_type, status, price, first_seen_at, last_seen_at, changed_at)
+                    VALUES (%s, %s, 'active', %s, %s, %s, %s)
+                    """, (property_id, listing_type, price, seen_at, seen_at, seen_at))
+                change = "price"
+            else:
+                old_price, old_status = state
+                change = "price" if not _same_price(old_price, price) else ("status" if old_status != "active" else None)
+                cursor.execute("""
+                    UPDATE listing_state
+                    SET last_seen_at = %s, price = %s, status = 'active', changed_at = CASE WHEN %s THEN %s ELSE changed_at END
+                    WHERE property_id = %s
+                    """, (seen_at, price, change is not None, seen_at, property_id))
+            if change == "price":
+                # prix courant gardé à jour dans properties (lu par l'entraînement et le dashboard) ; updated_at : relu par les chargements incrémentaux
+                cursor.execute("UPDATE properties SET price = %s, updated_at = %s WHERE id = %s", (price, seen_at, property_id))
+
+        if change is not None:
+            cursor.execute("""
+                INSERT INTO price_history(property_id, listing_type, observed_at, price, status)
+                VALUES (%s, %s, %s, %s, 'active')
+                """, (property_id, listing_type, seen_at, price))
+
+        connexion.commit()
+        cursor.close()
+        connexion.close()
+        return property_id, change
+    except Exception as e:
+        log.error("record_failed", key=source, url=url, error=str(e))
+        return None, None
+
+# Après un scraping complet (tout le sitemap lu, limite non atteinte) : les annonces actives de la source absentes de la liste
+# publiée (listed_urls) et non revues depuis crawl_started_at passent "removed". Une annonce listée mais dont la page n'a pas pu
+# être lue (erreur réseau) reste active ; un scraping partiel ne doit jamais appeler cette fonction.
+def close_unseen_listings(source, listed_urls, crawl_started_at):
+    try:
+        connexion = get_connection()
+        if connexion is None:
+            print("erreur")
+            return 0
+
+        now = datetime.utcnow() # même horloge que scraped_at (scraper)
+        cursor = connexion.cursor()
+        cursor.execute("""
+            SELECT s.property_id, u.url
+            FROM listing_state s
+            JOIN property_urls u ON u.property_id = s.property_id
+            WHERE u.source = %s AND s.status = 'active' AND s.last_seen_at < %s
+            """, (source, crawl_started_at))
+        rows = cursor.fetchall()
+        listed_urls = set(listed_urls)
+        still_listed = {pid for pid, url in rows if url in listed_urls}
+        gone = sorted({pid for pid, _ in rows} - still_listed)
+        # observation "removed" puis changement d'état, dans la même transaction (SQL commun PostgreSQL / SQLite)
+        execute_batch(cursor, """
+            INSERT INTO price_history(property_id, listing_type, observed_at, price, status)
+            SELECT property_id, listing_type, %s, price, 'removed'
+            FROM listing_state
+            WHERE property_id = %s AND status = 'active'
+            """, [(now, pid) for pid in gone], page_size=1000)
+        execute_batch(cursor, """
+            UPDATE listing_state
+            SET status = 'removed', changed_at = %s
+            WHERE property_id = %s AND status = 'active'
+            """, [(now, pid) for pid in gone], page_size=1000)
+        n = len(gone)
+        connexion.commit()
+        cursor.close()
+        connexion.close()
+        print(f"{n} annonces {source} retirées (absentes du sitemap, non revues depuis {crawl_started_at:%Y-%m-%d %H:%M})")
+        return n
+    except Exception as e:
+        print(f"Erreur lors de la fermeture des annonces : {e}")
+        return 0
@@ -0,0 +1,157 @@
+import os
+import re
+import sys
+import shutil
+import argparse
+import subprocess
+from pathlib import Path
+from database.connection import get_connection, backend, execute_batch, DEFAULT_SQLITE_PATH
+
+# Charge les données d'un dump PostgreSQL (format custom, ex: dump_local.dump) dans le stockage embarqué SQLite.
+# pg_restore -f - (client seul, aucun serveur nécessaire) écrit les blocs "COPY table (...) FROM stdin;" en texte :
+# ils sont lus ligne à ligne et insérés par lots de BATCH_SIZE, mémoire constante quelle que soit la taille du dump.
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_DUMP = ROOT / "dump_local.dump"
+TABLES = ("properties", "price_predictions") # tables lues par le scraper / l'entraînement / le dashboard
+BATCH_SIZE = 5000
+
+COPY_RE = re.compile(r"^COPY (?:public\.)?(\w+) \((.*)\) FROM stdin;$")
+ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v", "\\": "\\"}
+
+# Reprise de l'existant une fois les lignes chargées (équivalent SQLite des migrations 0008 / 0009)
+BACKFILL_SQL = [
+    """
+    INSERT OR IGNORE INTO listing_state(property_id, listing_type, status, price, first_seen_at, last_seen_at, changed_at)
+    SELECT id, listing_type, 'active', price, scraped_at, scraped_at, scraped_at FROM properties
+    """,
+    """
+    INSERT INTO price_history(property_id, listing_type, observed_at, price, status)
+    SELECT p.id, p.listing_type, p.scraped_at, p.price, 'active' FROM properties p
+    WHERE NOT EXISTS (SELECT 1 FROM price_history h WHERE h.property_id = p.id)
+    ORDER BY p.scraped_at
+    """,
+    """
+    INSERT OR IGNORE INTO feature_vocab(name)
+    SELECT j.value FROM properties p, json_each(p.features) j
+    WHERE j.value <> ''
+    GROUP BY j.value
+    ORDER BY COUNT(*) DESC, j.value
+    """,
+    """
+    UPDATE properties SET feature_ids = (
+        SELECT json_group_array(id) FROM (
+            SELECT DISTINCT v.id FROM json_each(properties.features) j JOIN feature_vocab v ON v.name = j.value ORDER BY v.id
+        )
+    )
+    WHERE features IS NOT NULL AND feature_ids IS NULL
+    """,
+]
+
+# Champ du format texte COPY -> valeur Python (\N = NULL, séquences d'échappement)
+def _unescape(field):
+    if field == "\\N":
+        return None
+    if "\\" not in field:
+        return field
+    return re.sub(r"\\(.)", lambda m: ESCAPES.get(m.group(1), m.group(1)), field)
+
+# Tableau PostgreSQL en texte ({a,b,"c d"}) -> liste Python
+def _parse_array(value):
+    if value is None:
+        return None
+    inner = value[1:-1]
+    if not inner:
+        return []
+    items = re.findall(r'"((?:[^"\\]|\\.)*)"|([^,]+)', inner)
+    return [re.sub(r"\\(.)", r"\1", quoted) if quoted else (None if bare == "NULL" else bare) for quoted, bare in items]
+
+# Lignes "COPY" du dump, par table : (table, colonnes, générateur de lignes)
+def _copy_blocks(stream):
+    for line in stream:
+        m = COPY_RE.match(line.rstrip("\n"))
+        if not m:
+            continue
+        table, columns = m.group(1), [c.strip() for c in m.group(2).split(",")]
+        yield table, columns, _copy_rows(stream)
+
+def _copy_rows(stream):
+    for line in stream:
+        if not line.endswith("\n"): # ligne coupée (pg_restore interrompu) : l'échec est signalé par son code retour
+            return
+        line = line.rstrip("\n")
+        if line == "\\.":
+            return
+        yield [_unescape(f) for f in line.split("\t")]
+
+def _flush(cursor, query, batch):
+    if batch:
+        execute_batch(cursor, query, batch, page_size=BATCH_SIZE)
+    return len(batch)
+
+def import_dump(dump_path=DEFAULT_DUMP, tables=TABLES):
+    if backend() != "sqlite":
+        print("import_dump remplit le stockage SQLite (DB_BACKEND=sqlite) ; pour PostgreSQL, utiliser pg_restore directement")
+        return {}
+    pg_restore = shutil.which("pg_restore")
+    if pg_restore is None:
+        print("pg_restore introuvable (client PostgreSQL requis pour lire le format custom du dump)")
+        return {}
+
+    from database.models import run_migrations
+    run_migrations() # schéma SQLite
+
+    args = [pg_restore, "--data-only", "-f", "-"] + [a for t in tables for a in ("-t", t)] + [str(dump_path)]
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, text=True, encoding="utf-8")
+    connexion = get_connection()
+    cursor = connexion.cursor()
+    counts = {}
+    try:
+        for table, columns, rows in _copy_blocks(proc.stdout):
+            if table not in tables:
+                for _ in rows:
+                    pass
+                continue
+            cursor.execute(f"DELETE FROM {table}") # import idempotent : la table est remplacée
+            if table == "properties": # tables dérivées des annonces, reconstruites par BACKFILL_SQL et run_dedup
+                for derived in ("property_urls", "listing_state", "price_history", "listing_clusters"):
+                    cursor.execute(f"DELETE FROM {derived}")
+            query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+            arrays = [i for i, c in enumerate(columns) if c == "features"]
+            batch, n = [], 0
+            for row in rows:
+                for i in arrays:
+                    row[i] = _parse_array(row[i])
+                batch.append(row)
+                if len(batch) >= BATCH_SIZE:
+                    n += _flush(cursor, query, batch)
+                    batch = []
+            n += _flush(cursor, query, batch)
+            counts[table] = n
+            print(f"{table} : {n} lignes importées")
+        # pg_restore interrompu (dump tronqué, table illisible) : rien n'est gardé, la base reste dans son état d'avant l'import
+        if proc.wait():
+            connexion.rollback()
+            raise RuntimeError(f"pg_restore a échoué (code {proc.returncode}), import annulé")
+        for q in BACKFILL_SQL:
+            cursor.execute(q)
+        connexion.commit()
+    finally:
+        cursor.close()
+        connexion.close()
+        proc.stdout.close()
+        proc.wait()
+    if "properties" in counts:
+        from database.dedup import run_dedup
+        run_dedup(full=True)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import d'un dump PostgreSQL dans le stockage SQLite local")
+    parser.add_argument("dump", nargs="?", default=str(DEFAULT_DUMP))
+    parser.add_argument("--sqlite", default=None, help=f"fichier SQLite cible (défaut : SQLITE_PATH ou {DEFAULT_SQLITE_PATH})")
+    args = parser.parse_args()
+    os.environ.setdefault("DB_BACKEND", "sqlite")
+    if args.sqlite:
+        os.environ["SQLITE_PATH"] = args.sqlite
+    sys.exit(0 if import_dump(args.dump) else 1)
@@ -0,0 +1,17 @@
+-- Résultats des backtests (ml_models/backtest.py), une ligne par fenêtre temporelle
+CREATE TABLE IF NOT EXISTS backtest_results (
+    id SERIAL PRIMARY KEY,
+    run_id VARCHAR(40) NOT NULL,
+    listing_type VARCHAR(10),
+    mode VARCHAR(10), -- expanding ou rolling
+    window_index INTEGER,
+    train_start TIMESTAMP,
+    test_start TIMESTAMP,
+    test_end TIMESTAMP,
+    n_train INTEGER,
+    n_test INTEGER,
+    mae DOUBLE PRECISION,
+    mape DOUBLE PRECISION,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_backtest_results_run ON backtest_results(run_id);
@@ -0,0 +1,5 @@
+-- Index pour les filtres du dashboard poussés en SQL (dashboard/utils.py : build_filter_sql, query_kpis, query_table_page)
+CREATE INDEX IF NOT EXISTS idx_properties_type_price ON properties(listing_type, price) INCLUDE (rooms, surface);
+CREATE INDEX IF NOT EXISTS idx_properties_price_id ON properties(price DESC, id DESC); -- pagination par clé (price, id)
+CREATE INDEX IF NOT EXISTS idx_properties_rooms ON properties(rooms);
+CREATE INDEX IF NOT EXISTS idx_properties_surface ON properties(surface);
@@ -0,0 +1,57 @@
+-- Tables pré-agrégées pour les graphes du dashboard (rafraîchies par database/aggregates.py après chaque scraping / entraînement)
+CREATE TABLE IF NOT EXISTS agg_city_stats (
+    listing_type VARCHAR(10),
+    city TEXT,
+    n INTEGER,
+    median_price DOUBLE PRECISION,
+    mean_price DOUBLE PRECISION,
+    std_price DOUBLE PRECISION,
+    PRIMARY KEY (listing_type, city)
+);
+
+CREATE TABLE IF NOT EXISTS agg_price_per_sqm (
+    listing_type VARCHAR(10) PRIMARY KEY,
+    n INTEGER,
+    mean DOUBLE PRECISION,
+    p01 DOUBLE PRECISION,
+    q1 DOUBLE PRECISION,
+    median DOUBLE PRECISION,
+    q3 DOUBLE PRECISION,
+    p99 DOUBLE PRECISION
+);
+
+CREATE TABLE IF NOT EXISTS agg_rooms_box (
+    listing_type VARCHAR(10),
+    rooms_bin INTEGER, -- 0..6 (6 = 6 et plus)
+    n INTEGER,
+    min_price DOUBLE PRECISION,
+    q1 DOUBLE PRECISION,
+    median DOUBLE PRECISION,
+    q3 DOUBLE PRECISION,
+    max_price DOUBLE PRECISION,
+    PRIMARY KEY (listing_type, rooms_bin)
+);
+
+CREATE TABLE IF NOT EXISTS agg_rooms_counts (
+    listing_type VARCHAR(10),
+    rooms INTEGER,
+    n INTEGER,
+    PRIMARY KEY (listing_type, rooms)
+);
+
+CREATE TABLE IF NOT EXISTS agg_price_histogram (
+    listing_type VARCHAR(10),
+    bucket INTEGER,
+    price_lo DOUBLE PRECISION,
+    price_hi DOUBLE PRECISION,
+    n INTEGER,
+    PRIMARY KEY (listing_type, bucket)
+);
+
+-- dernier état des annonces pris en compte par type (refresh incrémental)
+CREATE TABLE IF NOT EXISTS agg_refresh_state (
+    listing_type VARCHAR(10) PRIMARY KEY,
+    max_id INTEGER,
+    max_scraped_at TIMESTAMP,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,17 @@
+-- Bonnes affaires classées (database/deals.py), recalculées après chaque écriture de prédictions
+CREATE TABLE IF NOT EXISTS deal_scores (
+    property_id INTEGER PRIMARY KEY REFERENCES properties(id),
+    listing_type VARCHAR(10),
+    city TEXT,
+    property_type VARCHAR(50),
+    price DOUBLE PRECISION,
+    predicted_price DOUBLE PRECISION,
+    confidence_score DOUBLE PRECISION,
+    underpricing DOUBLE PRECISION, -- (prédit - prix) / prédit
+    score DOUBLE PRECISION, -- underpricing * confidence_score
+    rank_city INTEGER, -- rang du score dans (listing_type, city)
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_deal_scores_city_rank ON deal_scores(listing_type, city, rank_city);
+CREATE INDEX IF NOT EXISTS idx_deal_scores_type_score ON deal_scores(listing_type, score DESC);
+CREATE INDEX IF NOT EXISTS idx_deal_scores_underpricing ON deal_scores(underpricing);
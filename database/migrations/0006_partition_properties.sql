@@ -0,0 +1,117 @@
+-- properties partitionnée par type d'annonce (LIST) puis par mois de scraping (RANGE) :
+-- load_data (listing_type = %s) ne lit que la partition du type, les mises à jour incrémentales (scraped_at > %s) que les derniers mois.
+-- Contraintes PostgreSQL des tables partitionnées :
+--   * la clé primaire contient les colonnes de partition -> (id, listing_type, scraped_at), id reste unique via la séquence
+--   * plus de clé étrangère vers properties(id) (price_predictions, deal_scores)
+--   * l'unicité (source, url) est gardée par la table property_urls, remplie par trigger à chaque insertion
+
+ALTER TABLE properties RENAME TO properties_old;
+ALTER SEQUENCE properties_id_seq OWNED BY NONE;
+
+DO $$
+DECLARE c record;
+BEGIN
+    FOR c IN SELECT conname, conrelid::regclass AS tbl FROM pg_constraint
+             WHERE contype = 'f' AND confrelid = 'properties_old'::regclass LOOP
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', c.tbl, c.conname);
+    END LOOP;
+END $$;
+
+CREATE TABLE properties (
+    id INTEGER NOT NULL DEFAULT nextval('properties_id_seq'),
+    title VARCHAR(255) NOT NULL,
+    address TEXT,
+    price DECIMAL(12,2),
+    surface DECIMAL(8,2),
+    rooms INTEGER,
+    property_type VARCHAR(50), -- maison, appartement
+    latitude DECIMAL(10,8),
+    longitude DECIMAL(11,8),
+    description TEXT,
+    features TEXT[], -- [parking, balcon, cave]
+    source VARCHAR(50), -- c21 surtout
+    url TEXT,
+    listing_type VARCHAR(10) NOT NULL DEFAULT 'unknown', -- louable ou achetable
+    scraped_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, listing_type, scraped_at)
+) PARTITION BY LIST (listing_type);
+ALTER SEQUENCE properties_id_seq OWNED BY properties.id;
+
+CREATE TABLE properties_sale PARTITION OF properties FOR VALUES IN ('sale') PARTITION BY RANGE (scraped_at);
+CREATE TABLE properties_rent PARTITION OF properties FOR VALUES IN ('rent') PARTITION BY RANGE (scraped_at);
+CREATE TABLE properties_other PARTITION OF properties DEFAULT; -- types inattendus
+CREATE TABLE properties_sale_default PARTITION OF properties_sale DEFAULT;
+CREATE TABLE properties_rent_default PARTITION OF properties_rent DEFAULT;
+
+-- Crée les partitions mensuelles properties_<type>_<AAAAMM> manquantes du mois de start au mois de stop (inclus).
+-- Si la partition DEFAULT contient déjà des lignes de ce mois, elles sont déplacées dans la nouvelle partition.
+CREATE OR REPLACE FUNCTION ensure_properties_partitions(start_month DATE, stop_month DATE)
+RETURNS INTEGER AS $$
+DECLARE
+    lt TEXT;
+    m DATE;
+    part TEXT;
+    created INTEGER := 0;
+BEGIN
+    FOREACH lt IN ARRAY ARRAY['sale', 'rent'] LOOP
+        m := date_trunc('month', start_month)::date;
+        WHILE m <= stop_month LOOP
+            part := format('properties_%s_%s', lt, to_char(m, 'YYYYMM'));
+            IF to_regclass(part) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I (LIKE properties_%s INCLUDING DEFAULTS)', part, lt);
+                EXECUTE format('WITH moved AS (DELETE FROM properties_%s_default WHERE scraped_at >= %L AND scraped_at < %L RETURNING *) INSERT INTO %I SELECT * FROM moved',
+                               lt, m, (m + INTERVAL '1 month')::date, part);
+                EXECUTE format('ALTER TABLE properties_%s ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                               lt, part, m, (m + INTERVAL '1 month')::date);
+                created := created + 1;
+            END IF;
+            m := (m + INTERVAL '1 month')::date;
+        END LOOP;
+    END LOOP;
+    RETURN created;
+END $$ LANGUAGE plpgsql;
+
+-- partitions de l'historique existant + les 3 prochains mois, puis copie des données
+SELECT ensure_properties_partitions(
+    COALESCE((SELECT min(scraped_at) FROM properties_old), CURRENT_DATE)::date,
+    (CURRENT_DATE + INTERVAL '3 months')::date
+);
+INSERT INTO properties (id, title, address, price, surface, rooms, property_type, latitude, longitude,
+                        description, features, source, url, listing_type, scraped_at)
+SELECT id, title, address, price, surface, rooms, property_type, latitude, longitude,
+       description, features, source, url, COALESCE(listing_type, 'unknown'), COALESCE(scraped_at, CURRENT_TIMESTAMP)
+FROM properties_old;
+
+-- unicité (source, url) sur toutes les partitions
+CREATE TABLE IF NOT EXISTS property_urls (
+    source VARCHAR(50),
+    url TEXT,
+    property_id INTEGER,
+    PRIMARY KEY (source, url)
+);
+INSERT INTO property_urls(source, url, property_id)
+SELECT source, url, id FROM properties_old WHERE source IS NOT NULL AND url IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION properties_register_url() RETURNS trigger AS $$
+BEGIN
+    IF NEW.source IS NOT NULL AND NEW.url IS NOT NULL THEN
+        INSERT INTO property_urls(source, url, property_id) VALUES (NEW.source, NEW.url, NEW.id); -- doublon -> unique_violation comme avant
+    END IF;
+    RETURN NEW;
+END $$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_properties_register_url BEFORE INSERT ON properties
+FOR EACH ROW EXECUTE FUNCTION properties_register_url();
+
+DROP TABLE properties_old;
+
+-- index de 0001 / 0003 recréés sur la table partitionnée (propagés à chaque partition)
+CREATE INDEX IF NOT EXISTS idx_properties_id ON properties(id); -- jointures property_id = id sans les colonnes de partition
+CREATE INDEX IF NOT EXISTS idx_properties_price ON properties(price);
+CREATE INDEX IF NOT EXISTS idx_properties_area ON properties(address);
+CREATE INDEX IF NOT EXISTS idx_properties_scraped ON properties(scraped_at);
+CREATE INDEX IF NOT EXISTS idx_properties_type_price ON properties(listing_type, price) INCLUDE (rooms, surface);
+CREATE INDEX IF NOT EXISTS idx_properties_price_id ON properties(price DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_properties_rooms ON properties(rooms);
+CREATE INDEX IF NOT EXISTS idx_properties_surface ON properties(surface);
@@ -0,0 +1,17 @@
+-- Index des requêtes chaudes de l'entraînement et du dashboard (vérifiés par database/check_plans.py)
+
+-- BRIN sur scraped_at : quelques pages par partition, sert les filtres de plage (scraped_at > %s des mises à jour incrémentales)
+CREATE INDEX IF NOT EXISTS idx_properties_scraped_brin ON properties USING brin (scraped_at) WITH (pages_per_range = 32);
+
+-- load_data : annonces avec prix d'un type, dans l'ordre du temps (time_split / since)
+CREATE INDEX IF NOT EXISTS idx_properties_priced_scraped ON properties(scraped_at) WHERE price IS NOT NULL;
+
+-- jointure property_id des prédictions (load_properties_with_predictions, deal_scores) : couvrante, sans lecture de la table
+CREATE UNIQUE INDEX IF NOT EXISTS ux_price_predictions_property ON price_predictions(property_id);
+CREATE INDEX IF NOT EXISTS idx_price_predictions_property_cover ON price_predictions(property_id) INCLUDE (predicted_price, confidence_score, created_at);
+
+-- prédictions écrites depuis la dernière version (chargement incrémental du dashboard, data_version)
+CREATE INDEX IF NOT EXISTS idx_price_predictions_created ON price_predictions(created_at);
+
+ANALYZE properties;
+ANALYZE price_predictions;
@@ -0,0 +1,42 @@
+-- Historique compact des annonces (database/history.py) : la ligne complète de properties n'est écrite qu'à la 1re apparition,
+-- les passages suivants du scraper ne touchent que listing_state (état courant) et n'ajoutent une ligne à price_history
+-- que si le prix ou le statut a changé.
+
+-- état courant d'une annonce (une ligne par annonce, étroite)
+CREATE TABLE IF NOT EXISTS listing_state (
+    property_id INTEGER PRIMARY KEY,
+    listing_type VARCHAR(10),
+    status VARCHAR(10) NOT NULL DEFAULT 'active', -- active / removed
+    price DECIMAL(12,2),
+    first_seen_at TIMESTAMP NOT NULL,
+    last_seen_at TIMESTAMP NOT NULL,
+    changed_at TIMESTAMP NOT NULL -- dernier changement de prix ou de statut
+);
+CREATE INDEX IF NOT EXISTS idx_listing_state_last_seen ON listing_state(last_seen_at);
+
+-- changements de prix / statut, en ajout seulement (jamais de UPDATE ni de DELETE)
+CREATE TABLE IF NOT EXISTS price_history (
+    property_id INTEGER NOT NULL,
+    listing_type VARCHAR(10),
+    observed_at TIMESTAMP NOT NULL,
+    price DECIMAL(12,2),
+    status VARCHAR(10) NOT NULL DEFAULT 'active'
+);
+-- les lignes arrivent dans l'ordre du temps : un BRIN minuscule suffit pour les requêtes "à la date T"
+CREATE INDEX IF NOT EXISTS idx_price_history_observed_brin ON price_history USING brin (observed_at);
+CREATE INDEX IF NOT EXISTS idx_price_history_property ON price_history(property_id, observed_at DESC);
+
+-- reprise de l'existant : une observation initiale par annonce à sa date de scraping
+INSERT INTO listing_state(property_id, listing_type, status, price, first_seen_at, last_seen_at, changed_at)
+SELECT id, listing_type, 'active', price, scraped_at, scraped_at, scraped_at
+FROM properties
+ON CONFLICT (property_id) DO NOTHING;
+
+INSERT INTO price_history(property_id, listing_type, observed_at, price, status)
+SELECT p.id, p.listing_type, p.scraped_at, p.price, 'active'
+FROM properties p
+WHERE NOT EXISTS (SELECT 1 FROM price_history h WHERE h.property_id = p.id)
+ORDER BY p.scraped_at;
+
+ANALYZE listing_state;
+ANALYZE price_history;
@@ -0,0 +1,28 @@
+-- Vocabulaire des caractéristiques d'annonces (ex: "heat:forced_air") codées en entiers (database/feature_vocab.py).
+-- Chaque annonce stocke un tableau d'ids (feature_ids) au lieu de la liste de textes : ~4 octets par caractéristique,
+-- index GIN pour les filtres d'équipements (feature_ids @> ARRAY[...]) et matrice creuse directe côté ml_models.
+CREATE TABLE IF NOT EXISTS feature_vocab (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+ALTER TABLE properties ADD COLUMN IF NOT EXISTS feature_ids INTEGER[];
+
+-- reprise de l'existant : ids attribués par fréquence décroissante (les plus courants ont les plus petits ids)
+INSERT INTO feature_vocab(name)
+SELECT f
+FROM (SELECT unnest(features) AS f FROM properties) t
+WHERE f IS NOT NULL AND f <> ''
+GROUP BY f
+ORDER BY COUNT(*) DESC, f
+ON CONFLICT (name) DO NOTHING;
+
+UPDATE properties p
+SET feature_ids = (
+    SELECT array_agg(DISTINCT v.id ORDER BY v.id)
+    FROM unnest(p.features) f
+    JOIN feature_vocab v ON v.name = f
+)
+WHERE p.features IS NOT NULL AND p.feature_ids IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_properties_feature_ids ON properties USING gin (feature_ids);
@@ -0,0 +1,19 @@
+-- Dédoublonnage des annonces (database/dedup.py) : une ligne par annonce déjà examinée, avec son groupe de doublons.
+-- cluster_id = plus petit id du groupe (stable), is_canonical = annonce retenue pour l'entraînement et les bonnes affaires
+-- (la plus récente du groupe). cell / cell_alt / address_key sont les clés de blocage, indexées pour les passes incrémentales :
+-- une nouvelle annonce n'est comparée qu'aux annonces qui partagent l'une de ses clés.
+CREATE TABLE IF NOT EXISTS listing_clusters (
+    property_id INTEGER PRIMARY KEY,
+    cluster_id INTEGER NOT NULL,
+    is_canonical BOOLEAN NOT NULL DEFAULT TRUE,
+    listing_type VARCHAR(10),
+    cell VARCHAR(16), -- geohash (précision 7, ~150 m) + nb de chambres
+    cell_alt VARCHAR(16), -- même chose sur une grille décalée d'une demi-case (doublons à cheval sur deux cases)
+    address_key TEXT, -- adresse normalisée (numéro + rue + ville)
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_listing_clusters_cluster ON listing_clusters(cluster_id);
+CREATE INDEX IF NOT EXISTS idx_listing_clusters_cell ON listing_clusters(cell);
+CREATE INDEX IF NOT EXISTS idx_listing_clusters_cell_alt ON listing_clusters(cell_alt);
+CREATE INDEX IF NOT EXISTS idx_listing_clusters_address ON listing_clusters(address_key);
+CREATE INDEX IF NOT EXISTS idx_listing_clusters_duplicates ON listing_clusters(property_id) WHERE NOT is_canonical;
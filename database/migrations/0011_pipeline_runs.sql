@@ -0,0 +1,15 @@
+-- Exécutions de l'orchestrateur (pipeline/orchestrator.py) : une ligne par étape et par run, avec sa durée.
+-- watermark = état des entrées de l'étape relevé après son exécution (JSON) : au run suivant, une étape dont les entrées
+-- n'ont pas bougé depuis sa dernière exécution réussie est sautée.
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+    id SERIAL PRIMARY KEY,
+    run_id VARCHAR(32) NOT NULL,
+    stage VARCHAR(32) NOT NULL,
+    status VARCHAR(10) NOT NULL, -- ok / skipped / failed / blocked
+    watermark TEXT,
+    detail TEXT,
+    started_at TIMESTAMP NOT NULL,
+    duration_s DOUBLE PRECISION
+);
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_stage ON pipeline_runs(stage, started_at DESC);
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_run ON pipeline_runs(run_id);
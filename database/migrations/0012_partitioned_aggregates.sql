@@ -0,0 +1,28 @@
+-- Agrégats du dashboard maintenus par partition (database/aggregates.py) : partition = (type d'annonce, ville).
+-- Un refresh ne relit dans properties que les villes qui ont reçu une annonce nouvelle ou modifiée, puis redérive les tables
+-- de 0004 (agg_city_stats, agg_price_histogram...) à partir de ces comptages par classe logarithmique de prix.
+CREATE TABLE IF NOT EXISTS agg_city_price_bins (
+    listing_type VARCHAR(10),
+    city TEXT,
+    rooms INTEGER, -- NULL = nb de chambres inconnu
+    bin INTEGER, -- floor(log10(prix) * 1000)
+    n INTEGER,
+    total DOUBLE PRECISION, -- somme des prix (moyenne exacte)
+    total_sq DOUBLE PRECISION -- somme des carrés (écart type exact)
+);
+CREATE INDEX IF NOT EXISTS idx_agg_city_price_bins_city ON agg_city_price_bins(listing_type, city);
+
+CREATE TABLE IF NOT EXISTS agg_city_ppsqm_bins (
+    listing_type VARCHAR(10),
+    city TEXT,
+    bin INTEGER, -- floor(log10(prix / m2) * 1000)
+    n INTEGER,
+    total DOUBLE PRECISION,
+    PRIMARY KEY (listing_type, city, bin)
+);
+
+-- ville = 2e morceau de l'adresse (même expression que database/aggregates.py) : une ville se relit sans parcourir tout le type
+CREATE INDEX IF NOT EXISTS idx_properties_type_city ON properties(listing_type, (COALESCE(trim(split_part(address, ',', 2)), '')));
+
+-- les comptages par ville sont construits au premier refresh
+DELETE FROM agg_refresh_state;
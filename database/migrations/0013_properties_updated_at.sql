@@ -0,0 +1,9 @@
+-- Date de la dernière modification d'une annonce déjà insérée (changement de prix par database/history.py,
+-- coordonnées complétées par data_processing/geocoder.py) ; NULL = inchangée depuis son insertion (scraped_at).
+-- Les lectures incrémentales (dashboard, agrégats, mise à jour de la forêt, watermarks du pipeline) relisent
+-- les lignes scraped_at > x OR updated_at > x : une annonce repricée n'est plus invisible.
+ALTER TABLE properties ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_properties_updated ON properties(updated_at) WHERE updated_at IS NOT NULL;
+
+-- refresh des agrégats : dernière modification prise en compte
+ALTER TABLE agg_refresh_state ADD COLUMN IF NOT EXISTS max_updated_at TIMESTAMP;
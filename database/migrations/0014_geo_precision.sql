@@ -0,0 +1,6 @@
+-- Précision des coordonnées d'une annonce : NULL = coordonnées données par l'annonce elle-même,
+-- 'postal' / 'city' = centroïde du code postal / de la ville posé par le gazetier hors ligne (data_processing/geocoder.py).
+-- Les centroïdes sont partagés par toutes les annonces d'une même zone : le dédoublonnage (database/dedup.py) ne les utilise
+-- ni pour ses cases geohash ni pour la distance, et l'index de voisinage du modèle (ml_models/spatial.py) ne les indexe pas.
+-- Les coordonnées déjà complétées avant cette migration ne sont pas repérables et restent NULL.
+ALTER TABLE properties ADD COLUMN IF NOT EXISTS geo_precision VARCHAR(10);
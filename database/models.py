@@ -1,54 +1,121 @@
 import psycopg2
 from psycopg2 import sql
 import os
+import hashlib
 from pathlib import Path
-from database.connection import get_connection
+from database.connection import get_connection, backend
+from database.feature_vocab import encode_features
+from pipeline.log import get_logger
 
-# Fonction permettant de créer la base de donnée PostgreSQL via le fichier migrations.sql
+log = get_logger("database.models")
+
+# Migrations versionnées : database/migrations/<version>_<nom>.sql, appliquées dans l'ordre et une seule fois (table schema_migrations)
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+PARTITION_MONTHS_AHEAD = 3
+
+# Fonction permettant de créer / mettre à jour la base de donnée PostgreSQL : applique les migrations pas encore passées,
+# chacune dans sa transaction (une erreur annule la migration en cours et arrête les suivantes)
+# DB_BACKEND=sqlite : le fichier local reçoit directement le schéma final (database/sqlite_schema.sql)
 def run_migrations():
     try:
         connexion = get_connection()
         if connexion is None:
             print("erreur")
             return
+        if backend() == "sqlite":
+            from database.sqlite_backend import init_schema
+            init_schema(connexion)
+            connexion.close()
+            print("Schéma SQLite à jour")
+            return
         
         cursor = connexion.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(16) PRIMARY KEY,
+                name TEXT,
+                checksum CHAR(64),
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+        connexion.commit()
+        cursor.execute("SELECT version, checksum FROM schema_migrations")
+        applied = dict(cursor.fetchall())
 
-        # Lecture du fichier SQL
-        sql_script = Path("migrations.sql").read_text()
-
-        # Exécution du script complet
-        cursor.execute(sql_script)
+        for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+            version, name = path.stem.split("_", 1)
+            # Lecture du fichier SQL
+            sql_script = path.read_text(encoding="utf-8")
+            checksum = hashlib.sha256(sql_script.encode("utf-8")).hexdigest()
+            if version in applied:
+                if applied[version] != checksum:
+                    print(f"Attention : {path.name} a été modifiée après avoir été appliquée")
+                continue
+            try:
+                cursor.execute(sql_script)
+                cursor.execute("INSERT INTO schema_migrations(version, name, checksum) VALUES (%s, %s, %s)", (version, name, checksum))
+                connexion.commit()
+                print(f"Migration {path.name} appliquée")
+            except Exception as e:
+                connexion.rollback()
+                print(f"Erreur lors de la migration {path.name} : {e}")
+                break
 
-        connexion.commit()
         cursor.close()
         connexion.close()
+        ensure_partitions()
         print("Migrations exécutées")
         
     except Exception as e:
         print(f"Erreur lors de l'exécution des migrations : {e}")
 
-# Fonction permettant de sauvegarder les données passée en paramètre dans la table adaptée (properties)
-def save_property(title, price, address, surface, rooms, property_type, latitude, longitude, description, features, source, url, listing_type, scraped_at):
+# Crée les partitions mensuelles de properties jusqu'à PARTITION_MONTHS_AHEAD mois (à lancer avant un scraping)
+def ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    if backend() == "sqlite": # pas de partitions dans le fichier local
+        return 0
     try:
         connexion = get_connection()
         if connexion is None:
             print("erreur")
+            return 0
+        cursor = connexion.cursor()
+        cursor.execute("SELECT to_regproc('ensure_properties_partitions') IS NOT NULL")
+        created = 0
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT ensure_properties_partitions(CURRENT_DATE, (CURRENT_DATE + %s * INTERVAL '1 month')::date)", (months_ahead,))
+            created = cursor.fetchone()[0]
+            connexion.commit()
+        cursor.close()
+        connexion.close()
+        return created
+    except Exception as e:
+        print(f"Erreur lors de la création des partitions : {e}")
+        return 0
+
+# Fonction permettant de sauvegarder les données passée en paramètre dans la table adaptée (properties), renvoie l'id de la ligne créée (None si échec)
+def save_property(title, price, address, surface, rooms, property_type, latitude, longitude, description, features, source, url, listing_type, scraped_at):
+    try:
+        connexion = get_connection()
+        if connexion is None:
+            log.error("connection_failed")
             return
         
         cursor = connexion.cursor()
         requête = """
              INSERT INTO properties
-             (title, price, address, surface, rooms, property_type, latitude, longitude, description, features, source, url, listing_type, scraped_at) 
+             (title, price, address, surface, rooms, property_type, latitude, longitude, description, feature_ids, source, url, listing_type, scraped_at) 
              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+             RETURNING id
              """
-        cursor.execute(requête, (title, price, address, surface, rooms, property_type, latitude, longitude, description, features, source, url, listing_type, scraped_at))
+        cursor.execute(requête, (title, price, address, surface, rooms, property_type, latitude, longitude, description, encode_features(features), source, url, listing_type, scraped_at))
+        property_id = cursor.fetchone()[0]
         connexion.commit()
         cursor.close()
         connexion.close()
-        print("Sauvegarde effectuée")
+        log.debug("property_saved", id=property_id)
+        return property_id
     except Exception as e:
-        print(f"Erreur de sauvegarde : {e}")
+        log.error("save_failed", url=url, error=str(e))
 
 # Fonction permettant d'afficher les données contenue dans la table properties
 def get_all_properties():
@@ -0,0 +1,145 @@
+import os
+import json
+import shutil
+import argparse
+from datetime import datetime
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from database.connection import get_connection
+
+# Instantanés Parquet (zstd) des annonces + prédictions, partitionnés par listing_type et mois de scraping (hive : listing_type=sale/scrape_month=2025-03/).
+# L'entraînement peut les lire à la place de PostgreSQL (DATA_SOURCE=snapshot) : lecture locale, colonnes et partitions élaguées.
+# Le dashboard n'utilise pas les instantanés : ses graphes, KPI et cartes sont calculés en SQL (PostgreSQL ou DB_BACKEND=sqlite).
+# Chaque export est écrit dans un nouveau dossier v<horodatage>, puis manifest.json est remplacé atomiquement :
+# tous les lecteurs voient la même version complète, jamais un export en cours.
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR", Path(__file__).resolve().parent.parent / "snapshots"))
+KEEP_VERSIONS = 2 # anciennes versions gardées pour les lecteurs encore en cours
+
+EXPORT_SQL = """
+    SELECT p.id, p.title, p.address, p.price::float AS price, p.surface::float AS surface, p.rooms, p.property_type,
+           p.latitude::float AS latitude, p.longitude::float AS longitude, p.geo_precision, p.source, p.url, p.listing_type, p.scraped_at, p.updated_at, p.feature_ids,
+           to_char(p.scraped_at, 'YYYY-MM') AS scrape_month,
+           pr.predicted_price::float AS predicted_price, pr.confidence_score::float AS confidence_score,
+           pr.created_at AS prediction_date
+    FROM public.properties p
+    LEFT JOIN public.price_predictions pr ON p.id = pr.property_id
+"""
+
+SCHEMA = pa.schema([
+    ("id", pa.int64()), ("title", pa.string()), ("address", pa.string()), ("price", pa.float64()),
+    ("surface", pa.float64()), ("rooms", pa.float64()), ("property_type", pa.string()), ("latitude", pa.float64()),
+    ("longitude", pa.float64()), ("geo_precision", pa.string()), ("source", pa.string()), ("url", pa.string()), ("listing_type", pa.string()),
+    ("scraped_at", pa.timestamp("us")), ("updated_at", pa.timestamp("us")), ("feature_ids", pa.list_(pa.int32())), ("scrape_month", pa.string()), ("predicted_price", pa.float64()),
+    ("confidence_score", pa.float64()), ("prediction_date", pa.timestamp("us")),
+])
+PARTITIONING = ds.partitioning(pa.schema([("listing_type", pa.string()), ("scrape_month", pa.string())]), flavor="hive")
+
+def snapshot_enabled():
+    return os.getenv("DATA_SOURCE") == "snapshot"
+
+def read_manifest(root=SNAPSHOT_DIR):
+    path = Path(root) / "manifest.json"
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+# Exporte toute la base (lecture par curseur serveur, par paquets de chunk_size lignes) dans une nouvelle version de l'instantané
+def export_snapshot(root=SNAPSHOT_DIR, chunk_size=50000):
+    root = Path(root)
+    version = datetime.utcnow().strftime("v%Y%m%dT%H%M%S")
+    out = root / version
+    try:
+        connexion = get_connection()
+        if connexion is None:
+            print("erreur")
+            return None
+
+        cursor = connexion.cursor()
+        # version des données exportées (mêmes sondes que data_version() du dashboard)
+        cursor.execute("""
+            SELECT (SELECT max(id) FROM public.properties), (SELECT max(scraped_at) FROM public.properties),
+                   (SELECT max(created_at) FROM public.price_predictions)
+            """)
+        max_id, max_scraped, max_pred = cursor.fetchone()
+        cursor.close()
+
+        cursor = connexion.cursor(name="snapshot_export") # curseur nommé : les lignes arrivent par paquets, pas toutes en mémoire
+        cursor.itersize = chunk_size
+        cursor.execute(EXPORT_SQL)
+        n_rows, i = 0, 0
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunk = pd.DataFrame(rows, columns=[c[0] for c in cursor.description])
+            chunk["scrape_month"] = chunk["scrape_month"].fillna("unknown")
+            ds.write_dataset(
+                pa.Table.from_pandas(chunk, schema=SCHEMA, preserve_index=False), out, format="parquet",
+                partitioning=PARTITIONING, basename_template=f"part-{i}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+            )
+            n_rows += len(chunk)
+            i += 1
+        cursor.close()
+        connexion.close()
+    except Exception as e:
+        print(f"Erreur lors de l'export de l'instantané : {e}")
+        shutil.rmtree(out, ignore_errors=True)
+        return None
+
+    partitions = {}
+    for f in sorted(out.rglob("*.parquet")):
+        key = str(f.parent.relative_to(out))
+        partitions[key] = partitions.get(key, 0) + ds.dataset(f, format="parquet").count_rows()
+    manifest = {
+        "version": version,
+        "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "data_version": [max_id, pd.Timestamp(max_scraped).isoformat() if max_scraped else None, pd.Timestamp(max_pred).isoformat() if max_pred else None], # max() SQLite -> texte
+        "n_rows": n_rows,
+        "columns": SCHEMA.names,
+        "partitions": partitions,
+    }
+    tmp = root / "manifest.json.tmp"
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp, root / "manifest.json") # bascule atomique vers la nouvelle version
+
+    # ménage : on garde les KEEP_VERSIONS dernières versions
+    for old in sorted(p for p in root.glob("v*") if p.is_dir())[:-KEEP_VERSIONS]:
+        shutil.rmtree(old, ignore_errors=True)
+    print(f"Instantané {version} : {n_rows} lignes, {len(partitions)} partitions")
+    return manifest
+
+# Lit la version courante de l'instantané : seules les colonnes demandées sont lues, les filtres élaguent les partitions
+# listing_type : "rent"/"sale" ; since : scraped_at > since ou updated_at > since ; priced : price non nul ; predicted : prédiction présente
+def read_snapshot(columns=None, listing_type=None, since=None, priced=False, predicted=False, root=SNAPSHOT_DIR):
+    manifest = read_manifest(root)
+    if manifest is None:
+        raise FileNotFoundError(f"Aucun instantané dans {root} (lancer python -m database.snapshots)")
+    dataset = ds.dataset(Path(root) / manifest["version"], format="parquet", partitioning=PARTITIONING, schema=SCHEMA)
+
+    expr = None
+    def _and(e):
+        return e if expr is None else expr & e
+    if listing_type is not None:
+        expr = _and(ds.field("listing_type") == listing_type)
+    if since is not None:
+        since = pd.Timestamp(since)
+        at = pa.scalar(since.to_pydatetime(), pa.timestamp("us"))
+        # les annonces modifiées (updated_at) peuvent être dans n'importe quel mois : l'élagage ne vaut que pour les nouvelles
+        expr = _and(((ds.field("scrape_month") >= since.strftime("%Y-%m")) & (ds.field("scraped_at") > at)) | (ds.field("updated_at") > at))
+    if priced:
+        expr = _and(ds.field("price").is_valid())
+    if predicted:
+        expr = _and(ds.field("predicted_price").is_valid())
+    return dataset.to_table(columns=columns, filter=expr).to_pandas()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export Parquet des annonces + prédictions (partitionné par type et mois)")
+    parser.add_argument("--out", default=str(SNAPSHOT_DIR))
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    args = parser.parse_args()
+    export_snapshot(Path(args.out), args.chunk_size)
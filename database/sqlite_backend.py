@@ -0,0 +1,231 @@
+import re
+import json
+import math
+import sqlite3
+import numpy as np
+from decimal import Decimal
+from datetime import date, datetime
+from pathlib import Path
+
+# Stockage embarqué (un seul fichier SQLite, DB_BACKEND=sqlite) : même API DB-API que psycopg2 pour le reste du code.
+# Les requêtes du dépôt (écrites pour PostgreSQL) sont traduites à l'exécution : paramètres %s / %(nom)s, casts ::type,
+# "x = ANY(liste)", "ids @> liste", percentile_cont ... WITHIN GROUP, schéma public. ; les fonctions PostgreSQL utilisées
+# (split_part, width_bucket, GREATEST, percentile_cont...) sont enregistrées en fonctions Python.
+# Tableaux (features, feature_ids) stockés en JSON, relus en listes grâce aux types déclarés TEXTARRAY / INTARRAY.
+SCHEMA_PATH = Path(__file__).resolve().parent / "sqlite_schema.sql"
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+_CAST = re.compile(r"::\s*[A-Za-z_]+(?:\s+precision)?(?:\[\])?")
+_PERCENTILE = re.compile(r"percentile_cont\(\s*(ARRAY\[[^\]]*\]|[^()]+?)\s*\)\s*WITHIN GROUP\s*\(\s*ORDER BY\s+([^()]+?)\s*\)", re.I)
+_CONTAINS = re.compile(r"([\w.]+)\s*@>\s*(%s|%\(\w+\)s)")
+_SUBSCRIPT = re.compile(r"\b([a-z_]\w*)\[(\d+)\]")
+
+def _percentile_args(m):
+    fraction, expr = m.group(1), m.group(2)
+    if fraction.upper().startswith("ARRAY"):
+        return f"percentile_cont_array({expr}, '{fraction[5:].strip()}')"
+    return f"percentile_cont({expr}, {fraction})"
+
+# Requête PostgreSQL du dépôt -> requête SQLite (hors paramètres)
+def translate(q):
+    q = _CAST.sub("", q)
+    q = _PERCENTILE.sub(_percentile_args, q)
+    q = _SUBSCRIPT.sub(lambda m: f"json_extract({m.group(1)}, '$[{int(m.group(2)) - 1}]')", q) # tableaux 1-indexés -> JSON 0-indexé
+    q = _CONTAINS.sub(r"int_array_contains(\1, \2)", q)
+    q = re.sub(r"\bpublic\.", "", q)
+    q = re.sub(r"\bNOW\(\)", "CURRENT_TIMESTAMP", q, flags=re.I)
+    q = re.sub(r"\bFOR UPDATE\b", "", q, flags=re.I)
+    return q
+
+def _adapt(value):
+    if value is None or isinstance(value, (str, bytes, bool)):
+        return value
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime): # pd.Timestamp compris
+        return None if value != value else value.isoformat(" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return json.dumps([_adapt(v) for v in value])
+    return value
+
+# Paramètres psycopg2 -> paramètres positionnels "?" ; une liste passée à "= ANY(%s)" devient "IN (?, ?, ...)"
+def _bind(q, params):
+    if params is None:
+        return q, ()
+    out, args, pos, last = [], [], 0, 0
+    for m in _PLACEHOLDER.finditer(q):
+        out.append(q[last:m.start()])
+        last = m.end()
+        if m.group(0) == "%%":
+            out.append("%")
+            continue
+        if m.group(1) is not None:
+            value = params[m.group(1)]
+        else:
+            value = params[pos]
+            pos += 1
+        before = "".join(out)
+        any_call = re.search(r"=\s*ANY\(\s*$", before, flags=re.I)
+        if any_call and isinstance(value, (list, tuple, np.ndarray)):
+            out = [before[:any_call.start()] + "IN ("]
+            out.append(", ".join("?" * len(value)))
+            args.extend(_adapt(v) for v in value)
+        else:
+            out.append("?")
+            args.append(_adapt(value))
+    out.append(q[last:])
+    return "".join(out), args
+
+class PgCompatCursor(sqlite3.Cursor):
+    itersize = 2000 # ignoré (compatibilité avec les curseurs nommés psycopg2)
+
+    def execute(self, q, params=None):
+        sql, args = _bind(translate(q), params)
+        return super().execute(sql, args)
+
+    def executemany(self, q, seq):
+        rows = list(seq)
+        if not rows:
+            return self
+        q = translate(q)
+        sql, _ = _bind(q, rows[0])
+        return super().executemany(sql, (_bind(q, r)[1] for r in rows))
+
+class PgCompatConnection(sqlite3.Connection):
+    # name : curseur nommé psycopg2 (côté serveur) -> curseur SQLite ordinaire, qui lit déjà les lignes à la demande
+    def cursor(self, name=None, factory=PgCompatCursor):
+        return super().cursor(factory)
+
+    def execute(self, q, params=None):
+        return self.cursor().execute(q, params)
+
+# --- fonctions PostgreSQL ---
+def _split_part(s, delim, n):
+    if s is None:
+        return None
+    parts = s.split(delim)
+    return parts[n - 1] if 0 < n <= len(parts) else ""
+
+def _regexp_replace(s, pattern, repl):
+    return None if s is None else re.sub(pattern, repl.replace("\\", "\\\\"), s, count=1)
+
+def _width_bucket(x, lo, hi, n):
+    if x is None or lo is None or hi is None:
+        return None
+    if x < lo:
+        return 0
+    if x >= hi:
+        return n + 1
+    return int((x - lo) / (hi - lo) * n) + 1
+
+def _least(*args):
+    values = [a for a in args if a is not None]
+    return min(values) if values else None
+
+def _greatest(*args):
+    values = [a for a in args if a is not None]
+    return max(values) if values else None
+
+def _to_char(value, fmt):
+    if value is None:
+        return None
+    ts = datetime.fromisoformat(str(value))
+    return fmt.replace("YYYY", f"{ts.year:04d}").replace("MM", f"{ts.month:02d}").replace("DD", f"{ts.day:02d}")
+
+def _int_array_contains(a, b):
+    if a is None or b is None:
+        return None
+    return int(set(json.loads(b)).issubset(json.loads(a)))
+
+def _interpolate(values, q):
+    if not values:
+        return None
+    k = (len(values) - 1) * q
+    lo, hi = math.floor(k), math.ceil(k)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+class _Percentile:
+    def __init__(self):
+        self.values, self.q = [], None
+
+    def step(self, x, q):
+        self.q = q
+        if x is not None:
+            self.values.append(x)
+
+    def finalize(self):
+        self.values.sort()
+        return _interpolate(self.values, self.q)
+
+class _PercentileArray(_Percentile):
+    def finalize(self):
+        self.values.sort()
+        qs = json.loads(self.q) if self.q else []
+        return json.dumps([_interpolate(self.values, q) for q in qs]) if self.values else None
+
+class _StddevSamp:
+    def __init__(self):
+        self.n, self.mean, self.m2 = 0, 0.0, 0.0
+
+    def step(self, x):
+        if x is None:
+            return
+        self.n += 1
+        d = x - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (x - self.mean)
+
+    def finalize(self):
+        return math.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else None
+
+def _register(conn):
+    conn.create_function("split_part", 3, _split_part, deterministic=True)
+    conn.create_function("regexp_replace", 3, _regexp_replace, deterministic=True)
+    conn.create_function("width_bucket", 4, _width_bucket, deterministic=True)
+    conn.create_function("least", -1, _least, deterministic=True)
+    conn.create_function("greatest", -1, _greatest, deterministic=True)
+    conn.create_function("to_char", 2, _to_char, deterministic=True)
+    conn.create_function("int_array_contains", 2, _int_array_contains, deterministic=True)
+    conn.create_aggregate("percentile_cont", 2, _Percentile)
+    conn.create_aggregate("percentile_cont_array", 2, _PercentileArray)
+    conn.create_aggregate("stddev_samp", 1, _StddevSamp)
+
+def _to_datetime(b):
+    return datetime.fromisoformat(b.decode())
+
+sqlite3.register_converter("TIMESTAMP", _to_datetime)
+sqlite3.register_converter("TEXTARRAY", json.loads)
+sqlite3.register_converter("INTARRAY", json.loads)
+
+# Connexion au fichier SQLite (créé au besoin) : WAL = lecteurs (dashboard) non bloqués par l'écrivain (scraper, entraînement)
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES, factory=PgCompatConnection, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL") # sûr en WAL, évite un fsync par commit
+    conn.execute("PRAGMA foreign_keys = OFF")
+    conn.execute("PRAGMA cache_size = -65536") # 64 Mo
+    _register(conn)
+    return conn
+
+# Colonnes ajoutées au schéma après coup : CREATE TABLE IF NOT EXISTS ne modifie pas un fichier existant,
+# elles y sont ajoutées (avant le script, dont les index peuvent les utiliser)
+ADDED_COLUMNS = [
+    ("properties", "updated_at", "TIMESTAMP"),
+    ("properties", "geo_precision", "TEXT"),
+    ("agg_refresh_state", "max_updated_at", "TIMESTAMP"),
+]
+
+# Crée les tables du fichier SQLite (équivalent des migrations PostgreSQL, sans partitions)
+def init_schema(conn):
+    for table, column, decl in ADDED_COLUMNS:
+        existing = [r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+        if existing and column not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+    conn.commit()
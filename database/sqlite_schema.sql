@@ -0,0 +1,214 @@
+-- Schéma du stockage embarqué SQLite (DB_BACKEND=sqlite) : mêmes tables et colonnes que les migrations PostgreSQL 0001 à 0014,
+-- sans partitions ni index BRIN/GIN. Types déclarés : TIMESTAMP -> datetime, TEXTARRAY / INTARRAY -> listes (JSON), REAL pour les prix.
+
+CREATE TABLE IF NOT EXISTS properties (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    address TEXT,
+    price REAL,
+    surface REAL,
+    rooms INTEGER,
+    property_type TEXT,
+    latitude REAL,
+    longitude REAL,
+    description TEXT,
+    features TEXTARRAY,
+    feature_ids INTARRAY,
+    source TEXT,
+    url TEXT,
+    listing_type TEXT NOT NULL DEFAULT 'unknown',
+    scraped_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP,
+    geo_precision TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_properties_type_price ON properties(listing_type, price);
+CREATE INDEX IF NOT EXISTS idx_properties_price_id ON properties(price DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_properties_scraped ON properties(scraped_at);
+CREATE INDEX IF NOT EXISTS idx_properties_updated ON properties(updated_at) WHERE updated_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_properties_rooms ON properties(rooms);
+
+-- unicité (source, url), remplie par trigger comme en PostgreSQL (lue par record_listing)
+CREATE TABLE IF NOT EXISTS property_urls (
+    source TEXT,
+    url TEXT,
+    property_id INTEGER,
+    PRIMARY KEY (source, url)
+);
+CREATE TRIGGER IF NOT EXISTS trg_properties_register_url AFTER INSERT ON properties
+WHEN NEW.source IS NOT NULL AND NEW.url IS NOT NULL
+BEGIN
+    INSERT INTO property_urls(source, url, property_id) VALUES (NEW.source, NEW.url, NEW.id);
+END;
+
+CREATE TABLE IF NOT EXISTS price_predictions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    property_id INTEGER,
+    predicted_price REAL,
+    confidence_score REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ux_price_predictions_property ON price_predictions(property_id);
+CREATE INDEX IF NOT EXISTS idx_price_predictions_created ON price_predictions(created_at);
+
+CREATE TABLE IF NOT EXISTS backtest_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    listing_type TEXT,
+    mode TEXT,
+    window_index INTEGER,
+    train_start TIMESTAMP,
+    test_start TIMESTAMP,
+    test_end TIMESTAMP,
+    n_train INTEGER,
+    n_test INTEGER,
+    mae REAL,
+    mape REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_backtest_results_run ON backtest_results(run_id);
+
+CREATE TABLE IF NOT EXISTS agg_city_stats (
+    listing_type TEXT,
+    city TEXT,
+    n INTEGER,
+    median_price REAL,
+    mean_price REAL,
+    std_price REAL,
+    PRIMARY KEY (listing_type, city)
+);
+
+CREATE TABLE IF NOT EXISTS agg_price_per_sqm (
+    listing_type TEXT PRIMARY KEY,
+    n INTEGER,
+    mean REAL,
+    p01 REAL,
+    q1 REAL,
+    median REAL,
+    q3 REAL,
+    p99 REAL
+);
+
+CREATE TABLE IF NOT EXISTS agg_rooms_box (
+    listing_type TEXT,
+    rooms_bin INTEGER,
+    n INTEGER,
+    min_price REAL,
+    q1 REAL,
+    median REAL,
+    q3 REAL,
+    max_price REAL,
+    PRIMARY KEY (listing_type, rooms_bin)
+);
+
+CREATE TABLE IF NOT EXISTS agg_rooms_counts (
+    listing_type TEXT,
+    rooms INTEGER,
+    n INTEGER,
+    PRIMARY KEY (listing_type, rooms)
+);
+
+CREATE TABLE IF NOT EXISTS agg_price_histogram (
+    listing_type TEXT,
+    bucket INTEGER,
+    price_lo REAL,
+    price_hi REAL,
+    n INTEGER,
+    PRIMARY KEY (listing_type, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS agg_city_price_bins (
+    listing_type TEXT,
+    city TEXT,
+    rooms INTEGER,
+    bin INTEGER,
+    n INTEGER,
+    total REAL,
+    total_sq REAL
+);
+CREATE INDEX IF NOT EXISTS idx_agg_city_price_bins_city ON agg_city_price_bins(listing_type, city);
+
+CREATE TABLE IF NOT EXISTS agg_city_ppsqm_bins (
+    listing_type TEXT,
+    city TEXT,
+    bin INTEGER,
+    n INTEGER,
+    total REAL,
+    PRIMARY KEY (listing_type, city, bin)
+);
+
+CREATE TABLE IF NOT EXISTS agg_refresh_state (
+    listing_type TEXT PRIMARY KEY,
+    max_id INTEGER,
+    max_scraped_at TIMESTAMP,
+    max_updated_at TIMESTAMP,
+    refreshed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS deal_scores (
+    property_id INTEGER PRIMARY KEY,
+    listing_type TEXT,
+    city TEXT,
+    property_type TEXT,
+    price REAL,
+    predicted_price REAL,
+    confidence_score REAL,
+    underpricing REAL,
+    score REAL,
+    rank_city INTEGER,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_deal_scores_city_rank ON deal_scores(listing_type, city, rank_city);
+CREATE INDEX IF NOT EXISTS idx_deal_scores_type_score ON deal_scores(listing_type, score DESC);
+
+CREATE TABLE IF NOT EXISTS listing_state (
+    property_id INTEGER PRIMARY KEY,
+    listing_type TEXT,
+    status TEXT NOT NULL DEFAULT 'active',
+    price REAL,
+    first_seen_at TIMESTAMP NOT NULL,
+    last_seen_at TIMESTAMP NOT NULL,
+    changed_at TIMESTAMP NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_listing_state_last_seen ON listing_state(last_seen_at);
+
+CREATE TABLE IF NOT EXISTS price_history (
+    property_id INTEGER NOT NULL,
+    listing_type TEXT,
+    observed_at TIMESTAMP NOT NULL,
+    price REAL,
+    status TEXT NOT NULL DEFAULT 'active'
+);
+CREATE INDEX IF NOT EXISTS idx_price_history_property ON price_history(property_id, observed_at DESC);
+
+CREATE TABLE IF NOT EXISTS feature_vocab (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS listing_clusters (
+    property_id INTEGER PRIMARY KEY,
+    cluster_id INTEGER NOT NULL,
+    is_canonical BOOLEAN NOT NULL DEFAULT 1,
+    listing_type TEXT,
+    cell TEXT,
+    cell_alt TEXT,
+    address_key TEXT,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_listing_clusters_cluster ON listing_clusters(cluster_id);
+CREATE INDEX IF NOT EXISTS idx_listing_clusters_cell ON listing_clusters(cell);
+CREATE INDEX IF NOT EXISTS idx_listing_clusters_cell_alt ON listing_clusters(cell_alt);
+CREATE INDEX IF NOT EXISTS idx_listing_clusters_address ON listing_clusters(address_key);
+
+CREATE TABLE IF NOT EXISTS pipeline_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    watermark TEXT,
+    detail TEXT,
+    started_at TIMESTAMP NOT NULL,
+    duration_s REAL
+);
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_stage ON pipeline_runs(stage, started_at DESC);
+CREATE INDEX IF NOT EXISTS idx_pipeline_runs_run ON pipeline_runs(run_id);
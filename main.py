@@ -1,12 +1,6 @@
-from scrapers.c21 import C21Scraper
+import sys
+from pipeline.orchestrator import main
 
+# Point d'entrée historique, équivalent à 'python -m pipeline' (mêmes options, ex: python main.py --skip crawl --dry-run)
 if __name__ == "__main__":
-    scraper = C21Scraper()
-    result = scraper.scrape_c21(limit=300000, workers=24)
-    if isinstance(result, int):
-        print(f"\nAnnonces sauvegardées : {result}\n")
-    else:
-        annonces = result
-        print(f"\n{len(annonces)} annonces récupérées :\n")
-        for a in annonces[:5]:
-            print(f"- {a.get('titre')} | {a.get('prix')} | {a.get('rooms')} br | {a.get('surface')} | {a.get('url')}")
+    sys.exit(main())
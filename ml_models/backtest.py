@@ -0,0 +1,161 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import joblib
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
+from sklearn.ensemble import RandomForestRegressor
+from ml_models.features import load_data, prepare_columns, clean_and_fit, basic_clean
+from ml_models.model_train import make_encoder, make_amenity_encoder, build_matrix, spatial_block, evaluate
+from ml_models.text_features import make_text_hasher
+from ml_models.spatial import SpatialIndex
+from database.connection import get_connection, execute_batch
+from pipeline.log import get_logger
+
+log = get_logger("ml_models.backtest")
+
+# Fenêtres temporelles sur scraped_at (df trié) : n_windows périodes de test consécutives à la fin de l'historique
+# mode="expanding" : train = tout ce qui précède la période de test / mode="rolling" : train = les train_periods périodes précédentes
+def make_windows(scraped_at, n_windows=5, mode="expanding", train_periods=3):
+    ts = pd.to_datetime(pd.Series(scraped_at)).to_numpy()
+    start, end = ts.min(), ts.max()
+    step = (end - start) / (n_windows + train_periods if mode == "rolling" else n_windows + 1)
+    windows = []
+    for w in range(n_windows):
+        test_start = end - (n_windows - w) * step
+        test_end = test_start + step
+        train_start = start if mode == "expanding" else test_start - train_periods * step
+        i0, i1, i2 = np.searchsorted(ts, [train_start, test_start, test_end], side="left")
+        if w == n_windows - 1:
+            i2 = len(ts) # la dernière période inclut la toute dernière annonce
+        windows.append({
+            "window": w, "train": (int(i0), int(i1)), "test": (int(i1), int(i2)),
+            "train_start": pd.Timestamp(train_start), "test_start": pd.Timestamp(test_start), "test_end": pd.Timestamp(test_end),
+        })
+    return windows
+
+_data = None # annonces brutes + texte haché, chargés une fois par process worker (_load_shared)
+
+# Initialiseur des process workers : le texte haché (matrice CSR) est relu en memmap, partagé entre workers via le cache disque ;
+# le df brut (colonnes objet, non memmappables) est désérialisé une seule fois par worker et non une fois par fenêtre
+def _load_shared(path):
+    global _data
+    _data = joblib.load(path, mmap_mode="r")
+
+# Exécuté dans un process worker : imputeur, bornes de prix (1-99%) et encodeurs sont fittés sur les lignes d'entraînement
+# de la fenêtre uniquement (une fenêtre passée ne voit jamais les médianes ni les villes de son futur), le test de la fenêtre
+# est coupé aux bornes de prix de son train. Nettoyage et encodage sont donc refaits par fenêtre : les partager entre fenêtres
+# ferait fuiter le futur dans les fenêtres passées.
+def _run_window(win, rf_params, use_spatial):
+    df, text = _data["df"], _data["text"]
+    (a, b), (c, d) = win["train"], win["test"]
+    if b - a < 20 or d - c < 1:
+        return None
+
+    train, imputer = clean_and_fit(df.iloc[a:b])
+    test = basic_clean(df.iloc[c:d], imputer=imputer)
+    if len(train) < 20 or test.empty:
+        return None
+    encoder = make_encoder().fit(train)
+    amenities = make_amenity_encoder().fit(train["feature_ids"]) if "feature_ids" in train else None
+    Xtr, Xte = build_matrix(train, encoder, amenities=amenities), build_matrix(test, encoder, amenities=amenities)
+    if text is not None:
+        # texte haché (sans apprentissage) calculé une seule fois pour toutes les lignes : tranches par position d'origine
+        Xtr = sparse.hstack([Xtr, text[train["row"].to_numpy()]], format="csr")
+        Xte = sparse.hstack([Xte, text[test["row"].to_numpy()]], format="csr")
+    if use_spatial:
+        # index de voisinage fitté sur la fenêtre d'entraînement uniquement (pas de fuite du test)
+        spatial = SpatialIndex(n_jobs=rf_params["n_jobs"]).fit(train)
+        Xtr = sparse.hstack([Xtr, spatial_block(spatial, train, exclude_self=True)], format="csr")
+        Xte = sparse.hstack([Xte, spatial_block(spatial, test)], format="csr")
+
+    start = time.time()
+    rf = RandomForestRegressor(**rf_params)
+    rf.fit(Xtr, np.log1p(train["price"].astype(float)))
+    pred = np.expm1(rf.predict(Xte))
+    mae, mape = evaluate(test["price"], pred)
+    return {
+        "window": win["window"], "train_start": win["train_start"], "test_start": win["test_start"], "test_end": win["test_end"],
+        "n_train": len(train), "n_test": len(test), "mae": float(mae), "mape": float(mape), "seconds": time.time() - start,
+    }
+
+# Ecrit les métriques par fenêtre dans la table backtest_results (détail dans database/migrations/0002_backtest_results.sql)
+# (table créée par run_migrations)
+def save_backtest_results(run_id, listing_type, mode, results):
+    connexion = get_connection()
+    if connexion is None:
+        log.error("connection_failed")
+        return
+    cursor = connexion.cursor()
+    sql = """
+      INSERT INTO backtest_results(run_id, listing_type, mode, window_index, train_start, test_start, test_end, n_train, n_test, mae, mape)
+      VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    """
+    rows = [
+        (run_id, listing_type, mode, r["window"], r["train_start"].to_pydatetime(), r["test_start"].to_pydatetime(),
+         r["test_end"].to_pydatetime(), r["n_train"], r["n_test"], r["mae"], r["mape"])
+        for r in results
+    ]
+    execute_batch(cursor, sql, rows, page_size=1000)
+    connexion.commit()
+    cursor.close()
+    connexion.close()
+
+# Backtest glissant/expansif : fenêtres découpées une seule fois sur les annonces brutes triées, nettoyage et encodage refaits
+# dans chaque fenêtre (train seulement, voir _run_window), fenêtres évaluées en parallèle dans des process séparés
+def run_backtest(listing_type, n_windows=5, mode="expanding", train_periods=3, max_workers=None, use_spatial=True, save=True, use_text=False, text_components=64):
+    df = prepare_columns(load_data(listing_type))
+    df = df.sort_values("scraped_at", kind="stable").reset_index(drop=True)
+    df["row"] = np.arange(len(df))
+    text = make_text_hasher(n_components=text_components).transform_ids(df["id"]) if use_text else None
+    windows = make_windows(df["scraped_at"], n_windows, mode, train_periods)
+
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(max_workers or n_windows, n_windows, cpus))
+    rf_params = dict(n_estimators=200, max_depth=18, min_samples_leaf=5, max_features="sqrt", n_jobs=max(1, cpus // workers), random_state=42)
+
+    # annonces brutes et texte haché écrits une fois dans un fichier joblib, chargé une fois par worker (_load_shared)
+    tmpdir = tempfile.mkdtemp(prefix="backtest_")
+    try:
+        path = os.path.join(tmpdir, "features.joblib")
+        joblib.dump({"df": df, "text": text}, path)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_load_shared, initargs=(path,)) as ex:
+            results = [r for r in ex.map(_run_window, windows, [rf_params] * len(windows), [use_spatial] * len(windows)) if r]
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    for r in results:
+        log.info("window_done", listing_type=listing_type, mode=mode, window=r["window"], test_start=r["test_start"], test_end=r["test_end"],
+                 n_train=r["n_train"], n_test=r["n_test"], mae=round(r["mae"]), mape=round(r["mape"], 1))
+
+    if save and results:
+        run_id = f"{listing_type}-{mode}-{datetime.utcnow():%Y%m%d%H%M%S}"
+        save_backtest_results(run_id, listing_type, mode, results)
+        log.info("results_saved", listing_type=listing_type, windows=len(results), run_id=run_id)
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backtest des modèles de prix sur des fenêtres temporelles")
+    parser.add_argument("--listing-types", nargs="+", default=["rent", "sale"])
+    parser.add_argument("--windows", type=int, default=5)
+    parser.add_argument("--mode", choices=["expanding", "rolling"], default="expanding")
+    parser.add_argument("--train-periods", type=int, default=3, help="taille de la fenêtre d'entraînement en mode rolling (en périodes de test)")
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--no-spatial", action="store_true")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--text-features", action="store_true", help="ajoute les descriptions hachées (comparer avec/sans)")
+    parser.add_argument("--text-components", type=int, default=64, help="dimension après projection aléatoire (0 = espace haché complet)")
+    args = parser.parse_args()
+    if not args.no_save:
+        from database.models import run_migrations
+        run_migrations() # table backtest_results
+    for lt in args.listing_types:
+        run_backtest(lt, args.windows, args.mode, args.train_periods, args.max_workers, not args.no_spatial, not args.no_save,
+                     args.text_features, args.text_components or None)
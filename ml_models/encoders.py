@@ -0,0 +1,123 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+OTHER = "Other"
+
+# Encodeur catégoriel "fitté" une seule fois puis sauvegardé avec le modèle (joblib), réutilisé tel quel à l'entraînement, au batch et à l'ingestion.
+# - mode="onehot" : matrice creuse (CSR) au lieu des get_dummies denses
+# - mode="ordinal" : un code entier par colonne (suffisant pour une forêt)
+# Les catégories rares (au-delà de max_categories) et les catégories jamais vues tombent toujours dans "Other" -> résultat déterministe
+class CategoricalEncoder:
+    def __init__(self, columns=("province", "city"), max_categories=None, mode="onehot"):
+        if mode not in ("onehot", "ordinal"):
+            raise ValueError(f"mode inconnu : {mode}")
+        self.columns = list(columns)
+        self.max_categories = max_categories or {} # ex: {"city": 30} -> top 30 des villes, le reste -> Other
+        self.mode = mode
+        self.categories_ = None
+
+    def _values(self, df, col):
+        return df[col].fillna("NA").astype(str).replace("", "NA")
+
+    def fit(self, df):
+        self.categories_ = {}
+        for col in self.columns:
+            counts = self._values(df, col).value_counts()
+            top = self.max_categories.get(col)
+            if top is not None:
+                counts = counts.head(top)
+            # Other en position 0 : c'est là que vont les catégories inconnues
+            self.categories_[col] = [OTHER] + sorted(c for c in counts.index if c != OTHER)
+        return self
+
+    # Codes entiers (n, nb_colonnes), 0 = Other
+    def _codes(self, df):
+        if self.categories_ is None:
+            raise RuntimeError("CategoricalEncoder non fitté, appeler fit() d'abord")
+        codes = np.empty((len(df), len(self.columns)), dtype=np.int32)
+        for j, col in enumerate(self.columns):
+            c = pd.Categorical(self._values(df, col), categories=self.categories_[col]).codes
+            codes[:, j] = np.where(c < 0, 0, c) # -1 = jamais vu -> Other
+        return codes
+
+    def transform(self, df):
+        codes = self._codes(df)
+        if self.mode == "ordinal":
+            return codes.astype(np.float32)
+
+        # one-hot creux : une seule valeur non nulle par colonne catégorielle et par ligne
+        n = len(df)
+        offsets = np.cumsum([0] + [len(self.categories_[c]) for c in self.columns[:-1]])
+        indices = (codes + offsets).ravel()
+        indptr = np.arange(0, n * len(self.columns) + 1, len(self.columns))
+        data = np.ones(len(indices), dtype=np.float32)
+        return sparse.csr_matrix((data, indices, indptr), shape=(n, self.n_features))
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
+
+    @property
+    def n_features(self):
+        if self.mode == "ordinal":
+            return len(self.columns)
+        return sum(len(self.categories_[c]) for c in self.columns)
+
+    @property
+    def feature_names_(self):
+        if self.mode == "ordinal":
+            return list(self.columns)
+        return [f"{col}_{cat}" for col in self.columns for cat in self.categories_[col]]
+
+
+# Tableaux d'ids de caractéristiques (colonne feature_ids, une liste par annonce) -> (nb d'ids par ligne, ids concaténés)
+def _flatten_ids(values):
+    arrays = [np.asarray(v, dtype=np.int64) if isinstance(v, (list, tuple, np.ndarray)) else np.empty(0, dtype=np.int64) for v in values]
+    lengths = np.fromiter((len(a) for a in arrays), dtype=np.int64, count=len(arrays))
+    flat = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+    return lengths, flat
+
+# Encodeur des équipements (ids de feature_vocab) en matrice creuse 0/1, fitté et sauvegardé avec le modèle comme CategoricalEncoder.
+# Seules les caractéristiques présentes dans au moins min_count annonces sont gardées (max_features au plus) ; les autres sont ignorées.
+class AmenityEncoder:
+    def __init__(self, min_count=20, max_features=300):
+        self.min_count = min_count
+        self.max_features = max_features
+        self.vocab_ids_ = None
+
+    def fit(self, feature_ids):
+        _, flat = _flatten_ids(feature_ids)
+        ids, counts = np.unique(flat, return_counts=True)
+        keep = counts >= self.min_count
+        ids, counts = ids[keep], counts[keep]
+        top = np.argsort(-counts, kind="stable")[:self.max_features]
+        self.vocab_ids_ = np.sort(ids[top])
+        return self
+
+    def transform(self, feature_ids):
+        if self.vocab_ids_ is None:
+            raise RuntimeError("AmenityEncoder non fitté, appeler fit() d'abord")
+        lengths, flat = _flatten_ids(feature_ids)
+        n = len(lengths)
+        rows = np.repeat(np.arange(n), lengths)
+        # position de chaque id dans le vocabulaire du modèle (recherche dichotomique vectorisée), ids inconnus écartés
+        pos = np.searchsorted(self.vocab_ids_, flat)
+        pos_ok = np.minimum(pos, max(len(self.vocab_ids_) - 1, 0))
+        known = (pos < len(self.vocab_ids_)) & (self.vocab_ids_[pos_ok] == flat) if len(self.vocab_ids_) else np.zeros(len(flat), dtype=bool)
+        X = sparse.csr_matrix(
+            (np.ones(int(known.sum()), dtype=np.float32), (rows[known], pos[known])),
+            shape=(n, self.n_features),
+        )
+        X.data[:] = 1.0 # un id en double dans une annonce compte une fois
+        return X
+
+    def fit_transform(self, feature_ids):
+        return self.fit(feature_ids).transform(feature_ids)
+
+    @property
+    def n_features(self):
+        return len(self.vocab_ids_)
+
+    @property
+    def feature_names_(self):
+        return [f"amenity_{i}" for i in self.vocab_ids_] # noms lisibles : database.feature_vocab.load_vocab()
@@ -1,32 +1,74 @@
 import pandas as pd
 import numpy as np
 from database.connection import get_connection
+from database.snapshots import snapshot_enabled, read_snapshot
+from database.history import AS_OF_SQL
+from ml_models.imputer import HierarchicalImputer
+from data_processing.geocoder import fill_coordinates
+
+LOAD_COLUMNS = ["id", "title", "address", "price", "surface", "rooms", "property_type", "latitude", "longitude", "geo_precision", "scraped_at", "updated_at", "source", "feature_ids"]
 
 # On charge les données de la db pour soit rent soit sales selon l'argument passé en paramètre
-def load_data(listing_type):
+# since : ne charge que les annonces scrapées ou modifiées (updated_at : prix, coordonnées) après cette date (mise à jour incrémentale du modèle)
+# as_of : marché tel qu'il était à cette date (annonces actives et prix connus à as_of, via price_history)
+# DATA_SOURCE=snapshot : lecture de l'instantané Parquet local (database/snapshots.py) au lieu de PostgreSQL
+def load_data(listing_type, since=None, as_of=None):
+    if as_of is not None:
+        return _load_as_of(listing_type, as_of, since)
+    if snapshot_enabled():
+        return read_snapshot(LOAD_COLUMNS, listing_type=listing_type, since=since, priced=True)
     connexion = get_connection()
     q = """
     SELECT
     id, title, address, price::float, surface,
-    rooms, property_type, latitude, longitude, scraped_at, source
+    rooms, property_type, latitude, longitude, geo_precision, scraped_at, updated_at, source, feature_ids
     FROM public.properties
     WHERE price IS NOT NULL AND listing_type = %s
+      AND NOT EXISTS (SELECT 1 FROM listing_clusters c WHERE c.property_id = properties.id AND NOT c.is_canonical) -- doublons (database/dedup.py)
+      AND NOT EXISTS (SELECT 1 FROM listing_state s WHERE s.property_id = properties.id AND s.status <> 'active') -- retirées (close_unseen_listings)
     """
-    df = pd.read_sql(q, connexion, params=[listing_type])
+    params = [listing_type]
+    if since is not None:
+        q += " AND (scraped_at > %s OR updated_at > %s)"
+        params += [since, since]
+    df = pd.read_sql(q, connexion, params=params)
     connexion.close()
     return df
 
-# On nettoie le fichier (m2), impute des données (surface/rooms/geo) et certaines features comme la ville
-def basic_clean(df):
-    df = df.copy()
+def _load_as_of(listing_type, as_of, since=None):
+    connexion = get_connection()
+    q = AS_OF_SQL
+    params = {"lt": listing_type, "as_of": as_of}
+    if since is not None:
+        q += " AND p.scraped_at > %(since)s"
+        params["since"] = since
+    df = pd.read_sql(q, connexion, params=params)
+    connexion.close()
+    return df
 
-    # surface en m2 (la surface est en sqft, conversion directe)
-    if "surface_sqm" not in df or df["surface_sqm"].isna().all():
-        df["surface_sqm"] = np.where(df["surface"].notna(), df["surface"] * 0.092903, np.nan)
+# Provinces ayant assez d'annonces pour un modèle dédié (même découpage de l'adresse que add_location_columns, fait côté SQL)
+def list_provinces(listing_type, min_rows=500):
+    connexion = get_connection()
+    q = r"""
+    SELECT province, COUNT(*) AS n
+    FROM (
+        SELECT trim(regexp_replace(split_part(address, ',', 3), '\(.*\)', '')) AS province
+        FROM public.properties
+        WHERE price IS NOT NULL AND listing_type = %s
+    ) t
+    WHERE province <> ''
+    GROUP BY province
+    HAVING COUNT(*) >= %s
+    ORDER BY n DESC
+    """
+    df = pd.read_sql(q, connexion, params=[listing_type, min_rows])
+    connexion.close()
+    return df["province"].tolist()
 
-    # on extirpe de la colonne adress la ville (ex : x rue y, paris (75000) -> paris)
+# on extirpe de la colonne adress la ville (ex : x rue y, paris (75000) -> paris) et la province (modifie df en place)
+def add_location_columns(df):
     addr = df["address"].fillna("")
-    parts = addr.str.split(",", expand=True)
+    parts = addr.str.split(",", expand=True).reindex(columns=[0, 1, 2]) # reindex : garde 3 colonnes même sur un petit lot d'annonces
     df["city"] = (
         parts[1].fillna("").str.replace(r"\(.*\)", "", regex=True).str.strip()
     )
@@ -34,32 +76,42 @@ def basic_clean(df):
     df["province"] = (
         parts[2].fillna("").str.replace(r"\(.*\)", "", regex=True).str.strip()
     )
+    return df
+
+# Colonnes dérivées communes à l'entraînement et à l'inférence : surface en m2, ville/province, has_surface
+def prepare_columns(df):
+    df = df.copy()
+
+    # surface en m2 (la surface est en sqft, conversion directe)
+    if "surface_sqm" not in df or df["surface_sqm"].isna().all():
+        df["surface_sqm"] = np.where(df["surface"].notna(), df["surface"] * 0.092903, np.nan)
+
+    add_location_columns(df)
 
     # pour aider le modele, on met une colonne has_surface, 1 si l'annonce a une surface, 0 sinon
     df["has_surface"] = df["surface_sqm"].notna().astype(int)
+    return df
 
-    # on prend la médiane la plus précise possible, si elle n'existe pas (g1) on passe a une médiane moins précise etc jusqu'a g5 qui est globale
-    g1 = df.groupby(["city","property_type","rooms"], dropna=False)["surface_sqm"].transform("median") # médiane par (ville, type de bien, nb de pièces)
-    g2 = df.groupby(["province","property_type","rooms"], dropna=False)["surface_sqm"].transform("median") # médiane par province, type de bien, nb de pièces
-    g3 = df.groupby(["city","property_type"], dropna=False)["surface_sqm"].transform("median") # ville, type de bien
-    g4 = df.groupby(["property_type","rooms"], dropna=False)["surface_sqm"].transform("median") # type de bien, nb de pièce
-    g5 = df["surface_sqm"].median() # globale
-
-    # s'il manque la surface d'un appartement à toronto qui contient 2 pièce, on va voir la médiane d'autres exemples les plus proche(g1-g5) pour imputer avec précision
-    df["surface_sqm"] = (
-        df["surface_sqm"]
-        .fillna(g1).fillna(g2).fillna(g3).fillna(g4).fillna(g5)
-    )
+# On nettoie le fichier (m2), impute des données (surface/rooms/geo) et certaines features comme la ville
+# imputer : HierarchicalImputer déjà fitté (celui du modèle sauvegardé par ex.), sinon il est fitté sur df
+def basic_clean(df, imputer=None):
+    df, _ = clean_and_fit(df, imputer)
+    return df
+
+# Comme basic_clean mais renvoie aussi l'imputeur utilisé (pour le sauvegarder avec le modèle)
+# Les bornes de prix anti-outliers sont calculées au fit et gardées sur l'imputeur : un test / un nouveau lot nettoyé avec
+# un imputeur déjà fitté est coupé aux bornes du train (pas à ses propres percentiles, qui cacheraient sa vraie queue)
+def clean_and_fit(df, imputer=None):
+    df = prepare_columns(df)
 
-    # rooms: médiane par city, sinon globale
-    city_rooms_med = df.groupby("city", dropna=False)["rooms"].transform("median")
-    df["rooms"] = df["rooms"].fillna(city_rooms_med).fillna(df["rooms"].median())
+    # coordonnées manquantes : d'abord le gazetier hors ligne (code postal), la médiane de la ville ne sert qu'en dernier recours
+    fill_coordinates(df)
 
-    # geo: médiane par city si dispo (sinon on garde NA et on dropera)
-    city_lat_med = df.groupby("city", dropna=False)["latitude"].transform("median")
-    city_lon_med = df.groupby("city", dropna=False)["longitude"].transform("median")
-    df["latitude"]  = df["latitude"].fillna(city_lat_med)
-    df["longitude"] = df["longitude"].fillna(city_lon_med)
+    # on prend la médiane la plus précise possible (ville/type/chambres -> province -> ... -> globale), tables calculées une seule fois au fit
+    fitting = imputer is None
+    if fitting:
+        imputer = HierarchicalImputer().fit(df)
+    df = imputer.transform(df)
 
     # bornes raisonnables (valeurs aberrantes supprimées)
     df = df[(df["surface_sqm"] > 10) & (df["surface_sqm"] < 2000)]
@@ -68,19 +120,26 @@ def basic_clean(df):
     # rares lat/lon encore NA -> on enlève
     df = df[df["latitude"].notna() & df["longitude"].notna()]
 
-    # anti-outliers prix (1–99%) si assez de données
-    if len(df) >= 100:
-        lo, hi = np.percentile(df["price"], [1, 99])
+    # anti-outliers prix (1–99%) si assez de données au fit
+    if fitting:
+        imputer.price_bounds_ = tuple(float(b) for b in np.percentile(df["price"], [1, 99])) if len(df) >= 100 else None
+    bounds = getattr(imputer, "price_bounds_", None) # absent des imputeurs sauvegardés avant les bornes
+    if bounds is not None:
+        lo, hi = bounds
         df = df[(df["price"] >= lo) & (df["price"] <= hi)]
 
     # top 30 des villes pour limiter l'overfitting (limiter la dimensionalité)
     top_cities = df["city"].value_counts().head(30).index
     df["city_30"] = np.where(df["city"].isin(top_cities), df["city"], "Other")
 
-    return df
+    return df, imputer
 
  #train = plus anciennes, test = plus récentes, plus réaliste pour les prix du marché
-def time_split(df, test_frac=0.2):
-    df = df.sort_values("scraped_at").reset_index(drop=True)
-    cut = int(len(df) * (1 - test_frac))
+# cutoff : coupe à une date plutôt qu'à une proportion (train = annonces vues jusqu'à cutoff, avec load_data(as_of=cutoff) pour un train "à la date")
+def time_split(df, test_frac=0.2, cutoff=None):
+    df = df.sort_values("scraped_at", kind="stable").reset_index(drop=True)
+    if cutoff is not None:
+        cut = int(df["scraped_at"].searchsorted(pd.Timestamp(cutoff), side="right"))
+    else:
+        cut = int(len(df) * (1 - test_frac))
     return df.iloc[:cut], df.iloc[cut:]
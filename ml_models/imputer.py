@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+# Imputeur hiérarchique "fitté" : les tables de médianes (ville/province/type/chambres) sont calculées une seule fois
+# sur des clés catégorielles codées en entiers, sauvegardées avec le modèle, puis appliquées par simple lookup vectorisé
+# (entraînement, batch et ingestion utilisent exactement les mêmes médianes).
+class HierarchicalImputer:
+    KEY_COLUMNS = ["city", "province", "property_type", "rooms"]
+
+    # de la médiane la plus précise à la moins précise, la médiane globale sert de dernier recours
+    LEVELS = {
+        "surface_sqm": [
+            ("city", "property_type", "rooms"),
+            ("province", "property_type", "rooms"),
+            ("city", "property_type"),
+            ("property_type", "rooms"),
+        ],
+        "rooms": [("city",)],
+        "latitude": [("city",)],
+        "longitude": [("city",)],
+    }
+    # pas de médiane globale pour la géoloc : une annonce sans ville connue reste NA (et sera retirée)
+    GLOBAL_FALLBACK = {"surface_sqm": True, "rooms": True, "latitude": False, "longitude": False}
+
+    def __init__(self):
+        self.vocab_ = None
+        self.tables_ = None
+        self.globals_ = None
+        self.price_bounds_ = None # bornes de prix (1-99%) du df de fit, posées par features.clean_and_fit
+
+    # code 0 = valeur manquante (groupe à part comme dropna=False), 1..k = catégories vues au fit, k+1 = jamais vue (ne matche rien)
+    def _codes(self, df, col):
+        cats = self.vocab_[col]
+        values = df[col] if col != "rooms" else pd.to_numeric(df[col], errors="coerce")
+        c = pd.Categorical(values, categories=cats).codes.astype(np.int64) + 1
+        unseen = (c == 0) & values.notna().to_numpy()
+        c[unseen] = len(cats) + 1
+        return c
+
+    # Clé entière unique par combinaison de colonnes (base mixte)
+    def _key(self, codes, cols):
+        key = np.zeros(len(next(iter(codes.values()))), dtype=np.int64)
+        for col in cols:
+            key = key * (len(self.vocab_[col]) + 2) + codes[col]
+        return key
+
+    def fit(self, df):
+        self.vocab_ = {}
+        for col in self.KEY_COLUMNS:
+            values = df[col] if col != "rooms" else pd.to_numeric(df[col], errors="coerce")
+            self.vocab_[col] = pd.Index(values.dropna().unique()).sort_values()
+
+        codes = {col: self._codes(df, col) for col in self.KEY_COLUMNS}
+        self.tables_, self.globals_ = {}, {}
+        for target, levels in self.LEVELS.items():
+            y = pd.to_numeric(df[target], errors="coerce").to_numpy(dtype=float, copy=True)
+            self.tables_[target] = []
+            for cols in levels:
+                med = pd.Series(y).groupby(self._key(codes, cols)).median().dropna()
+                # stocké trié pour un lookup par searchsorted
+                self.tables_[target].append((cols, med.index.to_numpy(dtype=np.int64), med.to_numpy(dtype=float)))
+            self.globals_[target] = float(np.nanmedian(y)) if np.isfinite(y).any() else np.nan
+        return self
+
+    def _lookup(self, key, keys, values):
+        out = np.full(len(key), np.nan)
+        if len(keys) == 0:
+            return out
+        pos = np.searchsorted(keys, key).clip(max=len(keys) - 1)
+        hit = keys[pos] == key
+        out[hit] = values[pos[hit]]
+        return out
+
+    # Impute surface_sqm puis rooms puis la géoloc (même ordre que l'ancien basic_clean), renvoie une copie
+    def transform(self, df):
+        if self.tables_ is None:
+            raise RuntimeError("HierarchicalImputer non fitté, appeler fit() d'abord")
+        df = df.copy()
+        for target, levels in self.tables_.items():
+            # les clés sont recalculées à chaque cible car rooms est lui-même imputé entre temps
+            codes = {col: self._codes(df, col) for col in {c for cols, _, _ in levels for c in cols}}
+            y = pd.to_numeric(df[target], errors="coerce").to_numpy(dtype=float, copy=True)
+            for cols, keys, values in levels:
+                missing = np.isnan(y)
+                if not missing.any():
+                    break
+                y[missing] = self._lookup(self._key(codes, cols)[missing], keys, values)
+            if self.GLOBAL_FALLBACK[target]:
+                y[np.isnan(y)] = self.globals_[target]
+            df[target] = y
+        return df
+
+    def fit_transform(self, df):
+        return self.fit(df).transform(df)
@@ -0,0 +1,99 @@
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from ml_models.features import load_data, basic_clean, time_split
+from ml_models.model_store import load_model, save_model, shard_provinces
+from ml_models.model_train import build_matrix, predict_with_confidence, evaluate, upsert_predictions, train_and_write
+from database.deals import refresh_deal_scores
+from pipeline.log import get_logger
+
+log = get_logger("ml_models.incremental")
+
+# Mise à jour incrémentale d'une forêt sauvegardée (warm_start de scikit-learn) avec les annonces arrivées depuis le dernier entraînement :
+# - mode="grow" : on ajoute n_new_trees arbres entraînés sur les nouvelles annonces
+# - mode="rolling" : on remplace les n_new_trees arbres les plus anciens (fenêtre glissante, taille de la forêt constante)
+# Tous les full_refit_every cycles (ou sans modèle existant) on refait un entraînement complet pour éviter la dérive.
+# L'imputeur, les encodeurs et l'index spatial du bundle sont réutilisés tels quels (mêmes colonnes X).
+def update_forest(listing_type, n_new_trees=20, mode="grow", full_refit_every=10, holdout_frac=0.2, min_rows=50, shard=None, n_jobs=-1):
+    if mode not in ("grow", "rolling"):
+        raise ValueError(f"mode inconnu : {mode}")
+    name = listing_type if shard is None else f"{listing_type}/{shard}"
+
+    # modèle global : les provinces couvertes par un shard gardent les prédictions de leur shard
+    skip_provinces = shard_provinces(listing_type) if shard is None else []
+    bundle = load_model(listing_type, shard)
+    if bundle is None or "data_until" not in bundle or bundle.get("incremental_updates", 0) >= full_refit_every:
+        log.info("full_refit", model=name, full_refit_every=full_refit_every) # pas de modèle ou full_refit_every mises à jour atteintes
+        return train_and_write(listing_type, n_jobs=n_jobs, province=shard, skip_provinces=skip_provinces)
+
+    df0 = load_data(listing_type, since=bundle["data_until"])
+    if df0.empty:
+        log.info("no_new_rows", model=name, since=bundle["data_until"])
+        return None
+    df = basic_clean(df0, imputer=bundle["imputer"])
+    if shard is not None:
+        df = df[df["province"] == shard]
+    if len(df) < min_rows:
+        log.info("too_few_rows", model=name, rows=len(df), min_rows=min_rows)
+        return None
+
+    # les plus récentes servent de holdout pour mesurer l'effet de la mise à jour
+    df = df.sort_values("scraped_at", kind="stable").reset_index(drop=True)
+    train, test = time_split(df, test_frac=holdout_frac)
+    encoder, spatial, amenities, text = bundle["encoder"], bundle.get("spatial"), bundle.get("amenities"), bundle.get("text")
+    Xtr = build_matrix(train, encoder, spatial, amenities, text)
+    Xte = build_matrix(test, encoder, spatial, amenities, text)
+
+    rf = bundle["model"]
+    mae_before, mape_before = evaluate(test["price"], predict_with_confidence(rf, Xte)[0])
+
+    n_updates = bundle.get("incremental_updates", 0) + 1
+    # nouvelle graine à chaque cycle pour ne pas retomber sur les tirages des arbres déjà présents
+    rf.set_params(warm_start=True, n_jobs=n_jobs, random_state=42 + n_updates)
+    if mode == "rolling":
+        rf.estimators_ = rf.estimators_[n_new_trees:] # les arbres sont dans l'ordre de création : on retire les plus vieux
+    else:
+        rf.set_params(n_estimators=rf.n_estimators + n_new_trees)
+    rf.fit(Xtr, np.log1p(train["price"].astype(float)))
+    rf.set_params(warm_start=False)
+
+    mae, mape = evaluate(test["price"], predict_with_confidence(rf, Xte)[0])
+    log.info("forest_updated", model=name, mode=mode, new_trees=n_new_trees, trees=len(rf.estimators_), n_new=len(train), n_holdout=len(test),
+             mae_before=round(float(mae_before)), mae=round(float(mae)), mape_before=round(float(mape_before), 1), mape=round(float(mape), 1))
+
+    # les nouvelles annonces rejoignent l'index de voisinage puis sont prédites avec la forêt mise à jour
+    # (build_matrix les retire de leurs propres voisins par leur id : leur prix ne biaise pas leur prédiction)
+    if spatial is not None:
+        spatial.add(train)
+    preds, confs = predict_with_confidence(rf, build_matrix(df, encoder, spatial, amenities, text))
+    mask = ~df["province"].isin(skip_provinces).values
+    upsert_predictions(df["id"].values[mask], preds[mask], confs[mask])
+
+    # une annonce repricée compte à sa date de modification (load_data(since)) ; le holdout sera appris au prochain cycle,
+    # donc le watermark reste avant la plus ancienne annonce du holdout (sinon un repricing du train pourrait le faire sauter)
+    data_until = pd.to_datetime(train["updated_at"]).fillna(pd.to_datetime(train["scraped_at"])).max()
+    if not test.empty:
+        data_until = min(data_until, pd.to_datetime(test["scraped_at"]).min() - pd.Timedelta(microseconds=1))
+    bundle.update({
+        "model": rf,
+        "spatial": spatial,
+        "trained_at": datetime.utcnow(),
+        "data_until": data_until,
+        "incremental_updates": n_updates,
+        "n_rows": bundle.get("n_rows", 0) + len(train),
+    })
+    save_model(listing_type, bundle, shard=shard)
+    return {"listing_type": listing_type, "shard": shard, "n_new": len(df), "mae": float(mae), "mape": float(mape)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mise à jour incrémentale (warm start) des forêts rent/sale")
+    parser.add_argument("--listing-types", nargs="+", default=["rent", "sale"])
+    parser.add_argument("--trees", type=int, default=20, help="nb d'arbres ajoutés/remplacés par cycle")
+    parser.add_argument("--mode", choices=["grow", "rolling"], default="grow")
+    parser.add_argument("--full-refit-every", type=int, default=10)
+    args = parser.parse_args()
+    for lt in args.listing_types:
+        update_forest(lt, n_new_trees=args.trees, mode=args.mode, full_refit_every=args.full_refit_every)
+    refresh_deal_scores(args.listing_types)
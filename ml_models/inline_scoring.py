@@ -0,0 +1,134 @@
+import threading
+import pandas as pd
+from ml_models.model_store import load_model, load_shards
+from ml_models.predict import score_frame, prepare_raw
+from ml_models.features import add_location_columns
+from ml_models.model_train import upsert_predictions
+from database.connection import get_connection
+from pipeline.log import get_logger
+
+log = get_logger("ml_models.inline_scoring")
+
+# Score les annonces au fil du scraping : les modèles rent/sale sont chargés une seule fois par process,
+# les annonces sauvegardées sont mises en lot et les prédictions écrites dans price_predictions dès que le lot est plein
+class InlineScorer:
+    def __init__(self, batch_size=200, listing_types=("rent", "sale")):
+        self.batch_size = batch_size
+        self.bundles = {}
+        self.shards = {} # modèles par province (training_jobs --shard-by-province), prioritaires sur le modèle global
+        for lt in listing_types:
+            bundle = load_model(lt)
+            if bundle is not None:
+                self.bundles[lt] = bundle
+                self.shards[lt] = load_shards(lt)
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.score_lock = threading.Lock() # un seul lot scoré à la fois (l'index spatial est mis à jour entre deux lots)
+        self.scored = 0
+        self.scored_types = set() # types d'annonce ayant reçu des prédictions (deal_scores à recalculer pour ceux-là)
+        if not self.bundles:
+            log.warning("no_model", hint="lancer d'abord 'python3 -m ml_models.model_train'")
+
+    @property
+    def enabled(self):
+        return bool(self.bundles)
+
+    # Ajoute une annonce tout juste sauvegardée (property_id = id renvoyé par save_property)
+    def add(self, property_id, prop):
+        if not self.enabled or property_id is None or prop.get("listing_type") not in self.bundles:
+            return
+        row = {
+            "id": property_id,
+            "price": prop.get("prix"),
+            "address": prop.get("adresse"),
+            "surface": prop.get("surface"),
+            "rooms": prop.get("rooms"),
+            "property_type": prop.get("property_type", "appartement"),
+            "latitude": prop.get("latitude"),
+            "longitude": prop.get("longitude"),
+            "geo_precision": prop.get("geo_precision"),
+            "listing_type": prop.get("listing_type"),
+            "feature_ids": prop.get("feature_ids"),
+            "description": prop.get("description"),
+        }
+        batch = None
+        with self.lock:
+            self.buffer.append(row)
+            if len(self.buffer) >= self.batch_size:
+                batch, self.buffer = self.buffer, []
+        if batch:
+            self._score(batch)
+
+    # Vide le buffer (à appeler à la fin du scraping pour ne pas perdre le dernier lot)
+    def flush(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+        if batch:
+            self._score(batch)
+        return self.scored
+
+    # Score directement un lot de lignes (colonnes de la table properties), renvoie le total d'annonces prédites
+    def score_rows(self, rows):
+        rows = [r for r in rows if r.get("listing_type") in self.bundles]
+        if rows:
+            self._score(rows)
+        return self.scored
+
+    def _score(self, batch):
+        try:
+            df = pd.DataFrame(batch)
+            add_location_columns(df)
+            with self.score_lock:
+                for (lt, province), part in df.groupby(["listing_type", "province"]):
+                    bundle = self.shards[lt].get(province, self.bundles[lt]) # routage vers le shard de la province s'il existe
+                    part = part.drop(columns=["city", "province"])
+                    ids, preds, confs = score_frame(part, bundle)
+                    if len(ids):
+                        upsert_predictions(ids, preds, confs)
+                        with self.lock:
+                            self.scored += len(ids)
+                            self.scored_types.add(lt)
+                    # les nouvelles annonces enrichissent l'index de voisinage pour les lots suivants
+                    if bundle.get("spatial") is not None:
+                        priced = part[pd.to_numeric(part["price"], errors="coerce").notna()]
+                        if len(priced):
+                            bundle["spatial"].add(prepare_raw(priced, bundle))
+        except Exception as e:
+            log.error("scoring_failed", error=str(e))
+
+
+# Annonces sans prédiction (arrivées sans scoring à l'ingestion, ou trop peu nombreuses pour une mise à jour incrémentale du modèle)
+UNSCORED_SQL = """
+    SELECT p.id, p.price::float AS price, p.address, p.surface, p.rooms, p.property_type, p.latitude, p.longitude,
+           p.geo_precision, p.listing_type, p.feature_ids, p.description
+    FROM public.properties p
+    WHERE p.listing_type = ANY(%s)
+      AND NOT EXISTS (SELECT 1 FROM public.price_predictions pr WHERE pr.property_id = p.id)
+      AND NOT EXISTS (SELECT 1 FROM listing_clusters c WHERE c.property_id = p.id AND NOT c.is_canonical)
+"""
+
+# Prédit avec les modèles sauvegardés toutes les annonces qui n'ont pas encore de prédiction, par lots de chunk_size
+def score_unscored(listing_types=("rent", "sale"), chunk_size=2000):
+    scorer = InlineScorer(batch_size=chunk_size, listing_types=listing_types)
+    if not scorer.enabled:
+        return 0
+    connexion = get_connection()
+    if connexion is None:
+        log.error("connection_failed")
+        return 0
+    try:
+        cursor = connexion.cursor(name="unscored_stream")
+        cursor.itersize = chunk_size
+        cursor.execute(UNSCORED_SQL, (list(scorer.bundles),))
+        columns = None
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            columns = columns or [c[0] for c in cursor.description]
+            scorer.score_rows([dict(zip(columns, r)) for r in rows])
+        cursor.close()
+    finally:
+        connexion.close()
+    log.info("unscored_scored", rows=scorer.scored)
+    return scorer.scored
@@ -0,0 +1,54 @@
+import os
+import re
+import joblib
+from pathlib import Path
+
+# Dossier où sont rangés les modèles entraînés (surchargeable via la variable d'env MODELS_DIR)
+MODELS_DIR = Path(os.getenv("MODELS_DIR", Path(__file__).resolve().parent / "saved_models"))
+
+# shard = province pour un modèle spécialisé (ex: rf_sale__ON.joblib), None pour le modèle global
+def model_path(listing_type, shard=None):
+    if shard is None:
+        return MODELS_DIR / f"rf_{listing_type}.joblib"
+    safe = re.sub(r"[^A-Za-z0-9_-]", "_", shard)
+    return MODELS_DIR / f"rf_{listing_type}__{safe}.joblib"
+
+# On sauvegarde le "bundle" du modèle (forêt + colonnes + infos d'imputation) pour pouvoir prédire hors entraînement
+def save_model(listing_type, bundle, shard=None):
+    MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    path = model_path(listing_type, shard)
+    tmp = path.with_suffix(".tmp")
+    joblib.dump(bundle, tmp, compress=3)
+    os.replace(tmp, path) # écriture atomique : un lecteur ne voit jamais un fichier à moitié écrit
+    return path
+
+# Renvoie le dernier bundle sauvegardé pour rent/sale (ou pour une province), None s'il n'a jamais été entraîné
+def load_model(listing_type, shard=None):
+    path = model_path(listing_type, shard)
+    if not path.exists():
+        return None
+    return joblib.load(path)
+
+# Charge tous les modèles par province d'un type d'annonce -> {province: bundle}
+def load_shards(listing_type):
+    shards = {}
+    for path in sorted(MODELS_DIR.glob(f"rf_{listing_type}__*.joblib")):
+        bundle = joblib.load(path)
+        shards[bundle["shard"]] = bundle
+    return shards
+
+# Provinces ayant un shard sauvegardé, d'après les noms de fichiers (sans charger les forêts ; les codes de province n'ont pas de caractère remplacé)
+def shard_provinces(listing_type):
+    prefix = f"rf_{listing_type}__"
+    return sorted(p.name[len(prefix):-len(".joblib")] for p in MODELS_DIR.glob(f"{prefix}*.joblib"))
+
+# Supprime les shards qui ne font plus partie du plan d'entraînement (province passée sous min_rows, run sans --shard-by-province) :
+# sinon le scoring continuerait à router leurs provinces vers un modèle figé
+def remove_stale_shards(listing_type, keep=()):
+    keep = {model_path(listing_type, prov).name for prov in keep}
+    removed = []
+    for path in MODELS_DIR.glob(f"rf_{listing_type}__*.joblib"):
+        if path.name not in keep:
+            path.unlink()
+            removed.append(path.name)
+    return sorted(removed)
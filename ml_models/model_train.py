@@ -1,10 +1,18 @@
 import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_absolute_error
-from ml_models.features import load_data, basic_clean, time_split
-from database.connection import get_connection
-import psycopg2.extras
+from ml_models.features import load_data, prepare_columns, clean_and_fit, basic_clean, time_split
+from ml_models.model_store import save_model
+from ml_models.encoders import CategoricalEncoder, AmenityEncoder
+from ml_models.spatial import SpatialIndex
+from ml_models.text_features import make_text_hasher
+from database.connection import get_connection, execute_batch
+from pipeline.log import get_logger
+from datetime import datetime
+
+log = get_logger("ml_models.model_train")
 
 # On retourne le df numérique propre que la fonction basic_clean (features.py) a d'abord nettoyer
 def make_base(df):
@@ -19,7 +27,55 @@ def make_base(df):
         "surf_per_room": (df["surface_sqm"].astype(float) / rooms_safe).fillna(0.0), # surface de l'appart/maison sur le nombre de pièces
     }).fillna(0)
 
-# Ecrire les predictions dans la base approprié (price_prediction, détail dans le fichier migrations.sql)
+# Colonnes catégorielles encodées (la ville est limitée au top 30, le reste -> Other, comme city_30)
+CAT_COLUMNS = ["province", "city"]
+MAX_CATEGORIES = {"city": 30}
+
+def make_encoder(mode="onehot"):
+    return CategoricalEncoder(CAT_COLUMNS, max_categories=MAX_CATEGORIES, mode=mode)
+
+# Équipements (ids de feature_vocab) : colonnes 0/1 pour les caractéristiques assez fréquentes
+def make_amenity_encoder(min_count=20, max_features=300):
+    return AmenityEncoder(min_count=min_count, max_features=max_features)
+
+# Features de voisinage (prix médian des k plus proches voisins, prix/m2, densité) en bloc creux
+def spatial_block(spatial, df, exclude_self=False):
+    return sparse.csr_matrix(spatial.transform(df, exclude_self=exclude_self).fillna(0).values.astype(np.float32))
+
+# Matrice X finale (creuse) : base numérique + catégories encodées par l'encodeur déjà fitté
+# (+ équipements si un AmenityEncoder est fourni, + texte si un TextHasher est fourni, + voisinage si un index spatial est fourni, toujours dans cet ordre)
+# Texte : colonne description si elle est dans df (scoring à l'ingestion), sinon descriptions lues en base par paquets à partir des ids
+def build_matrix(df, encoder, spatial=None, amenities=None, text=None):
+    blocks = [sparse.csr_matrix(make_base(df).values.astype(np.float32)), encoder.transform(df)]
+    if amenities is not None:
+        feature_ids = df["feature_ids"] if "feature_ids" in df else [None] * len(df)
+        blocks.append(amenities.transform(feature_ids))
+    if text is not None:
+        blocks.append(text.transform(df["description"]) if "description" in df else text.transform_ids(df["id"]))
+    if spatial is not None:
+        # une annonce déjà dans l'index (ajoutée par une mise à jour, rescorée après un changement de prix) n'est pas sa propre voisine
+        blocks.append(spatial_block(spatial, df, exclude_self=spatial.positions(df["id"]) if "id" in df else False))
+    return sparse.hstack(blocks, format="csr")
+
+# Moyenne des prédictions de chaque arbre (sur l'échelle $) + incertitude = std/mean
+def predict_with_confidence(rf, X):
+    Xa = X.values if hasattr(X, "values") else X  # array numpy, sans feature
+    all_log = np.column_stack([est.predict(Xa) for est in rf.estimators_])  # prédictions de chaque arbre individuellement
+    all_pred = np.expm1(all_log) # retour à l’échelle
+
+    preds = all_pred.mean(axis=1) # moyenne arithmétique des prédictions en euros sur tous les arbres (ex : [1980,2020,2050,...] -> 2015 de moyenne sur 200 arbres)
+    rel_std = all_pred.std(axis=1) / (preds + 0.00000001) # écart type (0.00000001 pour éviter de diviser par 0)
+    confs = 1.0 / (1.0 + rel_std) # entre 0 et 1 (plus haut = plus confiant)
+    return preds, confs
+
+# MAE / MAPE (%) sur l'échelle des prix
+def evaluate(y_true, pred):
+    y_true = np.asarray(y_true, dtype=float)
+    mae  = mean_absolute_error(y_true, pred)
+    mape = np.mean(np.abs((y_true - pred) / np.clip(y_true, 0.00000001, None))) * 100
+    return mae, mape
+
+# Ecrire les predictions dans la base approprié (price_prediction, détail dans database/migrations/0001_initial.sql)
 def upsert_predictions(ids, preds, confs):
     connexion = get_connection()
     cursor = connexion.cursor()
@@ -37,32 +93,45 @@ def upsert_predictions(ids, preds, confs):
             created_at = NOW();
     """
     rows = [( int(i), float(p), float(c) ) for i, p, c in zip(ids, preds, confs)]
-    psycopg2.extras.execute_batch(cursor, sql, rows, page_size=1000)
+    execute_batch(cursor, sql, rows, page_size=1000)
     connexion.commit()
     cursor.close()
     connexion.close()
 
-def train_and_write(listing_type):
-    # debug taille
-    df0 = load_data(listing_type)
-    df  = basic_clean(df0)
-    print(f"[{listing_type}] rows raw = {len(df0)} -> après nettoyage = {len(df)}")
-    
-    # 80% seront entrainée sur les annonces les plus anciennes, 20% sont testés sur les annonces les plus récentes 
-    train, test = time_split(df, test_frac=0.2)
-
-    # base numériques
-    base_tr = make_base(train)
-    base_te = make_base(test)
-
-    # One-Hot Encoding (dummies) utilisé ici pour rendre les catégories en variable binaire
-    cats_tr = pd.get_dummies(train[["province", "city_30"]].fillna("NA"))
-    cats_te = pd.get_dummies(test[["province", "city_30"]].fillna("NA"))
-    cats_te = cats_te.reindex(columns=cats_tr.columns, fill_value=0) # meme colonne dans train et test
+# use_spatial : ajoute les features de voisinage (index BallTree fitté sur les annonces d'entraînement uniquement)
+# n_jobs : nb de coeurs pour la forêt (l'orchestrateur training_jobs répartit les CPU entre les modèles lancés en parallèle)
+# province : entraîne un modèle spécialisé sur une seule province (shard), sinon modèle global
+# skip_provinces : provinces déjà couvertes par un shard, le modèle global n'écrit pas leurs prédictions
+# use_text : ajoute les descriptions hachées (text_features.py), text_components : réduction par projection aléatoire (None = espace haché complet)
+# (désactivé par défaut : sur les volumes actuels le texte n'améliore pas la MAE, à réévaluer avec le backtest quand le corpus grandit)
+def train_and_write(listing_type, use_spatial=True, n_jobs=-1, province=None, skip_provinces=None, use_text=False, text_components=64):
+    name = listing_type if province is None else f"{listing_type}/{province}"
+    df0 = prepare_columns(load_data(listing_type))
+
+    # 80% seront entrainée sur les annonces les plus anciennes, 20% sont testés sur les annonces les plus récentes
+    # coupe faite AVANT le nettoyage : médianes de l'imputeur et bornes de prix (1-99%) calculées sur le train seulement,
+    # le test est coupé aux bornes du train (gardées sur l'imputeur)
+    train, test = time_split(df0, test_frac=0.2)
+    train, imputer = clean_and_fit(train)
+    test = basic_clean(test, imputer=imputer)
+    if province is not None:
+        train, test = train[train["province"] == province], test[test["province"] == province]
+    log.info("cleaned", model=name, rows_raw=len(df0), rows_clean=len(train) + len(test))
+
+    # encodages des catégories et des équipements (matrices creuses) fittés sur le train seulement :
+    # les villes / équipements du test ne choisissent pas le top 30 / le vocabulaire retenu
+    encoder = make_encoder().fit(train)
+    amenities = make_amenity_encoder().fit(train["feature_ids"]) if "feature_ids" in train else None
+    text = make_text_hasher(n_components=text_components) if use_text else None
 
     # Matrices finales X(info donnée au modèle) / y(ce qu'il doit prédire (prix)) pour l'algo ML
-    Xtr = pd.concat([base_tr, cats_tr], axis=1)
-    Xte = pd.concat([base_te, cats_te], axis=1)
+    Xtr = build_matrix(train, encoder, amenities=amenities, text=text)
+    Xte = build_matrix(test, encoder, amenities=amenities, text=text)
+    if use_spatial:
+        # l'index ne contient que le train : le test ne voit jamais ses propres prix
+        spatial = SpatialIndex(n_jobs=n_jobs).fit(train)
+        Xtr = sparse.hstack([Xtr, spatial_block(spatial, train, exclude_self=True)], format="csr")
+        Xte = sparse.hstack([Xte, spatial_block(spatial, test)], format="csr")
     ytr, yte = train["price"].astype(float), test["price"].astype(float) # prix réel (cible)
 
     # cible en log (meilleure stabilité sur sale car il y'a de très gros prix)
@@ -73,7 +142,7 @@ def train_and_write(listing_type):
         max_depth=18,
         min_samples_leaf=5,
         max_features="sqrt",
-        n_jobs=-1,
+        n_jobs=n_jobs,
         random_state=42
     )
     # on entraîne le modèle
@@ -81,31 +150,49 @@ def train_and_write(listing_type):
     pred_log = rf.predict(Xte)
     pred = np.expm1(pred_log) # résultats retransformés en prix réels
 
-    mae  = mean_absolute_error(yte, pred)
-    mape = np.mean(np.abs((yte - pred) / np.clip(yte, 0.00000001, None))) * 100
-    print(f"[{listing_type}] n_train={len(train)} n_test={len(test)} && MAE={mae:,.0f} && MAPE={mape:,.1f}%")
-
-    # ré-entraîner sur l'ensemble du dataset
-    base_all = make_base(df)
-    cats_all = pd.get_dummies(df[["province", "city_30"]].fillna("NA"))
-    X_all = pd.concat([base_all, cats_all], axis=1)
-
+    mae, mape = evaluate(yte, pred)
+    log.info("evaluated", model=name, n_train=len(train), n_test=len(test), mae=round(float(mae)), mape=round(float(mape), 1))
+
+    # ré-entraîner sur l'ensemble du dataset (imputeur et encodeurs refittés sur toutes les annonces pour le modèle final)
+    df, imputer = clean_and_fit(df0)
+    if province is not None:
+        df = df[df["province"] == province]
+    df = df.sort_values("scraped_at", kind="stable").reset_index(drop=True)
+    encoder = make_encoder().fit(df)
+    amenities = make_amenity_encoder().fit(df["feature_ids"]) if "feature_ids" in df else None
+    X_all = build_matrix(df, encoder, amenities=amenities, text=text)
+    spatial = None
+    if use_spatial:
+        spatial = SpatialIndex(n_jobs=n_jobs).fit(df)
+        X_all = sparse.hstack([X_all, spatial_block(spatial, df, exclude_self=True)], format="csr")
     rf.fit(X_all, np.log1p(df["price"].astype(float))) # réduit l'effet des énormes prix
 
-    # Moyenne des prédictions de chaque arbre (sur l'échelle $) + incertitude = std/mean
-    Xa = X_all.values  # array numpy, sans feature
-    all_log = np.column_stack([est.predict(Xa) for est in rf.estimators_])  # prédictions de chaque arbre individuellement
-    all_pred = np.expm1(all_log) # retour à l’échelle
-
-    preds_all = all_pred.mean(axis=1) # moyenne arithmétique des prédictions en euros sur tous les arbres (ex : [1980,2020,2050,...] -> 2015 de moyenne sur 200 arbres)
-    rel_std = all_pred.std(axis=1) / (preds_all + 0.00000001) # écart type (0.00000001 pour éviter de diviser par 0)
-    confs = 1.0 / (1.0 + rel_std) # entre 0 et 1 (plus haut = plus confiant)
-
-    # on remplie la db avec les valeurs de confiance, l'id et la prediction
-    upsert_predictions(df["id"].values, preds_all, confs)
-    print(f"[{listing_type}] {len(df)} prédictions écrites dans la db.")
+    preds_all, confs = predict_with_confidence(rf, X_all)
+
+    # on sauvegarde le modèle + ce qu'il faut pour reconstruire les features à l'inférence (scoring à l'ingestion)
+    save_model(listing_type, {
+        "listing_type": listing_type,
+        "shard": province,
+        "model": rf,
+        "encoder": encoder,
+        "amenities": amenities,
+        "text": text,
+        "spatial": spatial,
+        "imputer": imputer,
+        "trained_at": datetime.utcnow(),
+        "data_until": pd.to_datetime(df["updated_at"]).fillna(pd.to_datetime(df["scraped_at"])).max(), # les mises à jour incrémentales repartent de là
+        "incremental_updates": 0,
+        "n_rows": len(df),
+    }, shard=province)
+
+    # on remplie la db avec les valeurs de confiance, l'id et la prediction (sauf pour les provinces gérées par un shard)
+    mask = ~df["province"].isin(skip_provinces or []).values
+    upsert_predictions(df["id"].values[mask], preds_all[mask], confs[mask])
+    log.info("predictions_written", model=name, rows=int(mask.sum()))
+    return {"listing_type": listing_type, "shard": province, "n_rows": len(df), "mae": float(mae), "mape": float(mape)}
 
 
 if __name__ == "__main__":
-    train_and_write("rent")
-    train_and_write("sale")
+    # rent et sale entraînés en parallèle (voir training_jobs.py pour le découpage par province)
+    from ml_models.training_jobs import run_training_jobs
+    run_training_jobs(("rent", "sale"))
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+from ml_models.features import prepare_columns
+from ml_models.model_train import build_matrix, predict_with_confidence
+
+# On prépare des annonces brutes (mêmes colonnes que load_data) comme à l'entraînement : colonnes dérivées + imputation figée du modèle
+def prepare_raw(raw, bundle):
+    df = raw.copy()
+    for col in ("surface", "rooms", "latitude", "longitude"):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    return bundle["imputer"].transform(prepare_columns(df))
+
+# On reconstruit la matrice X attendue par le modèle sauvegardé
+def build_features(raw, bundle):
+    # l'encodeur sauvegardé garantit les mêmes colonnes qu'à l'entraînement (ville inconnue -> Other)
+    return build_matrix(prepare_raw(raw, bundle), bundle["encoder"], bundle.get("spatial"), bundle.get("amenities"), bundle.get("text"))
+
+# Prédit le prix et la confiance d'annonces brutes, les lignes toujours sans coordonnées GPS après imputation sont ignorées (comme dans basic_clean)
+def score_frame(raw, bundle):
+    df = prepare_raw(raw, bundle)
+    df = df[df["latitude"].notna() & df["longitude"].notna()]
+    if df.empty:
+        return df["id"].values, np.array([]), np.array([])
+    X = build_matrix(df, bundle["encoder"], bundle.get("spatial"), bundle.get("amenities"), bundle.get("text"))
+    preds, confs = predict_with_confidence(bundle["model"], X)
+    return df["id"].values, preds, confs
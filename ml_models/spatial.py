@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.neighbors import BallTree
+from sklearn.metrics.pairwise import haversine_distances
+from data_processing.geocoder import is_centroid
+
+EARTH_RADIUS_KM = 6371.0
+SPATIAL_COLUMNS = ["knn_median_price", "knn_median_ppsqm", "density"]
+
+# Index géographique (BallTree haversine) sur les annonces : pour chaque bien on calcule le prix médian des k plus proches voisins,
+# le prix/m2 médian de ces voisins et le nombre d'annonces dans un rayon donné -> O(n log n) au lieu d'une comparaison n²
+# Les nouvelles annonces (add) sont gardées dans un petit tampon interrogé en brute force, l'arbre est reconstruit quand le tampon devient trop gros
+class SpatialIndex:
+    def __init__(self, k=10, radius_km=1.0, leaf_size=40, rebuild_frac=0.1, chunk_size=20000, n_jobs=-1):
+        self.k = k
+        self.radius_km = radius_km
+        self.leaf_size = leaf_size
+        self.rebuild_frac = rebuild_frac
+        self.chunk_size = chunk_size
+        self.n_jobs = n_jobs
+        self.tree_ = None
+
+    @staticmethod
+    def _radians(df):
+        return np.radians(np.column_stack([
+            pd.to_numeric(df["latitude"], errors="coerce").to_numpy(dtype=float),
+            pd.to_numeric(df["longitude"], errors="coerce").to_numpy(dtype=float),
+        ]))
+
+    @staticmethod
+    def _values(df):
+        price = pd.to_numeric(df["price"], errors="coerce").to_numpy(dtype=float)
+        surface = pd.to_numeric(df["surface_sqm"], errors="coerce").to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ppsqm = np.where(surface > 0, price / surface, np.nan)
+        return price, ppsqm
+
+    @staticmethod
+    def _ids(df):
+        if "id" not in df:
+            return np.full(len(df), -1, dtype=np.int64)
+        return pd.to_numeric(df["id"], errors="coerce").fillna(-1).to_numpy(dtype=np.int64)
+
+    # Centroïdes du gazetier (geo_precision renseignée) : interrogent l'index mais n'y entrent pas,
+    # sinon toutes les annonces d'une ville partageraient le même point et se retrouveraient voisines à distance nulle
+    @staticmethod
+    def _indexable(df):
+        if "geo_precision" not in df:
+            return np.ones(len(df), dtype=bool)
+        return ~is_centroid(df["geo_precision"])
+
+    # df : annonces nettoyées (latitude, longitude, price, surface_sqm, id si disponible)
+    def fit(self, df):
+        coords = self._radians(df)
+        ok = np.isfinite(coords).all(axis=1) & self._indexable(df)
+        price, ppsqm = self._values(df)
+        self.coords_, self.price_, self.ppsqm_ = coords[ok], price[ok], ppsqm[ok]
+        self.id_pos_ = {i: k for k, i in enumerate(self._ids(df)[ok]) if i >= 0} # id d'annonce -> position dans l'index
+        self._build()
+        return self
+
+    def _build(self):
+        self.tree_ = BallTree(self.coords_, leaf_size=self.leaf_size, metric="haversine")
+        self.n_indexed_ = len(self.coords_) # les points au-delà de n_indexed_ sont dans le tampon (pas encore dans l'arbre)
+
+    # Ajout incrémental de nouvelles annonces (ex: au fil du scraping)
+    # une annonce déjà indexée (même id, ex: changement de prix) est mise à jour sur place au lieu d'être ajoutée en double
+    def add(self, df):
+        coords = self._radians(df)
+        ids = self._ids(df)
+        pos = self.positions(ids)
+        price, ppsqm = self._values(df)
+        known = pos >= 0
+        self.price_[pos[known]], self.ppsqm_[pos[known]] = price[known], ppsqm[known]
+        last = ~pd.Series(ids).duplicated(keep="last").to_numpy() | (ids < 0) # même annonce deux fois dans le lot : la dernière compte
+        ok = np.isfinite(coords).all(axis=1) & self._indexable(df) & ~known & last
+        if hasattr(self, "id_pos_"):
+            self.id_pos_.update((i, len(self.coords_) + k) for k, i in enumerate(ids[ok]) if i >= 0)
+        self.coords_ = np.vstack([self.coords_, coords[ok]])
+        self.price_ = np.concatenate([self.price_, price[ok]])
+        self.ppsqm_ = np.concatenate([self.ppsqm_, ppsqm[ok]])
+        if len(self.coords_) - self.n_indexed_ > self.rebuild_frac * max(self.n_indexed_, 1):
+            self._build()
+        return self
+
+    # Positions dans l'index des annonces d'ids donnés (-1 = pas dans l'index, ou index sauvegardé avant le suivi des ids)
+    def positions(self, ids):
+        id_pos = getattr(self, "id_pos_", {})
+        return np.array([id_pos.get(int(i), -1) for i in ids], dtype=np.int64)
+
+    def _query_chunk(self, coords, self_pos):
+        extra = 1 if self_pos is not None else 0
+        k = min(self.k + extra, self.n_indexed_)
+        dist, idx = self.tree_.query(coords, k=k)
+        radius = self.radius_km / EARTH_RADIUS_KM
+        density = self.tree_.query_radius(coords, r=radius, count_only=True).astype(float)
+
+        # tampon des annonces ajoutées depuis la dernière construction de l'arbre : brute force (petit)
+        if len(self.coords_) > self.n_indexed_:
+            pending = self.coords_[self.n_indexed_:]
+            d_pend = haversine_distances(coords, pending)
+            density += (d_pend <= radius).sum(axis=1)
+            dist = np.hstack([dist, d_pend])
+            idx = np.hstack([idx, np.arange(self.n_indexed_, len(self.coords_))[None, :].repeat(len(coords), axis=0)])
+            order = np.argsort(dist, axis=1)[:, :k]
+            dist = np.take_along_axis(dist, order, axis=1)
+            idx = np.take_along_axis(idx, order, axis=1)
+
+        # à l'entraînement, l'annonce fait partie de l'index : on l'enlève de ses propres voisins (sinon fuite de la cible)
+        if self_pos is not None:
+            is_self = idx == self_pos[:, None]
+            drop = np.where(is_self.any(axis=1), is_self.argmax(axis=1), idx.shape[1] - 1)
+            keep = np.ones_like(idx, dtype=bool)
+            keep[np.arange(len(idx)), drop] = False
+            idx = idx[keep].reshape(len(idx), -1)
+            density -= self_pos >= 0
+
+        with np.errstate(all="ignore"):
+            return np.column_stack([
+                np.nanmedian(self.price_[idx], axis=1),
+                np.nanmedian(self.ppsqm_[idx], axis=1),
+                density,
+            ])
+
+    # Renvoie un DataFrame (SPATIAL_COLUMNS) aligné sur df ; exclude_self=True quand df est exactement le df passé à fit(),
+    # ou tableau des positions de chaque ligne de df dans l'index (positions(), -1 = absente) pour des annonces ajoutées ensuite
+    def transform(self, df, exclude_self=False):
+        if self.tree_ is None:
+            raise RuntimeError("SpatialIndex non fitté, appeler fit() d'abord")
+        coords = self._radians(df)
+        out = np.full((len(df), len(SPATIAL_COLUMNS)), np.nan)
+        ok = np.isfinite(coords).all(axis=1)
+        positions = np.flatnonzero(ok)
+        if exclude_self is True:
+            indexed = ok & self._indexable(df) # mêmes lignes que dans fit(), les centroïdes n'ont pas de position
+            self_pos = np.where(indexed, np.cumsum(indexed) - 1, -1)[ok]
+        elif exclude_self is False or exclude_self is None:
+            self_pos = None
+        else:
+            self_pos = np.asarray(exclude_self, dtype=np.int64)[ok]
+
+        # calcul par morceaux, en parallèle (threads : l'arbre est partagé, pas recopié)
+        bounds = range(0, len(positions), self.chunk_size)
+        results = Parallel(n_jobs=self.n_jobs, prefer="threads")(
+            delayed(self._query_chunk)(
+                coords[positions[s:s + self.chunk_size]],
+                None if self_pos is None else self_pos[s:s + self.chunk_size],
+            )
+            for s in bounds
+        )
+        if results:
+            out[positions] = np.vstack(results)
+        return pd.DataFrame(out, columns=SPATIAL_COLUMNS, index=df.index)
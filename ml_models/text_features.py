@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.random_projection import SparseRandomProjection
+from database.connection import get_connection
+from database.snapshots import snapshot_enabled
+from pipeline.log import get_logger
+
+log = get_logger("ml_models.text_features")
+
+# Features texte des descriptions d'annonces : les mots et bigrammes sont hachés dans un espace de taille fixe (HashingVectorizer),
+# aucun vocabulaire n'est gardé en mémoire -> même encodeur quelle que soit la taille du corpus, rien à apprendre au fit.
+# Les descriptions sont lues par paquets depuis un curseur nommé (jamais toutes en mémoire), seule la matrice creuse hachée est gardée.
+# n_components : réduction optionnelle par projection aléatoire creuse (matrice de projection tirée une fois, sauvegardée avec le modèle)
+TEXT_FEATURES = 2 ** 15
+CHUNK_SIZE = 5000
+
+class TextHasher:
+    def __init__(self, n_features=TEXT_FEATURES, ngram_range=(1, 2), n_components=None, chunk_size=CHUNK_SIZE, random_state=42):
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.n_components = n_components
+        self.chunk_size = chunk_size
+        self.random_state = random_state
+        self.projection_ = None
+
+    def _vectorizer(self):
+        return HashingVectorizer(
+            n_features=self.n_features,
+            ngram_range=self.ngram_range,
+            strip_accents="unicode",
+            alternate_sign=False,
+            norm="l2",
+            dtype=np.float32,
+        )
+
+    # Seule la projection (si demandée) a besoin d'être tirée : elle ne dépend que de la largeur de l'espace haché
+    def fit(self, texts=None):
+        if self.n_components is not None:
+            self.projection_ = SparseRandomProjection(n_components=self.n_components, dense_output=True, random_state=self.random_state)
+            self.projection_.fit(sparse.csr_matrix((1, self.n_features), dtype=np.float32))
+        return self
+
+    # Textes -> matrice CSR (n, n_output), traités par paquets de chunk_size (descriptions vides/None -> ligne vide)
+    def transform(self, texts):
+        texts = ["" if t is None or (isinstance(t, float) and np.isnan(t)) else str(t) for t in texts]
+        if not texts:
+            return sparse.csr_matrix((0, self.n_output), dtype=np.float32)
+        return sparse.vstack([self._transform_chunk(texts[i:i + self.chunk_size]) for i in range(0, len(texts), self.chunk_size)], format="csr")
+
+    def _transform_chunk(self, texts):
+        X = self._vectorizer().transform(texts)
+        if self.projection_ is not None:
+            X = sparse.csr_matrix(self.projection_.transform(X).astype(np.float32))
+        return X
+
+    # Même matrice que transform, mais les descriptions des annonces ids sont lues en base par paquets (lignes dans l'ordre de ids)
+    def transform_ids(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        found, blocks = [], []
+        for chunk_ids, texts in stream_descriptions(ids, self.chunk_size):
+            found.append(chunk_ids)
+            blocks.append(self._transform_chunk(texts))
+        if not blocks:
+            return sparse.csr_matrix((len(ids), self.n_output), dtype=np.float32)
+        X = sparse.vstack(blocks + [sparse.csr_matrix((1, self.n_output), dtype=np.float32)], format="csr") # dernière ligne vide : annonces sans description
+        pos = pd.Index(np.concatenate(found)).get_indexer(ids)
+        pos[pos < 0] = X.shape[0] - 1
+        return X[pos]
+
+    @property
+    def n_output(self):
+        return self.n_components if self.projection_ is not None else self.n_features
+
+    @property
+    def feature_names_(self):
+        prefix = "text_proj" if self.projection_ is not None else "text_hash"
+        return [f"{prefix}_{i}" for i in range(self.n_output)]
+
+# Descriptions des annonces ids, par paquets de chunk_size lignes : (ids du paquet, textes) dans l'ordre d'arrivée du curseur
+def stream_descriptions(ids, chunk_size=CHUNK_SIZE):
+    connexion = get_connection()
+    if connexion is None:
+        log.error("connection_failed")
+        return
+    try:
+        cursor = connexion.cursor(name="description_stream") # curseur nommé : les lignes restent côté serveur
+        cursor.itersize = chunk_size
+        cursor.execute("SELECT id, description FROM public.properties WHERE id = ANY(%s) AND description IS NOT NULL", ([int(i) for i in ids],))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)), [r[1] for r in rows]
+        cursor.close()
+    finally:
+        connexion.close()
+
+# Encodeur texte pour l'entraînement, None si les descriptions ne sont pas accessibles (instantané Parquet : pas de description)
+def make_text_hasher(n_features=TEXT_FEATURES, n_components=None):
+    if snapshot_enabled():
+        log.warning("text_disabled", reason="DATA_SOURCE=snapshot : descriptions absentes de l'instantané, modèle entraîné sans features texte")
+        return None
+    return TextHasher(n_features=n_features, n_components=n_components).fit()
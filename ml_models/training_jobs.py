@@ -0,0 +1,72 @@
+import os
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ml_models.features import list_provinces
+from ml_models.model_train import train_and_write
+from ml_models.model_store import remove_stale_shards
+from database.aggregates import refresh_aggregates
+from database.deals import refresh_deal_scores
+from pipeline.log import get_logger
+
+log = get_logger("ml_models.training_jobs")
+
+# Liste des entraînements indépendants : un modèle global par type d'annonce (+ un modèle par province si shard_by_province)
+def plan_jobs(listing_types=("rent", "sale"), shard_by_province=False, min_shard_rows=500):
+    jobs = []
+    for lt in listing_types:
+        provinces = list_provinces(lt, min_rows=min_shard_rows) if shard_by_province else []
+        # le modèle global reste le fallback (provinces sans shard), il n'écrit pas les prédictions des provinces shardées
+        jobs.append({"listing_type": lt, "province": None, "skip_provinces": provinces})
+        for prov in provinces:
+            jobs.append({"listing_type": lt, "province": prov, "skip_provinces": None})
+    return jobs
+
+def _run_job(job, n_jobs, text_options):
+    start = time.time()
+    result = train_and_write(job["listing_type"], n_jobs=n_jobs, province=job["province"], skip_provinces=job["skip_provinces"], **text_options)
+    result["seconds"] = time.time() - start
+    return result
+
+# Lance les entraînements en parallèle dans des process séparés, avec un partage équitable des CPU
+# (chaque forêt reçoit cpu_count // nb_process coeurs au lieu que chacune prenne n_jobs=-1)
+# use_text / text_components : features texte des descriptions (voir train_and_write)
+def run_training_jobs(listing_types=("rent", "sale"), shard_by_province=False, min_shard_rows=500, max_workers=None, use_text=False, text_components=64):
+    jobs = plan_jobs(listing_types, shard_by_province, min_shard_rows)
+    for lt in listing_types:
+        removed = remove_stale_shards(lt, keep=[j["province"] for j in jobs if j["listing_type"] == lt and j["province"] is not None])
+        if removed:
+            log.info("stale_shards_removed", listing_type=lt, shards=removed)
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(max_workers or len(jobs), len(jobs), cpus))
+    n_jobs = max(1, cpus // workers)
+    log.info("train_started", models=len(jobs), processes=workers, n_jobs=n_jobs)
+
+    results = []
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        text_options = {"use_text": use_text, "text_components": text_components}
+        futures = {ex.submit(_run_job, job, n_jobs, text_options): job for job in jobs}
+        for f in as_completed(futures):
+            job = futures[f]
+            try:
+                results.append(f.result())
+            except Exception as e:
+                log.error("train_failed", listing_type=job["listing_type"], shard=job["province"], error=str(e))
+    log.info("train_done", seconds=round(time.time() - start))
+    refresh_deal_scores(sorted({r["listing_type"] for r in results}))
+    refresh_aggregates()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Entraînement parallèle des modèles rent/sale")
+    parser.add_argument("--listing-types", nargs="+", default=["rent", "sale"])
+    parser.add_argument("--shard-by-province", action="store_true", help="un modèle par province (en plus du modèle global)")
+    parser.add_argument("--min-shard-rows", type=int, default=500)
+    parser.add_argument("--max-workers", type=int, default=None)
+    parser.add_argument("--text-features", action="store_true", help="ajoute les descriptions hachées au modèle")
+    parser.add_argument("--text-components", type=int, default=64, help="dimension après projection aléatoire (0 = espace haché complet)")
+    args = parser.parse_args()
+    run_training_jobs(args.listing_types, args.shard_by_province, args.min_shard_rows, args.max_workers,
+                      args.text_features, args.text_components or None)
@@ -0,0 +1,4 @@
+import sys
+from pipeline.orchestrator import main
+
+sys.exit(main())
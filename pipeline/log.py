@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import multiprocessing.util
+from collections import deque
+from datetime import datetime, timezone
+
+# Journal structuré non bloquant pour les chemins chauds (scraper multi-thread, écritures en base, scoring à l'ingestion).
+# L'appelant ne fait qu'un test de niveau et un append dans une deque (atomique, sans verrou) : un seul thread écrivain
+# formate les lignes JSON et les écrit par paquets (un write + un flush par paquet au lieu d'un print(flush=True) par ligne sous le verrou de stdout).
+# Les avertissements / erreurs répétés sont limités par (module, événement, clé) : RATE_LIMIT lignes par fenêtre de RATE_WINDOW
+# secondes, puis une seule ligne de synthèse {"suppressed": n} en fin de fenêtre (ex: clé = hôte pour les erreurs réseau).
+#   log = get_logger("scrapers.c21")
+#   log.error("fetch_failed", key=host, url=url, error=str(e))
+# LOG_LEVEL (debug/info/warning/error, défaut info), LOG_FILE (défaut : stderr), LOG_RATE_LIMIT, LOG_RATE_WINDOW
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {v: k for k, v in LEVELS.items()}
+
+LEVEL = LEVELS.get(os.getenv("LOG_LEVEL", "info").lower(), INFO)
+RATE_LIMIT = int(os.getenv("LOG_RATE_LIMIT", "5"))
+RATE_WINDOW = float(os.getenv("LOG_RATE_WINDOW", "60"))
+QUEUE_SIZE = 100000 # file pleine : la ligne est perdue (et comptée) plutôt que de bloquer le scraper
+BATCH_SIZE = 5000 # lignes lues au plus par passage (écriture régulière même si la file ne se vide jamais)
+FLUSH_INTERVAL = 0.2 # secondes entre deux passages de l'écrivain quand la file est vide
+
+_STOP = "stop"
+_FLUSH = "flush"
+_queue = deque()
+_lock = threading.Lock()
+_writer = None
+_dropped = 0 # incrément non verrouillé : approximatif sous forte contention, suffisant pour un compteur de pertes
+
+class Logger:
+    def __init__(self, name):
+        self.name = name
+
+    def log(self, level, event, **fields):
+        global _dropped
+        if level < LEVEL:
+            return
+        if _writer is None:
+            _ensure_writer()
+        if len(_queue) >= QUEUE_SIZE:
+            _dropped += 1
+            return
+        _queue.append((time.time(), level, self.name, event, fields))
+
+    def debug(self, event, **fields):
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event, **fields):
+        self.log(INFO, event, **fields)
+
+    def warning(self, event, **fields):
+        self.log(WARNING, event, **fields)
+
+    def error(self, event, **fields):
+        self.log(ERROR, event, **fields)
+
+_loggers = {}
+
+def get_logger(name):
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers.setdefault(name, Logger(name))
+    return logger
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None:
+        return
+    with _lock:
+        if _writer is None:
+            _writer = _Writer()
+            _writer.start()
+            atexit.register(shutdown)
+            # les process workers (ProcessPoolExecutor) sortent par os._exit sans passer par atexit, mais exécutent les finaliseurs
+            multiprocessing.util.Finalize(None, shutdown, exitpriority=0)
+
+# Process enfant (fork, ex: ProcessPoolExecutor de l'entraînement / du backtest) : le thread écrivain n'existe pas dans l'enfant,
+# on repart d'une file vide et d'un écrivain à recréer au premier log (sinon les lignes s'accumuleraient sans jamais être écrites)
+def _after_fork():
+    global _writer, _lock, _queue, _dropped
+    _writer, _lock, _queue, _dropped = None, threading.Lock(), deque(), 0
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+# Thread écrivain : vide la file par paquets, applique la limitation de débit, écrit les lignes JSON
+class _Writer(threading.Thread):
+    def __init__(self):
+        super().__init__(name="log-writer", daemon=True)
+        path = os.getenv("LOG_FILE")
+        self.out = open(path, "a", encoding="utf-8", buffering=1 << 16) if path else sys.stderr
+        self.windows = {} # (module, événement, clé) -> [début de fenêtre, lignes émises, lignes supprimées, niveau]
+        self.dropped = 0
+
+    # Vide la file par paquets (jusqu'à un marqueur d'arrêt), écrit les lignes en un seul write, puis dort si la file est vide
+    def run(self):
+        while True:
+            lines, waiting, stop = [], [], False
+            now = time.time()
+            for _ in range(BATCH_SIZE):
+                try:
+                    item = _queue.popleft()
+                except IndexError:
+                    break
+                if item[0] == _FLUSH:
+                    waiting.append(item[1])
+                elif item[0] == _STOP:
+                    waiting.append(item[1])
+                    stop = True
+                    break
+                else:
+                    lines += self._accept(item, now)
+            lines += self._sweep(now, final=stop)
+            if lines:
+                self.out.write("".join(lines))
+                self.out.flush()
+            for done in waiting:
+                done.set()
+            if stop:
+                return
+            if not _queue: # file vide : on dort ; sinon (paquet plein, ou lignes toutes supprimées par la limitation) on enchaîne
+                time.sleep(FLUSH_INTERVAL)
+
+    def _accept(self, item, now):
+        ts, level, name, event, fields = item
+        if level < WARNING:
+            return [_format(ts, level, name, event, fields)]
+        k = (name, event, fields.get("key"))
+        w = self.windows.get(k)
+        if w is None or now - w[0] >= RATE_WINDOW:
+            out = [_summary(k, w)] if w is not None and w[2] else []
+            self.windows[k] = [now, 1, 0, level]
+            return out + [_format(ts, level, name, event, fields)]
+        if w[1] < RATE_LIMIT:
+            w[1] += 1
+            return [_format(ts, level, name, event, fields)]
+        w[2] += 1
+        return []
+
+    # Fenêtres terminées : une ligne de synthèse si des lignes ont été supprimées ; perte de lignes (file pleine) signalée
+    def _sweep(self, now, final=False):
+        out = []
+        for k, w in list(self.windows.items()):
+            if final or now - w[0] >= RATE_WINDOW:
+                if w[2]:
+                    out.append(_summary(k, w))
+                del self.windows[k]
+        if _dropped > self.dropped:
+            out.append(_format(now, WARNING, "pipeline.log", "queue_full", {"dropped": _dropped - self.dropped}))
+            self.dropped = _dropped
+        return out
+
+def _format(ts, level, name, event, fields):
+    record = {"ts": datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds"),
+              "level": LEVEL_NAMES.get(level, str(level)), "logger": name, "event": event}
+    record.update(fields)
+    return json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
+def _summary(k, w):
+    name, event, key = k
+    fields = {"suppressed": w[2], "window_s": RATE_WINDOW}
+    if key is not None:
+        fields["key"] = key
+    return _format(time.time(), w[3], name, event, fields)
+
+def _wait(marker, timeout=5):
+    done = threading.Event()
+    _queue.append((marker, done))
+    return done.wait(timeout)
+
+# Attend que toutes les lignes déjà déposées soient écrites
+def flush():
+    if _writer is not None and _writer.is_alive():
+        _wait(_FLUSH)
+
+# Arrêt propre (enregistré avec atexit) : synthèses des fenêtres en cours écrites, fichier fermé
+def shutdown():
+    global _writer
+    writer = _writer
+    if writer is None or not writer.is_alive():
+        return
+    _wait(_STOP)
+    writer.join(timeout=5)
+    if writer.out is not sys.stderr:
+        writer.out.close()
+    _writer = None
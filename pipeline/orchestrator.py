@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from database.connection import get_connection
+from pipeline.log import get_logger
+
+# Orchestrateur de la chaîne complète : crawl (fetch + parse + load, faits annonce par annonce dans le scraper) -> géocodage ->
+# dédoublonnage -> entraînement rent / sale -> scoring des annonces sans prédiction -> bonnes affaires, et agrégats du dashboard.
+# Les étapes forment un graphe de dépendances : une étape démarre dès que ses dépendances sont terminées, les étapes
+# indépendantes tournent en parallèle (agrégats pendant géocodage / dédoublonnage / entraînement, rent et sale ensemble).
+# Chaque étape a un watermark (état de ses entrées : max id, nb de lignes, dernier changement de prix...) : si il est identique
+# à celui de sa dernière exécution réussie, l'étape est sautée. Durées, statuts et watermarks sont gardés dans pipeline_runs
+# (migrations/0011_pipeline_runs.sql). Le dashboard n'a pas à être relancé : ses caches sont indexés sur data_version().
+#   python -m pipeline                       (run nocturne : seul le travail demandé par les nouvelles données est fait)
+#   python -m pipeline --skip crawl --force train_rent train_sale
+log = get_logger("pipeline")
+
+LISTING_TYPES = ("rent", "sale")
+EXCLUDE_DUPLICATES = "NOT EXISTS (SELECT 1 FROM listing_clusters c WHERE c.property_id = p.id AND NOT c.is_canonical)"
+
+# --- watermarks : une requête d'agrégats indexés par étape (None = l'étape tourne toujours) ---
+def _query_watermark(cursor, q, params=None):
+    cursor.execute(q, params)
+    return [v if v is None or isinstance(v, (int, float, str)) else str(v) for v in cursor.fetchone()]
+
+def _models_mtime(listing_type):
+    from ml_models.model_store import MODELS_DIR
+    paths = sorted(MODELS_DIR.glob(f"rf_{listing_type}*.joblib"))
+    return [[p.name, int(p.stat().st_mtime)] for p in paths]
+
+def wm_properties(cursor, options):
+    return (_query_watermark(cursor, "SELECT MAX(id), COUNT(*), MAX(scraped_at), MAX(updated_at) FROM public.properties") # updated_at : repricing
+            + _query_watermark(cursor, "SELECT MAX(changed_at) FROM listing_state")) # annonces fermées / rouvertes
+
+def wm_geocode(cursor, options):
+    from data_processing.geocoder import GAZETTEER_PATH
+    data = _query_watermark(cursor, """
+        SELECT MAX(id), COUNT(*) FROM public.properties WHERE (latitude IS NULL OR longitude IS NULL) AND address IS NOT NULL
+    """)
+    return data + [int(GAZETTEER_PATH.stat().st_mtime) if GAZETTEER_PATH.exists() else None]
+
+def wm_train(listing_type):
+    def watermark(cursor, options):
+        data = _query_watermark(cursor, f"""
+            SELECT MAX(p.id), COUNT(*), MAX(s.changed_at)
+            FROM public.properties p
+            LEFT JOIN listing_state s ON s.property_id = p.id
+            WHERE p.listing_type = %s AND p.price IS NOT NULL AND {EXCLUDE_DUPLICATES}
+        """, (listing_type,))
+        return data + [options["train_mode"]]
+    return watermark
+
+def wm_score(cursor, options):
+    data = _query_watermark(cursor, f"""
+        SELECT MAX(p.id), COUNT(*) FROM public.properties p
+        WHERE NOT EXISTS (SELECT 1 FROM public.price_predictions pr WHERE pr.property_id = p.id) AND {EXCLUDE_DUPLICATES}
+    """)
+    return data + [_models_mtime(lt) for lt in LISTING_TYPES]
+
+def wm_deals(cursor, options):
+    return (_query_watermark(cursor, "SELECT COUNT(*), MAX(created_at) FROM public.price_predictions")
+            + _query_watermark(cursor, "SELECT COUNT(*), MAX(updated_at) FROM listing_clusters")
+            + _query_watermark(cursor, "SELECT MAX(changed_at) FROM listing_state"))
+
+# --- étapes ---
+def run_crawl(options):
+    from scrapers.c21 import C21Scraper
+    from database.models import ensure_partitions
+    from database.history import close_unseen_listings
+    ensure_partitions() # partitions mensuelles de properties prêtes pour les annonces du mois
+    scraper = C21Scraper()
+    crawl_started_at = datetime.utcnow()
+    saved = scraper.scrape_c21(limit=options["limit"], workers=options["workers"], score=options["score_on_ingest"])
+    closed = None
+    # seul un parcours complet du sitemap permet de conclure qu'une annonce absente a été retirée
+    if saved > 0 and scraper.sitemap_complete:
+        closed = close_unseen_listings(scraper.name, scraper.listed_urls, crawl_started_at)
+    else:
+        print("Parcours du sitemap partiel (limite atteinte ou sitemap illisible) : aucune annonce fermée")
+    return {"saved": saved, "closed": closed}
+
+def run_geocode(options):
+    from data_processing.geocoder import backfill_coordinates
+    return {"geocoded": backfill_coordinates()}
+
+def run_dedup_stage(options):
+    from database.dedup import run_dedup
+    stats = run_dedup()
+    if stats is None:
+        raise RuntimeError("dédoublonnage en échec")
+    return stats
+
+def run_train(listing_type):
+    def run(options):
+        from ml_models.model_store import shard_provinces
+        n_jobs = max(1, (os.cpu_count() or 1) // len(LISTING_TYPES)) # rent et sale s'entraînent en même temps
+        # les shards existants sont mis à jour aussi (sinon leurs provinces resteraient sur un modèle figé),
+        # et le modèle global n'écrase pas leurs prédictions
+        shards = shard_provinces(listing_type)
+        if options["train_mode"] == "full":
+            from ml_models.model_train import train_and_write
+            return {"model": train_and_write(listing_type, n_jobs=n_jobs, skip_provinces=shards),
+                    "shards": [train_and_write(listing_type, n_jobs=n_jobs, province=prov) for prov in shards]}
+        from ml_models.incremental import update_forest # refait un entraînement complet quand il le faut (pas de modèle, dérive)
+        return {"model": update_forest(listing_type, n_jobs=n_jobs),
+                "shards": [update_forest(listing_type, n_jobs=n_jobs, shard=prov) for prov in shards]}
+    return run
+
+def run_score(options):
+    from ml_models.inline_scoring import score_unscored
+    return {"scored": score_unscored(LISTING_TYPES)}
+
+def run_deals(options):
+    from database.deals import refresh_deal_scores
+    return {"ranked": refresh_deal_scores()}
+
+def run_aggregates(options):
+    from database.aggregates import refresh_aggregates
+    return {"listing_types": refresh_aggregates()}
+
+# nom -> (dépendances, watermark, exécution) ; l'ordre du dict est l'ordre d'affichage
+STAGES = {
+    "crawl": ((), None, run_crawl),
+    "geocode": (("crawl",), wm_geocode, run_geocode),
+    "dedup": (("geocode",), wm_properties, run_dedup_stage),
+    "train_rent": (("dedup",), wm_train("rent"), run_train("rent")),
+    "train_sale": (("dedup",), wm_train("sale"), run_train("sale")),
+    "score": (("train_rent", "train_sale"), wm_score, run_score),
+    "deals": (("score",), wm_deals, run_deals),
+    "aggregates": (("geocode", "dedup"), wm_properties, run_aggregates), # après géocodage (updated_at) et dédoublonnage (listing_clusters)
+}
+
+# --- état persistant ---
+# pipeline_runs absente (base pas encore migrée, --dry-run) : aucun run connu, tout est à exécuter
+def _last_watermarks(cursor):
+    try:
+        cursor.execute("""
+            SELECT stage, watermark FROM (
+                SELECT stage, watermark, ROW_NUMBER() OVER (PARTITION BY stage ORDER BY started_at DESC, id DESC) AS rn
+                FROM pipeline_runs WHERE status = 'ok'
+            ) r WHERE rn = 1
+        """)
+    except Exception as e:
+        log.warning("no_pipeline_runs", error=str(e))
+        return {}
+    return dict(cursor.fetchall())
+
+def _watermark(stage, options):
+    fn = STAGES[stage][1]
+    if fn is None:
+        return None
+    connexion = get_connection()
+    try:
+        cursor = connexion.cursor()
+        value = json.dumps(fn(cursor, options), default=str)
+        cursor.close()
+        return value
+    finally:
+        connexion.close()
+
+def _record(run_id, stage, status, watermark, detail, started_at, seconds):
+    connexion = get_connection()
+    if connexion is None:
+        log.error("record_failed", stage=stage)
+        return
+    try:
+        cursor = connexion.cursor()
+        cursor.execute("""
+            INSERT INTO pipeline_runs(run_id, stage, status, watermark, detail, started_at, duration_s)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (run_id, stage, status, watermark, json.dumps(detail, default=str) if detail is not None else None, started_at, seconds))
+        connexion.commit()
+        cursor.close()
+    finally:
+        connexion.close()
+
+# Étape exécutée dans un thread : watermark relevé avant l'exécution et comparé au dernier run réussi, puis enregistré tel quel :
+# une donnée arrivée pendant l'étape change le watermark et sera traitée au run suivant. Une étape qui modifie ses propres
+# entrées (géocodage, scoring) repasse donc une fois à vide après un run utile, puis reste à jour.
+def _run_stage(run_id, stage, options, last, force):
+    started_at = datetime.utcnow()
+    start = time.time()
+    before = None
+    try:
+        before = _watermark(stage, options)
+        if not force and before is not None and before == last.get(stage):
+            status, detail = "skipped", None
+        else:
+            detail = STAGES[stage][2](options)
+            status = "ok"
+    except Exception as e:
+        status, detail = "failed", {"error": str(e)}
+        log.error("stage_failed", stage=stage, error=str(e))
+    seconds = time.time() - start
+    _record(run_id, stage, status, before if status != "failed" else None, detail, started_at, seconds)
+    log.info("stage_done", run_id=run_id, stage=stage, status=status, seconds=round(seconds, 3))
+    return status, seconds
+
+# Exécute le graphe : stages = étapes demandées (les autres sont considérées à jour), force = étapes relancées même sans changement
+def run_pipeline(stages=None, force=(), options=None, max_parallel=4, dry_run=False):
+    from database.models import run_migrations
+    options = {"limit": 300000, "workers": 24, "score_on_ingest": False, "train_mode": "incremental", **(options or {})}
+    selected = [s for s in STAGES if stages is None or s in stages]
+    force = set(STAGES) if force == "all" else set(force)
+
+    if not dry_run: # --dry-run n'affiche que le plan : schéma laissé tel quel
+        run_migrations() # pipeline_runs (et le reste du schéma) à jour
+    connexion = get_connection()
+    if connexion is None:
+        print("erreur")
+        return {}
+    cursor = connexion.cursor()
+    last = _last_watermarks(cursor)
+    cursor.close()
+    connexion.close()
+
+    if dry_run:
+        for s in selected:
+            try:
+                wm = _watermark(s, options)
+            except Exception: # table pas encore créée (migrations non appliquées) : l'étape est à exécuter
+                wm = None
+            state = "forcée" if s in force else ("à jour" if wm is not None and wm == last.get(s) else "à exécuter")
+            print(f"{s:<12} {state}  (dépend de : {', '.join(STAGES[s][0]) or '-'})")
+        return {}
+
+    run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    print(f"[PIPELINE] run {run_id} : {', '.join(selected)}", flush=True)
+    results, pending, running = {}, list(selected), {}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max_parallel) as ex:
+        while pending or running:
+            for s in list(pending):
+                deps = [d for d in STAGES[s][0] if d in selected]
+                if any(results.get(d, (None,))[0] in ("failed", "blocked") for d in deps):
+                    pending.remove(s)
+                    results[s] = ("blocked", 0.0)
+                    _record(run_id, s, "blocked", None, None, datetime.utcnow(), 0.0)
+                elif all(d in results for d in deps):
+                    pending.remove(s)
+                    running[ex.submit(_run_stage, run_id, s, options, last, s in force)] = s
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for f in done:
+                results[running.pop(f)] = f.result()
+
+    print(f"[PIPELINE] run {run_id} terminé en {time.time() - start:,.1f}s", flush=True)
+    for s in selected:
+        status, seconds = results[s]
+        print(f"  {s:<12} {status:<8} {seconds:8.2f}s", flush=True)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Orchestrateur : crawl -> géocodage -> dédoublonnage -> entraînement -> scoring -> bonnes affaires / agrégats")
+    parser.add_argument("--only", nargs="+", choices=list(STAGES), default=None, help="étapes à exécuter (par défaut toutes)")
+    parser.add_argument("--skip", nargs="+", choices=list(STAGES), default=[], help="étapes à ne pas exécuter")
+    parser.add_argument("--force", nargs="*", choices=list(STAGES), default=None, help="relance ces étapes même sans nouvelles données (sans nom : toutes)")
+    parser.add_argument("--limit", type=int, default=300000, help="nb max d'URLs d'annonces lues dans le sitemap")
+    parser.add_argument("--workers", type=int, default=24, help="threads du scraper")
+    parser.add_argument("--score-on-ingest", action="store_true", default=os.getenv("SCORE_ON_INGEST") == "1",
+                        help="prédit les annonces pendant le scraping (SCORE_ON_INGEST=1)")
+    parser.add_argument("--full-train", action="store_true", help="réentraîne entièrement au lieu de la mise à jour incrémentale")
+    parser.add_argument("--max-parallel", type=int, default=4, help="étapes exécutées en même temps")
+    parser.add_argument("--dry-run", action="store_true", help="affiche les étapes à exécuter / à jour sans rien lancer")
+    args = parser.parse_args(argv)
+
+    stages = [s for s in (args.only or STAGES) if s not in args.skip]
+    force = "all" if args.force == [] else (args.force or ())
+    options = {"limit": args.limit, "workers": args.workers, "score_on_ingest": args.score_on_ingest,
+               "train_mode": "full" if args.full_train else "incremental"}
+    results = run_pipeline(stages, force=force, options=options, max_parallel=args.max_parallel, dry_run=args.dry_run)
+    return 1 if any(status == "failed" for status, _ in results.values()) else 0
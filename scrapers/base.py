@@ -7,6 +7,10 @@ from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
 import time
+from urllib.parse import urlparse
+from pipeline.log import get_logger
+
+log = get_logger("scrapers")
 
 class BaseScraper:
     def __init__(self, name, url):
@@ -32,7 +36,7 @@ class BaseScraper:
             time.sleep(self.delay)
             return html
         except Exception as e:
-            print(f"error{url} -> {e}", flush=True)
+            log.error("fetch_failed", key=urlparse(url).netloc, url=url, error=str(e)) # limité par hôte
             return None
         
     # Si XML (sitemap), parse en XML, sinon HTML
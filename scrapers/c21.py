@@ -2,12 +2,19 @@ import json
 import re
 from bs4 import BeautifulSoup
 from scrapers.base import BaseScraper
-from database.models import save_property
+from database.history import record_listing
+from database.feature_vocab import encode_features
 from data_processing.price_extractor import extract_price
+from data_processing.geocoder import locate
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import time, random
 from database.connection import get_connection
+from ml_models.inline_scoring import InlineScorer
+from database.deals import refresh_deal_scores
+from pipeline.log import get_logger
+
+log = get_logger("scrapers.c21")
 
 
 SQFT_TO_M2 = 0.09290304  # 1 sqft = 0.09290304 m2
@@ -120,6 +127,8 @@ class C21Scraper(BaseScraper):
     def __init__(self):
         super().__init__(name="c21", url="https://www.c21.ca")
         self.delay = 0.8
+        self.sitemap_complete = False # dernier parcours : index et tous les sitemaps d'annonces lus, limite non atteinte
+        self.listed_urls = set() # dernier parcours : URLs publiées dans le sitemap + URLs enregistrées des annonces lues
 
     # Récupère une page XML et la parse en XML
     def _get_xml_soup(self, url):
@@ -129,8 +138,10 @@ class C21Scraper(BaseScraper):
         return BeautifulSoup(html, "xml")
 
     # On parcourt cet adresse (https://www.c21.ca/sitemap.xml) à la recherche d'annonce intéressante pour renvoyer une liste d'URL d'annonce
+    # self.sitemap_complete n'est vrai que si l'index et chaque sitemap d'annonces ont été lus sans atteindre la limite
     def iter_listing_urls_from_sitemap(self, limit=50):
         urls, seen = [], set()
+        self.sitemap_complete = False
 
         index_url = f"{self.url}/sitemap.xml"
         index_soup = self._get_xml_soup(index_url)
@@ -148,10 +159,12 @@ class C21Scraper(BaseScraper):
 
         listing_sitemaps.sort()  # du plus ancien au plus récent
 
+        complete = True
         for sm_url in listing_sitemaps:
-            print(f"[SITEMAP] {sm_url}", flush=True)
+            log.info("sitemap", url=sm_url)
             sm_soup = self._get_xml_soup(sm_url)
             if not sm_soup:
+                complete = False # sitemap illisible : ses annonces ne sont pas listées, le parcours est partiel
                 continue
 
             for loc_tag in sm_soup.find_all("loc"):
@@ -163,10 +176,11 @@ class C21Scraper(BaseScraper):
                 seen.add(page_url)
                 urls.append(page_url)
                 if len(urls) >= limit:
-                    print(f"[SITEMAP] {len(urls)} URLs trouvées (limite atteinte)", flush=True)
+                    log.info("sitemap_done", urls=len(urls), limit_reached=True)
                     return urls
 
-        print(f"[SITEMAP] {len(urls)} URLs trouvées", flush=True)
+        self.sitemap_complete = complete
+        log.info("sitemap_done", urls=len(urls), limit_reached=False, complete=complete)
         return urls # Une liste d'URL d'annonce trouvée correspondant aux filtres appliqués
 
     # On cherche le script 'var Wx = {...}' qui contient tout les détails de l'annonce (prix,descriptions,titre,adresse etc)
@@ -294,7 +308,7 @@ class C21Scraper(BaseScraper):
 
         except Exception as e:
             # pour ne pas faire planter le programme en cas d'échec
-            print(f"[WX][parse][ERR] {e}", flush=True)
+            log.warning("wx_parse_failed", error=str(e))
             return {}
 
 
@@ -486,11 +500,14 @@ class C21Scraper(BaseScraper):
         return data
 
     # Fonction qui orchètre toutes les fonctions de ce fichier, il cherche les annonces, normalise les valeurs, sauvegarde les détails de l'annonce dans la db
-    def scrape_c21(self, limit=300000, workers=24):
+    # score=True : les annonces sont aussi prédites au fil de l'eau avec les derniers modèles sauvegardés (price_predictions à jour sans relancer l'entraînement)
+    def scrape_c21(self, limit=300000, workers=24, score=False):
         urls = self.iter_listing_urls_from_sitemap(limit=limit) # Liste d'URL intéréssante
         print(f"URLs listées: {len(urls)}", flush=True)
+        self.listed_urls = set(urls)
 
         saved = 0
+        scorer = InlineScorer() if score else None
 
         def _scrape_one(u):
             try:
@@ -498,14 +515,19 @@ class C21Scraper(BaseScraper):
                 if not soup:
                     return 0
                 prop = self.extract_property_data(soup, page_url=u) # prop = {"titre":xxx "prix":25000.0 etc}
+                prop["geo_precision"] = None # coordonnées de l'annonce
+                if prop["latitude"] is None or prop["longitude"] is None: # ni Wx ni iframe : centroïde du code postal / de la ville
+                    prop["latitude"], prop["longitude"], prop["geo_precision"] = locate(prop["adresse"])
 
                 # type rent/sale
                 prop["listing_type"] = infer_listing_type(
                     prop.get("titre"), prop.get("description"), prop.get("url"), price=prop.get("prix")
                 )
 
-                # insert
-                save_property(
+                prop["feature_ids"] = encode_features(prop.get("features", [])) # ids du vocabulaire (aussi utilisés par le scoring)
+
+                # 1re apparition -> ligne complète, sinon seuls l'état courant et les changements de prix sont écrits
+                property_id, change = record_listing(
                     title=prop["titre"],
                     price=prop["prix"],
                     address=prop["adresse"],
@@ -516,15 +538,20 @@ class C21Scraper(BaseScraper):
                     longitude=prop["longitude"],
                     description=prop["description"],
                     features=prop.get("features", []),
+                    feature_ids=prop["feature_ids"],
+                    geo_precision=prop["geo_precision"],
                     source=self.name,
                     url=prop["url"],
                     listing_type=prop.get("listing_type"),
                     scraped_at=datetime.utcnow(),
                 )
+                self.listed_urls.add(prop["url"]) # URL enregistrée (celle de la page peut différer de celle du sitemap)
+                if scorer is not None and change in ("new", "price"):
+                    scorer.add(property_id, prop)
                 time.sleep(0.1 + random.random() * 0.3)
                 return 1
             except Exception as e:
-                print(f"error scrapping {u}: {e}", flush=True)
+                log.error("scrape_failed", key=self.name, url=u, error=str(e))
                 return 0
 
         # On fait fonctionner des threads pour scrapper des centaines d'annonces rapidement, ça permet de paralléliser le travail
@@ -534,5 +561,10 @@ class C21Scraper(BaseScraper):
                 saved += f.result()
 
         print(f"{saved}/{len(urls)} annonces C21 sauvegardées.", flush=True)
+        if scorer is not None:
+            print(f"{scorer.flush()} annonces C21 prédites à l'ingestion.", flush=True)
+            # la carte et le top des bonnes affaires lisent deal_scores, pas price_predictions
+            if scorer.scored_types:
+                refresh_deal_scores(sorted(scorer.scored_types))
         return saved
 
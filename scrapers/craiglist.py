@@ -1,6 +1,11 @@
+from datetime import datetime
 from scrapers.base import BaseScraper
-from database.models import save_property
+from database.history import record_listing
 from data_processing.price_extractor import extract_price
+from data_processing.geocoder import locate
+from pipeline.log import get_logger
+
+log = get_logger("scrapers.craigslist")
 
 class CraigslistParisScraper(BaseScraper):
     cities = [
@@ -20,6 +25,9 @@ class CraigslistParisScraper(BaseScraper):
         "bangkok.craigslist.org",
         "delhi.craigslist.org"
     ]
+    # sites canadiens -> province : le gazetier (data_processing/geocoder.py) ne couvre que le Canada,
+    # les annonces des autres sites restent sans coordonnées plutôt que d'être placées sur une ville canadienne homonyme
+    canadian_sites = {"toronto": "ON"}
 
     def __init__(self, city_index=0):
         city_host = self.cities[city_index]
@@ -84,26 +92,32 @@ class CraigslistParisScraper(BaseScraper):
                 prop["prix"] = extract_price(prop["prix"]) # €1 100 ----> 1100
             
             saved_count = 0
+            city = self.name.split("_", 1)[1] # craigslist_toronto -> toronto (la "location" est souvent un quartier)
             for prop in properties:
                 try:
-                    save_property(
+                    province = self.canadian_sites.get(city)
+                    latitude, longitude, precision = locate(prop["adresse"], default_city=city, default_province=province) if province else (None, None, None)
+                    # section "apa" (apartments / housing for rent) : que des locations
+                    property_id, _ = record_listing(
                         title=prop["titre"],
                         price=prop["prix"],
                         address=prop["adresse"],
                         surface=None,
                         rooms=None,
                         property_type="appartement",
-                        latitude=None,
-                        longitude=None,
+                        latitude=latitude,
+                        longitude=longitude,
+                        geo_precision=precision,
                         description=None,
                         features=[],
                         source=self.name,
                         url=prop["url"],
-                        scraped_at="2025-08-09"
+                        listing_type="rent",
+                        scraped_at=datetime.utcnow(),
                     )
-                    saved_count += 1
+                    saved_count += property_id is not None
                 except Exception as e:
-                    print(f"Erreur sauvegarde : {e}")
+                    log.error("save_failed", key=self.name, url=prop.get("url"), error=str(e))
             
             print(f"{saved_count}/{len(properties)} annonces sauvegardées")
             return properties